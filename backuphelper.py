@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - privileged volume backup helper daemon
+# © 2021 Johannes Kreutz.
+
+# Runs as root and accepts backup jobs on a unix socket, so the server manager neither needs sudo nor a new
+# process for every volume. Every connection carries one job:
+# - the client sends the job as a single json line, see modules/backupjob.py
+# - the helper answers with json lines: {"type":"progress","files":<n>,"bytes":<n>} while the job runs, followed by
+#   {"type":"result","stats":{...}}, {"type":"error","message":<text>} or {"type":"cancelled"}
+# - the client cancels the job by sending {"type":"cancel"} or by closing the connection
+# Jobs of different connections run concurrently.
+
+# Include dependencies
+import grp
+import json
+import os
+import socket
+import socketserver
+import threading
+
+# Include modules
+import config
+import modules.backupjob as backupjob
+from modules.jobcontrol import jobControl, jobCancelled
+
+# Handles a single job connection
+class jobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.__writeLock = threading.Lock()
+        self.__control = jobControl(self.__sendProgress, config.backupprogressinterval)
+        try:
+            job = json.loads(self.rfile.readline())
+        except ValueError:
+            self.__send({"type":"error","message":"Invalid job."})
+            return
+        if not isinstance(job, dict):
+            self.__send({"type":"error","message":"Invalid job."})
+            return
+        watcher = threading.Thread(target=self.__watch, daemon=True)
+        watcher.start()
+        try:
+            stats = backupjob.runJob(job, self.__control)
+            self.__sendProgress(self.__control.get())
+            self.__send({"type":"result","stats":stats})
+        except jobCancelled:
+            self.__send({"type":"cancelled"})
+        except (ValueError, OSError) as e:
+            self.__send({"type":"error","message":str(e)})
+        finally:
+            # The connection is closed after handle returns, so the watcher has to stop reading first
+            try:
+                self.request.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+            watcher.join()
+
+    # Cancels the job when the client asks for it or goes away
+    def __watch(self):
+        try:
+            for line in self.rfile:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(message, dict) and message.get("type") == "cancel":
+                    break
+        except (OSError, ValueError):
+            pass
+        self.__control.cancel()
+
+    # Forwards the progress of the job
+    def __sendProgress(self, counters):
+        self.__send({"type":"progress","files":counters["files"],"bytes":counters["bytes"]})
+
+    # Writes a message to the client, a lost client cancels the job
+    def __send(self, message):
+        try:
+            with self.__writeLock:
+                self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except OSError:
+            self.__control.cancel()
+
+# Socket server running every connection on its own thread
+class helperServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+# Main logic
+if os.path.exists(config.backupsocket):
+    os.remove(config.backupsocket)
+os.makedirs(os.path.dirname(config.backupsocket), exist_ok=True)
+# Nobody may connect before the socket got its final permissions
+umask = os.umask(0o077)
+server = helperServer(config.backupsocket, jobHandler)
+os.umask(umask)
+# Only root and the server manager group may connect
+os.chown(config.backupsocket, 0, grp.getgrnam(config.backupsocketgroup).gr_gid)
+os.chmod(config.backupsocket, 0o660)
+server.serve_forever()
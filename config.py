@@ -14,3 +14,60 @@ managerpath = "/usr/local/bin/servermanager/"
 backuppath = "/var/lib/servermanager/"
 apitokenfile = "apitoken"
 licensefile = "licensefile"
+
+# repository
+repositoryrefresh = 300
+repositorytimeout = 10
+# seconds until an empty repository, e.g. after a first start without network, is loaded again
+repositoryretry = 30
+# seconds a download may stall before it fails
+downloadtimeout = 60
+
+# persistence
+configwritedelay = 0.5
+configretrydelay = 5
+
+# startup
+startupworkers = 8
+
+# image and container building
+buildworkers = 4
+pulllimit = 3
+buildlimit = 2
+
+# docker connections, quick requests share a pool big enough for the startup and build threads, pulls and builds have their own
+dockerpoolsize = startupworkers + buildworkers
+dockertimeout = 60
+dockerlongtimeout = 1800
+
+# artifact cache
+artifactcachesize = 2 * 1024 * 1024 * 1024
+
+# volume backups, a limit of 0 means unlimited
+backupvolumeworkers = 2
+backupfileworkers = 4
+backupbytespersecond = 0
+backupiops = 0
+backupretention = 3
+backupcompression = "zlib"
+backupsocket = "/run/servermanager/backup.sock"
+backupsocketgroup = "servermanager"
+backupprogressinterval = 0.5
+# copy: back up volumes into folders and copy them back on revert, swap: snapshot volumes into new docker volumes and switch to them on revert
+backupmode = "copy"
+
+# trash folder, removed folders are moved here and deleted in the background
+trashpath = "/var/lib/servermanager/trash/"
+
+# jobs, the number of service operations running at the same time, the number of finished jobs kept and the longest time in seconds a request waits for its job
+jobworkers = 4
+jobhistory = 100
+jobwaittimeout = 10
+
+# events, the number of events kept for clients catching up, the progress publishing interval and the longest wait of a client in seconds
+eventhistory = 1000
+eventprogressinterval = 1
+eventtimeout = 30
+
+# status, the number of threads building the status entries of changed services
+statusworkers = 4
@@ -11,6 +11,7 @@ fi
 
 # Stop service
 systemctl stop servermanager
+systemctl stop servermanager-backup
 
 # Delete all docker stuff
 su servermanager -c "python3 /usr/local/bin/servermanager/dockerdelete.py yes"
@@ -23,5 +24,7 @@ rm -R /etc/netplan/40-servermanager-loopback.yaml
 netplan generate
 netplan apply
 systemctl disable servermanager
+systemctl disable servermanager-backup
 rm /etc/systemd/system/servermanager.service
+rm /etc/systemd/system/servermanager-backup.service
 deluser servermanager
@@ -172,6 +172,7 @@ mkdir /etc/servermanager
 mkdir /var/lib/servermanager
 mkdir /var/lib/servermanager/services
 mkdir /var/lib/servermanager/services/buildcache
+mkdir /var/lib/servermanager/trash
 
 # Install python modules for servermanager user
 #su servermanager -c "pip3 install docker"
@@ -183,12 +184,40 @@ chown -R servermanager:servermanager /var/lib/servermanager
 chown -R servermanager:servermanager /usr/local/bin/servermanager
 chown root:root /usr/local/bin/servermanager/volumebackup.py
 chmod 755 /usr/local/bin/servermanager/volumebackup.py
+chown root:root /usr/local/bin/servermanager/backuphelper.py
+chmod 755 /usr/local/bin/servermanager/backuphelper.py
+
+# Install a systemd init script for the privileged backup helper, it restarts together with the server manager
+cat > /etc/systemd/system/servermanager-backup.service <<EOF
+[Unit]
+Description=SchoolConnect Server Manager Backup Helper
+After=syslog.target
+PartOf=servermanager.service
+
+[Service]
+Type=simple
+User=root
+Group=root
+WorkingDirectory=/usr/local/bin/servermanager
+RuntimeDirectory=servermanager
+RuntimeDirectoryMode=0755
+ExecStart=/usr/local/bin/servermanager/backuphelper.py
+SyslogIdentifier=servermanager-backup
+StandardOutput=syslog
+StandardError=syslog
+Restart=always
+RestartSec=5
+
+[Install]
+WantedBy=multi-user.target
+EOF
 
 # Install a systemd init script for the server manager
 cat > /etc/systemd/system/servermanager.service <<EOF
 [Unit]
 Description=SchoolConnect Server Manager
-After=syslog.target
+After=syslog.target servermanager-backup.service
+Wants=servermanager-backup.service
 
 [Service]
 Type=simple
@@ -246,6 +275,8 @@ netplan generate
 netplan apply
 
 # Start the server manager via systemd
+systemctl enable servermanager-backup
+systemctl start servermanager-backup
 systemctl enable servermanager
 systemctl start servermanager
 
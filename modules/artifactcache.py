@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - content-addressed cache for downloaded artifacts
+# © 2021 Johannes Kreutz.
+
+# Cache layout below config.backuppath + "artifacts/":
+# index.json: maps urls to the sha256 of their content, their kind, size, last use and the ETag and Last-Modified of the response
+# objects/<sha256>: downloaded single files
+# trees/<sha256>/: extracted archives, published with an atomic rename
+# tmp/: downloads and extractions in progress
+# Cached artifacts are served right away for a known sha256. The content behind a url without checksum can change, so
+# it is revalidated with a conditional request and only downloaded again if the server reports a change, or if it sent
+# no validators. Identical content is stored only once.
+
+# Include dependencies
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Include modules
+import config
+import modules.filesystem as fs
+import modules.essentials as ess
+from modules.download import download, notModified
+
+# Shared instance
+sharedCache = None
+sharedLock = threading.Lock()
+
+# Returns the process-wide artifact cache
+def getArtifactCache():
+    global sharedCache
+    with sharedLock:
+        if sharedCache is None:
+            sharedCache = artifactCache(config.backuppath + "artifacts/", config.artifactcachesize)
+        return sharedCache
+
+# Returns the only directory inside the given extracted tree, or False if there is not exactly one
+def getSingleSubdir(path):
+    dirs = [filename for filename in os.listdir(path) if os.path.isdir(path + "/" + filename)]
+    if len(dirs) != 1:
+        return False
+    return path + "/" + dirs[0]
+
+# Class definition
+class artifactCache:
+    def __init__(self, path, maxSize):
+        self.__path = path
+        self.__maxSize = maxSize
+        self.__lock = threading.Lock()
+        self.__urlLocks = {}
+        self.__pins = {}
+        for folder in ["objects", "trees", "tmp"]:
+            os.makedirs(self.__path + folder, exist_ok=True)
+        # Leftovers of interrupted downloads are never valid
+        for filename in os.listdir(self.__path + "tmp"):
+            fs.filesystem.removeElement(self.__path + "tmp/" + filename)
+        self.__index = {}
+        if os.path.exists(self.__path + "index.json"):
+            try:
+                with open(self.__path + "index.json", "r") as f:
+                    self.__index = json.loads(f.read())
+            except ValueError:
+                self.__index = {}
+
+    # Provides the cached single file for the given url, downloading it if necessary. Usage: with cache.file(url) as path
+    @contextmanager
+    def file(self, url, sha256 = None, progressObject = None):
+        path = self.__acquire(url, sha256, "file", progressObject)
+        try:
+            yield path
+        finally:
+            self.__release(path)
+
+    # Provides the extracted tree of the archive at the given url, downloading it if necessary. Usage: with cache.tree(url) as path
+    @contextmanager
+    def tree(self, url, sha256 = None, progressObject = None):
+        path = self.__acquire(url, sha256, "tree", progressObject)
+        try:
+            yield path
+        finally:
+            self.__release(path)
+
+    # Returns the total size of all cached artifacts in bytes
+    def getSize(self):
+        with self.__lock:
+            return sum(entry["size"] for entry in self.__uniqueEntries().values())
+
+    # PRIVATE HELPER FUNCTIONS
+    # Returns the path of a valid cached artifact, fetching it on a miss, and pins it against eviction
+    def __acquire(self, url, sha256, kind, progressObject):
+        with self.__lock:
+            urlLock = self.__urlLocks.setdefault(url, threading.Lock())
+        # Only one download per url at a time, concurrent requesters wait and then hit the cache
+        with urlLock:
+            with self.__lock:
+                path = self.__lookup(url, sha256, kind)
+                if path is not None:
+                    self.__pin(path)
+                    return path
+                # A copy without checksum stays pinned while it is revalidated
+                cachedPath, validators = self.__lookupUnverified(url, sha256, kind)
+                if cachedPath is not None:
+                    self.__pin(cachedPath)
+            revalidated = False
+            try:
+                digest, path, size = self.__fetch(url, kind, sha256, validators, progressObject)
+            except notModified:
+                # The server confirmed the cached copy, it stays pinned for the caller
+                revalidated = True
+                return cachedPath
+            finally:
+                if cachedPath is not None and not revalidated:
+                    self.__release(cachedPath)
+            with self.__lock:
+                target = self.__path + ("objects/" if kind == "file" else "trees/") + digest
+                if os.path.exists(target):
+                    # Identical content is already published, possibly under another url
+                    fs.filesystem.removeElement(path)
+                else:
+                    os.rename(path, target)
+                self.__index[url] = {"sha256":digest,"kind":kind,"size":size,"lastUsed":time.time(),"etag":validators["etag"],"lastModified":validators["lastModified"]}
+                self.__pin(target)
+                if cachedPath is not None and cachedPath != target:
+                    self.__removeUnreferenced(cachedPath)
+                self.__evict()
+                self.__storeIndex()
+                return target
+
+    # Returns the path of a cached artifact for the url if it matches the expected checksum, updating its last use
+    def __lookup(self, url, sha256, kind):
+        entry = self.__index.get(url)
+        if sha256 is None or entry is None or entry["sha256"] != sha256:
+            return None
+        return self.__use(url, kind)
+
+    # Returns the path and the cache validators of a cached artifact for a url without checksum, the path is None if
+    # there is no copy which can be revalidated
+    def __lookupUnverified(self, url, sha256, kind):
+        validators = {"etag":None,"lastModified":None}
+        entry = self.__index.get(url)
+        if sha256 is not None or entry is None or (entry.get("etag") is None and entry.get("lastModified") is None):
+            return None, validators
+        path = self.__use(url, kind)
+        if path is not None:
+            validators = {"etag":entry.get("etag"),"lastModified":entry.get("lastModified")}
+        return path, validators
+
+    # Returns the path of the indexed artifact of the url if it still exists and updates its last use, None otherwise
+    def __use(self, url, kind):
+        entry = self.__index[url]
+        path = self.__path + ("objects/" if kind == "file" else "trees/") + entry["sha256"]
+        if entry["kind"] != kind:
+            return None
+        if not os.path.exists(path):
+            del self.__index[url]
+            return None
+        entry["lastUsed"] = time.time()
+        self.__storeIndex()
+        return path
+
+    # Streams the url into the temporary folder, unpacking archives on the fly and verifying the checksum. Returns the
+    # sha256, temporary path and size and fills in the validators of the response. Raises notModified if they still match
+    def __fetch(self, url, kind, sha256, validators, progressObject):
+        tmpPath = self.__path + "tmp/" + ess.essentials.randomString(16)
+        if kind == "file":
+            digest = download.toFile(url, tmpPath, sha256, progressObject, validators)
+            return digest, tmpPath, os.path.getsize(tmpPath)
+        digest = download.extractTo(url, tmpPath, sha256, 0, progressObject, validators)
+        return digest, tmpPath, self.__treeSize(tmpPath)
+
+    # Returns the summed size of all files in a tree
+    def __treeSize(self, path):
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for filename in files:
+                size += os.lstat(os.path.join(root, filename)).st_size
+        return size
+
+    # Pins an artifact which is in use
+    def __pin(self, path):
+        self.__pins[path] = self.__pins.get(path, 0) + 1
+
+    # Unpins an artifact when it is not used anymore
+    def __release(self, path):
+        with self.__lock:
+            self.__pins[path] -= 1
+            if self.__pins[path] == 0:
+                del self.__pins[path]
+
+    # Returns the index entries by artifact path, one entry per stored artifact
+    def __uniqueEntries(self):
+        entries = {}
+        for url, entry in self.__index.items():
+            path = self.__path + ("objects/" if entry["kind"] == "file" else "trees/") + entry["sha256"]
+            if not path in entries or entries[path]["lastUsed"] < entry["lastUsed"]:
+                entries[path] = entry
+        return entries
+
+    # Removes an artifact which has been replaced by changed content, unless another url still uses it or it is in use
+    def __removeUnreferenced(self, path):
+        if path in self.__pins or path in self.__uniqueEntries():
+            return
+        fs.filesystem.removeElement(path)
+
+    # Removes the least recently used artifacts which are not in use until the cache fits its size limit
+    def __evict(self):
+        entries = self.__uniqueEntries()
+        total = sum(entry["size"] for entry in entries.values())
+        for path, entry in sorted(entries.items(), key=lambda item: item[1]["lastUsed"]):
+            if total <= self.__maxSize:
+                break
+            if path in self.__pins:
+                continue
+            fs.filesystem.removeElement(path)
+            total -= entry["size"]
+            for url in [url for url, other in self.__index.items() if other["sha256"] == entry["sha256"] and other["kind"] == entry["kind"]]:
+                del self.__index[url]
+
+    # Persists the index
+    def __storeIndex(self):
+        fs.filesystem.writeAtomic(self.__path + "index.json", json.dumps(self.__index))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - client of the privileged backup helper
+# © 2021 Johannes Kreutz.
+
+# Include dependencies
+import json
+import socket
+import threading
+from subprocess import Popen, PIPE
+
+# Include modules
+import config
+
+# Class definition
+class backupJob:
+    def __init__(self, job, progressObject = None):
+        # The job dict is described in modules/backupjob.py, progressObject is a download.progress counting processed bytes
+        self.__job = job
+        self.__progress = progressObject
+        self.__lock = threading.Lock()
+        self.__cancelled = False
+        self.__socket = None
+        self.__process = None
+        self.__reported = 0
+
+    # Runs the job on the backup helper and returns its statistics. Falls back to sudo if the helper is not running
+    def run(self):
+        try:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(config.backupsocket)
+        except OSError:
+            return self.__runScript()
+        with self.__lock:
+            self.__socket = connection
+            cancelled = self.__cancelled
+        try:
+            connection.sendall((json.dumps(self.__job) + "\n").encode("utf-8"))
+            if cancelled:
+                self.__sendCancel()
+            with connection.makefile("r", encoding="utf-8") as reader:
+                for line in reader:
+                    message = json.loads(line)
+                    if message["type"] == "progress":
+                        self.__addProgress(message["bytes"])
+                    elif message["type"] == "result":
+                        return message["stats"]
+                    elif message["type"] == "cancelled":
+                        print("Backup job " + self.__job["action"] + " was cancelled.")
+                        return {}
+                    elif message["type"] == "error":
+                        print("Backup job " + self.__job["action"] + " failed: " + message["message"])
+                        return {}
+        except (OSError, ValueError, KeyError):
+            print("Lost connection to the backup helper.")
+        finally:
+            with self.__lock:
+                self.__socket = None
+            connection.close()
+        return {}
+
+    # Asks the running job to stop, a job which did not start yet is cancelled right after it started
+    def cancel(self):
+        with self.__lock:
+            self.__cancelled = True
+            if self.__process is not None:
+                self.__process.terminate()
+        self.__sendCancel()
+
+    # PRIVATE HELPER FUNCTIONS
+    # Sends the cancel message to the helper
+    def __sendCancel(self):
+        with self.__lock:
+            try:
+                if self.__socket is not None:
+                    self.__socket.sendall((json.dumps({"type":"cancel"}) + "\n").encode("utf-8"))
+            except OSError:
+                pass
+
+    # Adds the bytes processed since the last progress message
+    def __addProgress(self, bytes):
+        if self.__progress is not None:
+            self.__progress.add(bytes - self.__reported)
+        self.__reported = bytes
+
+    # Runs the job with a separate sudo process of volumebackup.py, which reports no progress
+    def __runScript(self):
+        job = self.__job
+        if job["action"] == "delete":
+            args = [job["path"], "delete"]
+        elif job["action"] == "backup":
+            args = [job["path"], job["volume"]]
+        elif job["action"] == "restore":
+            args = [job["path"], job["volume"], "restore"]
+        elif job["action"] == "clone":
+            args = [job["volume"], job["target"], "clone"]
+        elif job["action"] == "archive":
+            args = [job["path"], job["volume"], "archive", job["version"]]
+        elif job["action"] == "versions":
+            args = [job["volume"], "versions"]
+        else:
+            args = [job["version"], job["volume"], "restorearchive"]
+        for key in ["repository", "keep", "rate", "iops", "workers"]:
+            if key in job:
+                args.append("--" + key + "=" + str(job[key]))
+        with self.__lock:
+            if self.__cancelled:
+                return {}
+            self.__process = Popen(["sudo", "/usr/local/bin/servermanager/volumebackup.py"] + args, stdout=PIPE, universal_newlines=True)
+        output, _ = self.__process.communicate()
+        lines = output.strip().splitlines()
+        try:
+            return json.loads(lines[-1]) if len(lines) > 0 else {}
+        except ValueError:
+            return {}
+
+# Deletes a backup folder with the privileges of the backup helper
+def deleteBackup(path):
+    backupJob({"action":"delete","path":path}).run()
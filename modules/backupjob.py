@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - privileged volume backup jobs
+# © 2021 Johannes Kreutz.
+
+# A job is a dict with an action and its parameters, used by the backup helper daemon and by volumebackup.py:
+# {"action":"backup","volume":<name>,"path":<destination>}: incremental snapshot of a volume
+# {"action":"restore","volume":<name>,"path":<snapshot>}: replace the volume content with a snapshot
+# {"action":"delete","path":<snapshot>}: delete a snapshot
+# {"action":"archive","volume":<name>,"path":<snapshot>,"version":<version>,"repository":<path>,"keep":<n>}: store a snapshot in the deduplicating repository
+# {"action":"restorearchive","volume":<name>,"version":<version>,"repository":<path>}: replace the volume content with a stored version
+# {"action":"versions","volume":<name>,"repository":<path>}: list the stored versions of a volume, oldest first
+# {"action":"clone","volume":<name>,"target":<name>}: replace the content of the target volume with a copy of the volume
+# Backup, restore, clone and archive jobs accept "rate", "iops" and "workers" to limit their disk usage.
+
+# Include dependencies
+import os
+import re
+
+# Include modules
+import config
+from modules.volumesnapshot import volumeSnapshot
+from modules.throttle import throttle
+from modules.chunkstore import chunkStore
+from modules.jobcontrol import jobControl
+
+# Folder holding the docker volumes, jobs never write into it except for the volume they restore
+volumeRoot = "/var/lib/docker/volumes/"
+
+# Allowed volume names and versions, they become part of paths
+namePattern = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9_.+-]*$")
+
+# Returns the validated string parameter of a job
+def getName(job, key):
+    value = job.get(key)
+    if not isinstance(value, str) or namePattern.match(value) is None or ".." in value:
+        raise ValueError("Invalid " + key + ".")
+    return value
+
+# Returns the validated path parameter of a job, which must not point into the docker volumes
+def getPath(job, key):
+    value = job.get(key)
+    if not isinstance(value, str) or not value.startswith("/"):
+        raise ValueError("Invalid " + key + ".")
+    if volumeRoot in value or (os.path.realpath(value) + "/").startswith(volumeRoot):
+        raise ValueError("Paths in the docker volumes are not allowed.")
+    return value
+
+# Returns a numeric parameter of a job
+def getNumber(job, key, default):
+    value = job.get(key, default)
+    return value if isinstance(value, int) and value >= 0 else default
+
+# Runs a job and returns its statistics. Raises ValueError for invalid jobs and jobCancelled if the control cancels it
+def runJob(job, control = None):
+    control = jobControl() if control is None else control
+    action = job.get("action")
+    limiter = throttle(getNumber(job, "rate", 0), getNumber(job, "iops", 0))
+    workers = getNumber(job, "workers", config.backupfileworkers)
+    if action == "delete":
+        volumeSnapshot.delete(getPath(job, "path"))
+        return {}
+    volume = getName(job, "volume")
+    if action == "backup":
+        path = getPath(job, "path")
+        if not os.path.isdir(path):
+            raise ValueError("The backup destination does not exist.")
+        # Incremental snapshot, hard linking unchanged files against the newest previous snapshot of this volume
+        base = volumeSnapshot.findBase(path, volume)
+        stats = volumeSnapshot.backup(volumeRoot + volume, path, volume, base, workers, limiter, control)
+    elif action == "restore":
+        stats = volumeSnapshot.restore(getPath(job, "path"), volumeRoot + volume, workers, limiter, control)
+    elif action == "clone":
+        target = getName(job, "target")
+        if target == volume:
+            raise ValueError("A volume can not be cloned into itself.")
+        # Without a manifest the whole volume is copied, cloning the files copy-on-write where possible
+        stats = volumeSnapshot.restore(volumeRoot + volume, volumeRoot + target, workers, limiter, control)
+    elif action == "archive":
+        repository = chunkStore(getPath(job, "repository"), config.backupcompression)
+        repository.lock()
+        try:
+            stats = repository.archive(getPath(job, "path"), volume, getName(job, "version"), control)
+            stats["chunksRemoved"] = repository.prune(volume, getNumber(job, "keep", config.backupretention))
+        finally:
+            repository.unlock()
+    elif action == "restorearchive":
+        repository = chunkStore(getPath(job, "repository"), config.backupcompression)
+        repository.lock()
+        try:
+            stats = repository.restore(volume, getName(job, "version"), volumeRoot + volume, control)
+        finally:
+            repository.unlock()
+    elif action == "versions":
+        repository = chunkStore(getPath(job, "repository"), config.backupcompression)
+        repository.lock()
+        try:
+            stats = {"versions":repository.listVersions(volume)}
+        finally:
+            repository.unlock()
+    else:
+        raise ValueError("Unknown action.")
+    stats["volume"] = volume
+    return stats
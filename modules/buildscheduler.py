@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - dependency-aware image and container build scheduler
+# © 2021 Johannes Kreutz.
+
+# Include dependencies
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+# Include modules
+import config
+import modules.image as image
+import modules.container as container
+
+# Class definition
+class buildScheduler:
+    def __init__(self, jobs, dependencies, workers = None, pullLimit = None, buildLimit = None):
+        # jobs maps container names to build objects ("object", "image", "volumeSource", "name", "labels", "volumeAliases"), dependencies maps container names to the names they depend on
+        self.__jobs = jobs
+        self.__dependencies = {}
+        for name in jobs:
+            self.__dependencies[name] = [dep for dep in dependencies.get(name, []) if dep in jobs and dep != name]
+        self.__workers = config.buildworkers if workers is None else workers
+        self.__pullSemaphore = threading.BoundedSemaphore(config.pulllimit if pullLimit is None else pullLimit)
+        self.__buildSemaphore = threading.BoundedSemaphore(config.buildlimit if buildLimit is None else buildLimit)
+        self.__images = {}
+        self.__imageLock = threading.Lock()
+
+    # Builds all images and containers. Returns the created containers in job order and a dict of failure reasons by container name
+    def run(self):
+        created = {}
+        failures = {}
+        if len(self.__jobs) == 0:
+            return [], failures
+        with ThreadPoolExecutor(max_workers=self.__workers) as pool:
+            # Images do not depend on each other, so all of them are requested right away
+            imageFutures = {}
+            for name, job in self.__jobs.items():
+                imageFutures[pool.submit(self.__fetchImage, job)] = name
+            images = {}
+            containerFutures = {}
+            pending = set(imageFutures)
+            waiting = set(self.__jobs)
+            while len(pending) > 0 or len(waiting) > 0:
+                # Containers get created as soon as their image is there and all their dependencies exist
+                for name in list(waiting):
+                    failedDeps = [dep for dep in self.__dependencies[name] if dep in failures]
+                    if len(failedDeps) > 0:
+                        failures[name] = "dependency " + failedDeps[0] + " failed"
+                        waiting.discard(name)
+                    elif name in images and all(dep in created for dep in self.__dependencies[name]):
+                        future = pool.submit(self.__createContainer, self.__jobs[name], images[name])
+                        containerFutures[future] = name
+                        pending.add(future)
+                        waiting.discard(name)
+                if len(pending) == 0:
+                    # Everything left over waits on a dependency cycle
+                    for name in waiting:
+                        failures[name] = "dependency cycle"
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in imageFutures:
+                        name = imageFutures[future]
+                        try:
+                            images[name] = future.result()
+                        except Exception as e:
+                            images[name] = False
+                            failures[name] = "image: " + str(e)
+                        if images[name] == False and not name in failures:
+                            failures[name] = "image: " + self.__imageError(self.__jobs[name])
+                        if name in failures:
+                            waiting.discard(name)
+                    else:
+                        name = containerFutures[future]
+                        try:
+                            containerObject, result = future.result()
+                        except Exception as e:
+                            failures[name] = "container: " + str(e)
+                            continue
+                        if result != 0:
+                            failures[name] = "container: " + containerObject.getStatus()
+                        else:
+                            created[name] = {"container":containerObject,"image":images[name]}
+        return [created[name] for name in self.__jobs if name in created], failures
+
+    # PRIVATE HELPER FUNCTIONS
+    # Returns the key identifying the image source of a job, identical sources are only fetched once
+    def __imageKey(self, job):
+        source = job["image"]
+        if "prebuilt" in source:
+            return "prebuilt:" + source["prebuilt"]["name"] + ":" + source["prebuilt"]["version"]
+        elif "url" in source:
+            return "url:" + source["url"]
+        return "path:" + source["path"]
+
+    # Pulls or builds the image of a job, sharing the result with all jobs using the same source
+    def __fetchImage(self, job):
+        key = self.__imageKey(job)
+        with self.__imageLock:
+            entry = self.__images.get(key)
+            owner = entry is None
+            if owner:
+                entry = {"future":Future(),"object":image.image(False, job["object"]["name"])}
+                self.__images[key] = entry
+        if not owner:
+            return entry["future"].result()
+        semaphore = self.__pullSemaphore if "prebuilt" in job["image"] else self.__buildSemaphore
+        try:
+            with semaphore:
+                result = entry["object"].create(job["object"], job["image"])
+        except Exception as e:
+            entry["future"].set_exception(e)
+            raise
+        entry["future"].set_result(result)
+        return result
+
+    # Returns the status of the image object used for the source of a job
+    def __imageError(self, job):
+        with self.__imageLock:
+            entry = self.__images.get(self.__imageKey(job))
+        return entry["object"].getStatus() if entry is not None else "undefined"
+
+    # Creates the container of a job from its image
+    def __createContainer(self, job, imageId):
+        containerObject = container.container(False, None, job["name"])
+        result = containerObject.create(imageId, job["object"], job["volumeSource"], job.get("labels"), job.get("volumeAliases"))
+        return containerObject, result
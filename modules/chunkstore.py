@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - deduplicating chunked backup repository
+# © 2021 Johannes Kreutz.
+
+# Repository layout:
+# chunks/<first two hex digits>/<sha256>: one compressed chunk, the first byte names the codec (z: zlib, x: lzma, n: none)
+# snapshots/<volume>/<version>.json: the file tree of one volume version, regular files list their chunk hashes
+# lock: exclusive lock held while the repository is changed
+# Files are split into content-defined chunks: cut points are newline bytes whose preceding 32 byte window hashes
+# to zero in the low 12 bits, so an insertion only changes the chunks around it. Anchors are searched with
+# bytes.find, which keeps the per-byte work in C. Identical chunks are stored once across all files, volumes and versions.
+
+# Include dependencies
+import fcntl
+import hashlib
+import json
+import lzma
+import os
+import stat
+import time
+import zlib
+
+# Include modules
+import modules.filesystem as fs
+from modules.jobcontrol import jobControl
+
+# Chunk size limits in bytes and the cut point condition
+minChunkSize = 256 * 1024
+maxChunkSize = 4 * 1024 * 1024
+anchorByte = b"\n"
+windowSize = 32
+cutMask = (1 << 12) - 1
+
+# Returns the end of the chunk starting at start
+def findCut(data, start, end):
+    # The first minChunkSize bytes can never hold a cut point, so they are skipped
+    position = data.find(anchorByte, start + minChunkSize, end)
+    while position != -1:
+        if zlib.crc32(data[position - windowSize:position + 1]) & cutMask == 0:
+            return position + 1
+        position = data.find(anchorByte, position + 1, end)
+    return end
+
+# Splits a byte string into content-defined chunks
+def splitChunks(data):
+    chunks = []
+    start = 0
+    length = len(data)
+    while start < length:
+        if length - start <= minChunkSize:
+            chunks.append(data[start:])
+            break
+        cut = findCut(data, start, min(start + maxChunkSize, length))
+        chunks.append(data[start:cut])
+        start = cut
+    return chunks
+
+# Class definition
+class chunkStore:
+    def __init__(self, path, compression = "zlib"):
+        self.__path = path.rstrip("/") + "/"
+        self.__compression = compression
+        os.makedirs(self.__path + "chunks", exist_ok=True)
+        os.makedirs(self.__path + "snapshots", exist_ok=True)
+        self.__lockFile = None
+
+    # Takes the exclusive repository lock
+    def lock(self):
+        self.__lockFile = open(self.__path + "lock", "w")
+        fcntl.flock(self.__lockFile, fcntl.LOCK_EX)
+
+    # Releases the repository lock
+    def unlock(self):
+        if self.__lockFile is not None:
+            fcntl.flock(self.__lockFile, fcntl.LOCK_UN)
+            self.__lockFile.close()
+            self.__lockFile = None
+
+    # Stores the tree at source as the given version of the volume. Files unchanged since the newest stored version are not read again. Returns statistics
+    # The job control receives the progress and may cancel the archive, chunks stored until then are kept for the next run
+    def archive(self, source, volume, version, control = None):
+        control = jobControl() if control is None else control
+        begin = time.monotonic()
+        stats = {"files":0,"bytes":0,"chunksNew":0,"chunksReused":0,"bytesStored":0,"filesUnchanged":0,"seconds":0}
+        previous = self.__readSnapshot(volume, self.__newestVersion(volume))
+        previousEntries = previous["entries"] if previous is not None else {}
+        entries = {}
+        stack = [""]
+        while len(stack) > 0:
+            relative = stack.pop()
+            control.check()
+            with os.scandir(os.path.join(source, relative)) as iterator:
+                for item in iterator:
+                    itemRelative = os.path.join(relative, item.name)
+                    info = item.stat(follow_symlinks=False)
+                    entry = {"mode":stat.S_IMODE(info.st_mode),"uid":info.st_uid,"gid":info.st_gid,"mtime":info.st_mtime_ns}
+                    if stat.S_ISDIR(info.st_mode):
+                        entry["type"] = "d"
+                        stack.append(itemRelative)
+                    elif stat.S_ISLNK(info.st_mode):
+                        entry["type"] = "l"
+                        entry["target"] = os.readlink(item.path)
+                    elif stat.S_ISREG(info.st_mode):
+                        entry["type"] = "f"
+                        entry["size"] = info.st_size
+                        entry["ino"] = info.st_ino
+                        stats["files"] += 1
+                        stats["bytes"] += info.st_size
+                        old = previousEntries.get(itemRelative)
+                        if old is not None and old.get("type") == "f" and old.get("size") == entry["size"] and old.get("mtime") == entry["mtime"] and old.get("ino") == entry["ino"] and self.__hasChunks(old["chunks"]):
+                            entry["chunks"] = old["chunks"]
+                            stats["filesUnchanged"] += 1
+                        else:
+                            entry["chunks"] = self.__storeFile(item.path, stats, control)
+                        control.advance(1, info.st_size)
+                    else:
+                        continue
+                    entries[itemRelative] = entry
+        rootInfo = os.lstat(source)
+        snapshot = {"volume":volume,"version":version,"created":time.time(),"root":{"mode":stat.S_IMODE(rootInfo.st_mode),"uid":rootInfo.st_uid,"gid":rootInfo.st_gid,"mtime":rootInfo.st_mtime_ns},"entries":entries}
+        os.makedirs(self.__path + "snapshots/" + volume, exist_ok=True)
+        fs.filesystem.writeAtomic(self.__snapshotPath(volume, version), json.dumps(snapshot))
+        stats["seconds"] = round(time.monotonic() - begin, 3)
+        return stats
+
+    # Writes the given stored version of the volume to the destination folder, replacing its content. Returns statistics
+    # The job control receives the progress and may cancel the restore, which leaves the destination incomplete
+    def restore(self, volume, version, destination, control = None):
+        control = jobControl() if control is None else control
+        begin = time.monotonic()
+        snapshot = self.__readSnapshot(volume, version)
+        if snapshot is None:
+            raise FileNotFoundError("No stored version " + version + " of volume " + volume)
+        destination = destination.rstrip("/")
+        if os.path.exists(destination):
+            fs.filesystem.emptyFolder(destination)
+        os.makedirs(destination, exist_ok=True)
+        stats = {"files":0,"bytesCopied":0,"seconds":0,"bytesPerSecond":0,"method":"archive"}
+        # Sorting puts every folder before its content
+        directories = []
+        for relative in sorted(snapshot["entries"]):
+            entry = snapshot["entries"][relative]
+            target = os.path.join(destination, relative)
+            if entry["type"] == "d":
+                os.mkdir(target)
+                directories.append((target, entry))
+            elif entry["type"] == "l":
+                os.symlink(entry["target"], target)
+            else:
+                with open(target, "wb") as f:
+                    for digest in entry["chunks"]:
+                        control.check()
+                        f.write(self.__readChunk(digest))
+                os.chmod(target, entry["mode"])
+                os.utime(target, ns=(entry["mtime"], entry["mtime"]))
+                stats["files"] += 1
+                stats["bytesCopied"] += entry["size"]
+                control.advance(1, entry["size"])
+            self.__chown(target, entry)
+        for target, entry in reversed(directories):
+            os.chmod(target, entry["mode"])
+            os.utime(target, ns=(entry["mtime"], entry["mtime"]))
+        os.chmod(destination, snapshot["root"]["mode"])
+        self.__chown(destination, snapshot["root"])
+        stats["seconds"] = round(time.monotonic() - begin, 3)
+        if stats["seconds"] > 0:
+            stats["bytesPerSecond"] = int(stats["bytesCopied"] / stats["seconds"])
+        return stats
+
+    # Returns all stored versions of the volume, oldest first
+    def listVersions(self, volume):
+        folder = self.__path + "snapshots/" + volume
+        if not os.path.isdir(folder):
+            return []
+        versions = []
+        for filename in os.listdir(folder):
+            if filename.endswith(".json"):
+                snapshot = self.__readSnapshot(volume, filename[:-5])
+                if snapshot is not None:
+                    versions.append((snapshot["created"], snapshot["version"]))
+        return [version for created, version in sorted(versions)]
+
+    # Deletes all but the newest keep versions of the volume and removes chunks nobody references anymore. Returns the number of removed chunks
+    def prune(self, volume, keep):
+        versions = self.listVersions(volume)
+        for version in versions[:max(0, len(versions) - keep)]:
+            os.remove(self.__snapshotPath(volume, version))
+        return self.collectGarbage()
+
+    # Removes all chunks which are not referenced by any stored version
+    def collectGarbage(self):
+        referenced = set()
+        for volume in os.listdir(self.__path + "snapshots"):
+            for version in self.listVersions(volume):
+                for entry in self.__readSnapshot(volume, version)["entries"].values():
+                    if entry["type"] == "f":
+                        referenced.update(entry["chunks"])
+        removed = 0
+        for prefix in os.listdir(self.__path + "chunks"):
+            for digest in os.listdir(self.__path + "chunks/" + prefix):
+                if not digest in referenced:
+                    os.remove(self.__path + "chunks/" + prefix + "/" + digest)
+                    removed += 1
+        return removed
+
+    # PRIVATE HELPER FUNCTIONS
+    # Splits a file into chunks, stores the new ones and returns the list of chunk hashes
+    def __storeFile(self, path, stats, control):
+        digests = []
+        with open(path, "rb") as f:
+            # Reading in blocks of the maximum chunk size keeps memory bounded, the unfinished tail is carried over
+            rest = b""
+            while True:
+                control.check()
+                block = f.read(maxChunkSize)
+                data = rest + block
+                if len(data) == 0:
+                    break
+                chunks = splitChunks(data)
+                if len(block) > 0 and len(chunks) > 1:
+                    rest = chunks.pop()
+                else:
+                    rest = b""
+                for chunk in chunks:
+                    digests.append(self.__storeChunk(chunk, stats))
+                if len(block) == 0:
+                    break
+        return digests
+
+    # Stores a single chunk unless it exists already, returns its hash
+    def __storeChunk(self, chunk, stats):
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self.__chunkPath(digest)
+        if os.path.exists(path):
+            stats["chunksReused"] += 1
+            return digest
+        if self.__compression == "lzma":
+            data = b"x" + lzma.compress(chunk)
+        else:
+            data = b"z" + zlib.compress(chunk, 6)
+        if len(data) >= len(chunk) + 1:
+            data = b"n" + chunk
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        stats["chunksNew"] += 1
+        stats["bytesStored"] += len(data)
+        return digest
+
+    # Reads and decompresses a single chunk
+    def __readChunk(self, digest):
+        with open(self.__chunkPath(digest), "rb") as f:
+            data = f.read()
+        if data[:1] == b"x":
+            return lzma.decompress(data[1:])
+        elif data[:1] == b"z":
+            return zlib.decompress(data[1:])
+        return data[1:]
+
+    # Returns if all given chunks are stored
+    def __hasChunks(self, digests):
+        for digest in digests:
+            if not os.path.exists(self.__chunkPath(digest)):
+                return False
+        return True
+
+    # Returns the path of a chunk
+    def __chunkPath(self, digest):
+        return self.__path + "chunks/" + digest[:2] + "/" + digest
+
+    # Returns the path of a stored version
+    def __snapshotPath(self, volume, version):
+        return self.__path + "snapshots/" + volume + "/" + version + ".json"
+
+    # Reads a stored version, returns None if it does not exist
+    def __readSnapshot(self, volume, version):
+        if version is None:
+            return None
+        try:
+            with open(self.__snapshotPath(volume, version), "r") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    # Returns the newest stored version of the volume, or None
+    def __newestVersion(self, volume):
+        versions = self.listVersions(volume)
+        return versions[-1] if len(versions) > 0 else None
+
+    # Applies the stored ownership, which is only possible when running as root
+    def __chown(self, target, entry):
+        if os.geteuid() == 0:
+            os.lchown(target, entry["uid"], entry["gid"])
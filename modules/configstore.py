@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - coalescing configuration file writer
+# © 2021 Johannes Kreutz.
+
+# Include dependencies
+import atexit
+import json
+import threading
+import time
+import weakref
+
+# Include modules
+import config
+import modules.filesystem as fs
+
+# All stores of this process, flushed on shutdown
+stores = weakref.WeakSet()
+
+# Writes all pending changes, used on shutdown
+def flushAll():
+    for store in list(stores):
+        store.flush()
+
+atexit.register(flushAll)
+
+# Class definition
+class configStore:
+    def __init__(self, data, delay = None):
+        self.__data = data
+        self.__path = None
+        self.__delay = config.configwritedelay if delay is None else delay
+        self.__dirty = False
+        self.__lastChange = 0
+        self.__writer = None
+        self.__condition = threading.Condition(threading.Lock())
+        stores.add(self)
+
+    # Sets the file the data is persisted to
+    def setPath(self, path):
+        with self.__condition:
+            self.__path = path
+
+    # Marks the data as changed. The background writer persists it once no further changes arrived for the debounce delay
+    def markDirty(self):
+        with self.__condition:
+            self.__dirty = True
+            self.__lastChange = time.monotonic()
+            if self.__writer is None:
+                self.__writer = threading.Thread(target=self.__run, daemon=True)
+                self.__writer.start()
+            self.__condition.notify()
+
+    # Writes pending changes immediately
+    def flush(self):
+        with self.__condition:
+            for attempt in range(5):
+                if not self.__dirty or self.__write():
+                    return True
+            return False
+
+    # Drops pending changes and stops persisting, used when the file is going to be deleted
+    def discard(self):
+        with self.__condition:
+            self.__dirty = False
+            self.__path = None
+            self.__condition.notify()
+
+    # Returns if there are changes which are not written yet
+    def isDirty(self):
+        return self.__dirty
+
+    # PRIVATE HELPER FUNCTIONS
+    # Background writer main loop, exits as soon as everything is written
+    def __run(self):
+        with self.__condition:
+            while self.__dirty:
+                remaining = self.__lastChange + self.__delay - time.monotonic()
+                if remaining > 0:
+                    self.__condition.wait(remaining)
+                else:
+                    self.__write()
+            self.__writer = None
+
+    # Serializes and atomically replaces the file. Returns false if the data changed while serializing or the file could
+    # not be written, the data stays dirty then and the background writer tries again later
+    def __write(self):
+        if self.__path is None:
+            self.__dirty = False
+            return True
+        try:
+            content = json.dumps(self.__data, sort_keys=True, indent=4)
+        except RuntimeError:
+            # Another thread changed the data while it was serialized, try again
+            self.__lastChange = time.monotonic()
+            return False
+        try:
+            fs.filesystem.writeAtomic(self.__path, content)
+        except OSError as e:
+            print("Could not write " + self.__path + ": " + str(e))
+            # A full or read-only disk does not recover within the debounce delay
+            self.__lastChange = time.monotonic() + config.configretrydelay
+            return False
+        self.__dirty = False
+        return True
@@ -17,22 +17,24 @@ import docker
 
 # Include modules
 import config
+import modules.dockerstate as dockerstate
 from modules.envstore import envman
+import modules.dockerclient as dockerclient
 
 # Manager objects
 env = envman()
 
-# Create docker connection
-client = docker.from_env()
-
 # Class definition
 class container:
-    def __init__(self, exists, id, name):
+    def __init__(self, exists, id, name, dockerObject = None):
         self.__status = 0
         self.__localEnv = envman(name)
-        if exists:
+        if dockerObject is not None:
+            self.__container = dockerObject
+            self.__status = 1
+        elif exists:
             try:
-                self.__container = client.containers.get(container_id=id)
+                self.__container = dockerclient.getClient().containers.get(container_id=id)
                 self.__status = 1
             except docker.errors.NotFound:
                 self.__container = None
@@ -43,22 +45,23 @@ class container:
                 print("Container lookup failed. Check inputs.")
 
     # Creates a new container and returns it
-    def create(self, image, object, volumeSource = None):
+    def create(self, image, object, volumeSource = None, labels = None, volumeAliases = None):
         self.__status = 3
         extrahosts = {}
+        labels = {} if labels is None else labels
         if object["name"] == "pc_admin":
             extrahosts = {"docker.local":"192.168.255.255"}
         try:
             if self.__isHostNetwork(self.__firstNetwork(object)):
                 if volumeSource == None:
-                    self.__container = client.containers.create(image=image, auto_remove=False, detach=True, hostname=object["hostname"], ports=self.__createPortMap(object), restart_policy={"Name":"on-failure", "MaximumRetryCount": 5}, volumes=self.__createVolumeMap(object), name=object["name"], environment=self.__createEnvironmentMap(object), extra_hosts=extrahosts, network_mode="host")
+                    self.__container = dockerclient.getClient().containers.create(image=image, auto_remove=False, detach=True, hostname=object["hostname"], ports=self.__createPortMap(object), restart_policy={"Name":"on-failure", "MaximumRetryCount": 5}, volumes=self.__createVolumeMap(object, volumeAliases), name=object["name"], environment=self.__createEnvironmentMap(object), extra_hosts=extrahosts, labels=labels, network_mode="host")
                 else:
-                    self.__container = client.containers.create(image=image, auto_remove=False, detach=True, hostname=object["hostname"], ports=self.__createPortMap(object), restart_policy={"Name":"on-failure", "MaximumRetryCount": 5}, volumes_from=volumeSource, name=object["name"], environment=self.__createEnvironmentMap(object), extra_hosts=extrahosts, network_mode="host")
+                    self.__container = dockerclient.getClient().containers.create(image=image, auto_remove=False, detach=True, hostname=object["hostname"], ports=self.__createPortMap(object), restart_policy={"Name":"on-failure", "MaximumRetryCount": 5}, volumes_from=volumeSource, name=object["name"], environment=self.__createEnvironmentMap(object), extra_hosts=extrahosts, labels=labels, network_mode="host")
             else:
                 if volumeSource == None:
-                    self.__container = client.containers.create(image=image, auto_remove=False, detach=True, hostname=object["hostname"], ports=self.__createPortMap(object), restart_policy={"Name":"on-failure", "MaximumRetryCount": 5}, volumes=self.__createVolumeMap(object), name=object["name"], environment=self.__createEnvironmentMap(object), extra_hosts=extrahosts, network=self.__firstNetwork(object)["name"])
+                    self.__container = dockerclient.getClient().containers.create(image=image, auto_remove=False, detach=True, hostname=object["hostname"], ports=self.__createPortMap(object), restart_policy={"Name":"on-failure", "MaximumRetryCount": 5}, volumes=self.__createVolumeMap(object, volumeAliases), name=object["name"], environment=self.__createEnvironmentMap(object), extra_hosts=extrahosts, labels=labels, network=self.__firstNetwork(object)["name"])
                 else:
-                    self.__container = client.containers.create(image=image, auto_remove=False, detach=True, hostname=object["hostname"], ports=self.__createPortMap(object), restart_policy={"Name":"on-failure", "MaximumRetryCount": 5}, volumes_from=volumeSource, name=object["name"], environment=self.__createEnvironmentMap(object), extra_hosts=extrahosts, network=self.__firstNetwork(object)["name"])
+                    self.__container = dockerclient.getClient().containers.create(image=image, auto_remove=False, detach=True, hostname=object["hostname"], ports=self.__createPortMap(object), restart_policy={"Name":"on-failure", "MaximumRetryCount": 5}, volumes_from=volumeSource, name=object["name"], environment=self.__createEnvironmentMap(object), extra_hosts=extrahosts, labels=labels, network=self.__firstNetwork(object)["name"])
             self.__status = 1
             return 0
         except docker.errors.ContainerError:
@@ -88,6 +91,10 @@ class container:
     # Returns this containers actual name
     def getName(self):
         if not self.__container == None:
+            if self.__container.name is None:
+                # Objects from a sparse list call only carry the names list
+                names = self.__container.attrs.get("Names") or [""]
+                return names[0].lstrip("/")
             return self.__container.name
         else:
             return ""
@@ -104,10 +111,13 @@ class container:
             self.__container.stop()
             self.__status = 1
 
-    # Returns if this container is actually running
+    # Returns if this container is actually running, answered from the event-driven state cache when it is live
     def isRunning(self):
         if not self.__container == None:
-            if self.__container.status == "running":
+            status = dockerstate.getState().getContainerStatus(self.__container.id)
+            if status is None:
+                status = self.__container.status
+            if status == "running":
                 return True
             else:
                 return False
@@ -145,12 +155,13 @@ class container:
     def __createEnvironmentMap(self, object):
         environmentMap = {}
         if "environment" in object:
+            localValues = self.__localEnv.getValues()
+            globalValues = env.getValues()
             for var in object["environment"]:
-                local = self.__localEnv.getValue(var)
-                if local is False:
-                    environmentMap[var] = env.getValue(var)
+                if var in localValues:
+                    environmentMap[var] = localValues[var]
                 else:
-                    environmentMap[var] = local
+                    environmentMap[var] = globalValues.get(var, False)
         if object["name"] == "pc_admin":
             apitokenfile = open(config.configpath + config.apitokenfile, "r")
             environmentMap["APIKEY"] = apitokenfile.read()
@@ -158,11 +169,13 @@ class container:
         return environmentMap
 
     # Creates a volume map for the docker api
-    def __createVolumeMap(self, object):
+    def __createVolumeMap(self, object, volumeAliases):
         volumeMap = {}
+        volumeAliases = {} if volumeAliases is None else volumeAliases
         if "volumes" in object:
             for wantedVolume in object["volumes"]:
-                volumeMap[wantedVolume["name"]] = {"bind": wantedVolume["mountpoint"], "mode": "rw"}
+                # Volumes replaced by a snapshot volume are mounted under the name of the snapshot
+                volumeMap[volumeAliases.get(wantedVolume["name"], wantedVolume["name"])] = {"bind": wantedVolume["mountpoint"], "mode": "rw"}
         if "userdata" in object:
             volumeMap[env.getValue("USERDATA")] = {"bind": object["userdata"], "mode": "rw"}
         return volumeMap
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - compiled service description model
+# © 2021 Johannes Kreutz.
+
+# A service description, either a docker-compose.yml or a service json file, is compiled once when it is read. The
+# model holds the translated containers, networks, volumes and environment variables with all env files parsed, and
+# is never changed afterwards. Records support the read access of dicts, so callers use them like before.
+
+# Include dependencies
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# Include modules
+from modules.envparser import envParser
+
+# Read-only dict replacement
+class frozenRecord(Mapping):
+    __slots__ = ("__fields",)
+
+    def __init__(self, fields):
+        self.__fields = fields
+
+    # Returns the value of a field
+    def __getitem__(self, key):
+        return self.__fields[key]
+
+    # Iterates over the field names
+    def __iter__(self):
+        return iter(self.__fields)
+
+    # Returns the number of fields
+    def __len__(self):
+        return len(self.__fields)
+
+    # Returns the record like a dict
+    def __repr__(self):
+        return "frozenRecord(" + repr(self.__fields) + ")"
+
+# Returns an immutable copy of parsed json or yaml content, dicts become records and lists become tuples
+def freeze(value):
+    if isinstance(value, dict):
+        return frozenRecord({key: freeze(entry) for key, entry in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(entry) for entry in value)
+    return value
+
+# Class definition
+class descriptionModel:
+    __slots__ = ("containerNames", "containers", "dependencies", "startOrder", "networks", "volumes", "environment")
+
+    def __init__(self, containers, dependencies, networks, volumes, environment):
+        # Containers in their defined order, indexed by name
+        self.containerNames = tuple(container["name"] for container in containers)
+        self.containers = MappingProxyType({container["name"]: freeze(container) for container in containers})
+        self.dependencies = MappingProxyType({name: tuple(names) for name, names in dependencies.items()})
+        self.startOrder = self.__getStartOrder()
+        self.networks = freeze(networks)
+        self.volumes = freeze(volumes)
+        self.environment = freeze(environment)
+
+    # PRIVATE HELPER FUNCTIONS
+    # Returns all container names ordered so that every container comes after its dependencies, keeping the defined order otherwise
+    def __getStartOrder(self):
+        order = []
+        visiting = set()
+        def visit(name):
+            if name in order or name in visiting or not name in self.dependencies:
+                return
+            visiting.add(name)
+            for dependency in self.dependencies[name]:
+                visit(dependency)
+            visiting.discard(name)
+            order.append(name)
+        for name in self.containerNames:
+            visit(name)
+        return tuple(order)
+
+# Returns the names of the containers a container depends on, docker-compose allows both a list and a dict with conditions
+def getDependencyNames(container):
+    dependencies = container.get("depends_on", [])
+    return list(dependencies.keys()) if isinstance(dependencies, dict) else list(dependencies)
+
+# Returns a model from the parts returned by translateCompose
+def fromParts(parts):
+    return descriptionModel(parts["containers"], parts["dependencies"], parts["networks"], parts["volumes"], parts["environment"])
+
+# Compiles a service json file
+def compileJson(desc):
+    dependencies = {container["name"]: getDependencyNames(container) for container in desc["containers"]}
+    return descriptionModel(desc["containers"], dependencies, desc.get("networks", []), desc.get("volumes", []), desc.get("environment", []))
+
+# Compiles a docker-compose file, basePath is the folder containing it including the trailing slash
+def compileCompose(desc, basePath):
+    return fromParts(translateCompose(desc, basePath))
+
+# Translates a docker-compose file into the parts of the model. The parts only contain dicts, lists and strings, so
+# they can be stored as json. "envFiles" lists the env files which have been read
+def translateCompose(desc, basePath):
+    envFiles = {}
+    # Returns the variables of an env file, every file is parsed once
+    def readEnvFile(file):
+        filename = file[2:] if file.startswith("./") else file
+        if not filename in envFiles:
+            try:
+                envFiles[filename] = envParser(basePath + filename).getEnvironment()
+                if envFiles[filename] is None:
+                    print("Env file " + basePath + filename + " is invalid, its variables are ignored.")
+            except OSError as e:
+                print("Reading env file " + basePath + filename + " failed: " + str(e))
+            if envFiles.get(filename) is None:
+                envFiles[filename] = []
+        return envFiles[filename]
+    containers = []
+    dependencies = {}
+    environment = []
+    names = [] # Cache names we already have
+    for name, container in desc["services"].items():
+        c = {
+            "name": name,
+            "hostname": name,
+            "ports": [],
+            "networks": [],
+            "volumes": [],
+            "environment": []
+        }
+        # Translate image source
+        if "image" in container:
+            source = container["image"]
+            if ":" in source:
+                parts = source.split(":")
+                c["prebuilt"] = {
+                    "name": parts[0],
+                    "version": parts[1],
+                }
+            else:
+                c["prebuilt"] = {
+                    "name": container["image"],
+                    "version": "latest",
+                }
+        else:
+            c["path"] = basePath + container["build"]
+        # Translate ports
+        if "ports" in container:
+            for port in container["ports"]:
+                parts = port.split(":")
+                c["ports"].append({
+                    "external": parts[0],
+                    "internal": parts[1],
+                })
+        # Translate networks
+        if "networks" in container:
+            for network in container["networks"]:
+                c["networks"].append({
+                    "name": network,
+                })
+        # Translate volumes
+        if "volumes" in container:
+            for volume in container["volumes"]:
+                parts = volume.split(":")
+                c["volumes"].append({
+                    "name": parts[0],
+                    "mountpoint": parts[1],
+                })
+        # Translate environment parameters
+        if "env_file" in container:
+            for envFile in container["env_file"]:
+                for var in readEnvFile(envFile):
+                    c["environment"].append(var["name"])
+                    if not var["name"] in names:
+                        names.append(var["name"])
+                        environment.append(var)
+        containers.append(c)
+        dependencies[name] = getDependencyNames(container)
+    networks = []
+    for name, network in (desc.get("networks") or {}).items():
+        networks.append({
+            "name": name,
+            "internal": True if network is not None and "internal" in network else False,
+        })
+    volumes = [{"name": name} for name in (desc.get("volumes") or {})]
+    return {"containers":containers,"dependencies":dependencies,"networks":networks,"volumes":volumes,"environment":environment,"envFiles":list(envFiles.keys())}
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - shared docker clients
+# © 2021 Johannes Kreutz.
+
+# All modules share one connection pool per kind of request instead of creating their own client at import time.
+# The clients are created on first use, so importing a module does not need a running docker daemon.
+# quick: inspects, lists, creates, starts, stops and deletions
+# long: image pulls, builds and prunes, which can take minutes
+# stream: the event stream, which is idle most of the time and never times out
+
+# Include dependencies
+import docker
+import threading
+
+# Include modules
+import config
+
+# Shared instances
+sharedClients = {}
+sharedLock = threading.Lock()
+
+# Returns the shared client for quick requests
+def getClient():
+    return getSharedClient("quick", config.dockertimeout, config.dockerpoolsize)
+
+# Returns the shared client for image pulls, builds and prunes
+def getLongClient():
+    return getSharedClient("long", config.dockerlongtimeout, config.pulllimit + config.buildlimit)
+
+# Returns the shared client for the event stream
+def getStreamClient():
+    return getSharedClient("stream", None, 1)
+
+# Returns the shared client of the given kind, creating it on first use
+def getSharedClient(kind, timeout, poolSize):
+    with sharedLock:
+        if not kind in sharedClients:
+            try:
+                sharedClients[kind] = docker.from_env(timeout=timeout, max_pool_size=poolSize)
+            except TypeError:
+                # Older docker modules have no pool size setting and keep their default of 10 connections
+                sharedClients[kind] = docker.from_env(timeout=timeout)
+        return sharedClients[kind]
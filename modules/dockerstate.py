@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - docker object state cache, kept up to date by the docker event stream
+# © 2021 Johannes Kreutz.
+
+# Include dependencies
+import threading
+import time
+
+# Include modules
+import modules.dockerclient as dockerclient
+
+# Shared instance
+sharedState = None
+sharedLock = threading.Lock()
+
+# Returns the process-wide state cache, seeding it and starting the event subscriber on first use
+def getState():
+    global sharedState
+    with sharedLock:
+        if sharedState is None:
+            sharedState = dockerState()
+            sharedState.start()
+        return sharedState
+
+# Container event actions and the state they result in
+containerTransitions = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "stop": "exited",
+}
+
+# Class definition
+class dockerState:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__containers = {}
+        self.__networks = {}
+        self.__volumes = {}
+        self.__ready = False
+        self.__thread = None
+        self.__listeners = []
+
+    # Seeds the tables and starts the event subscriber thread
+    def start(self):
+        since = self.__seed()
+        self.__thread = threading.Thread(target=self.__run, args=(since,), daemon=True)
+        self.__thread.start()
+
+    # Returns the state of the container with the given id ("running", "exited", ...), or None if it is unknown or the cache is not live
+    def getContainerStatus(self, id):
+        if not self.__ready:
+            return None
+        entry = self.__containers.get(id)
+        return entry["status"] if entry is not None else None
+
+    # Returns the name of the container with the given id, or None if it is unknown
+    def getContainerName(self, id):
+        entry = self.__containers.get(id)
+        return entry["name"] if entry is not None else None
+
+    # Returns if a network with the given id exists, or None if the cache is not live
+    def networkExists(self, id):
+        if not self.__ready:
+            return None
+        return id in self.__networks
+
+    # Returns if a volume with the given name exists, or None if the cache is not live
+    def volumeExists(self, name):
+        if not self.__ready:
+            return None
+        return name in self.__volumes
+
+    # Returns if the cache is following the event stream
+    def isReady(self):
+        return self.__ready
+
+    # Calls the function without arguments whenever containers changed their state or the tables were seeded again
+    def subscribe(self, function):
+        with self.__lock:
+            self.__listeners.append(function)
+
+    # PRIVATE HELPER FUNCTIONS
+    # Event subscriber main loop, reconnects and re-seeds if the stream breaks
+    def __run(self, since):
+        while True:
+            try:
+                for event in dockerclient.getStreamClient().events(since=since, decode=True):
+                    self.__apply(event)
+            except Exception as e:
+                print("Docker event stream interrupted: " + str(e))
+            self.__ready = False
+            time.sleep(5)
+            try:
+                since = self.__seed()
+            except Exception as e:
+                print("Docker state seeding failed: " + str(e))
+
+    # Reads the full inventory with one list call per object type. Returns the timestamp the event stream has to start at
+    def __seed(self):
+        since = int(time.time())
+        containers = {}
+        for ct in dockerclient.getClient().containers.list(all=True, sparse=True):
+            names = ct.attrs.get("Names") or [""]
+            containers[ct.id] = {"name":names[0].lstrip("/"),"status":ct.attrs.get("State")}
+        networks = {}
+        for nw in dockerclient.getClient().networks.list():
+            networks[nw.id] = nw.name
+        volumes = {}
+        for vol in dockerclient.getClient().volumes.list():
+            volumes[vol.name] = vol.name
+        with self.__lock:
+            self.__containers = containers
+            self.__networks = networks
+            self.__volumes = volumes
+            self.__ready = True
+        self.__notify()
+        return since
+
+    # Applies a single docker event to the tables
+    def __apply(self, event):
+        type = event.get("Type")
+        action = event.get("Action", "")
+        actor = event.get("Actor", {})
+        id = actor.get("ID")
+        attributes = actor.get("Attributes", {})
+        with self.__lock:
+            if type == "container":
+                if action == "destroy":
+                    self.__containers.pop(id, None)
+                elif action == "rename":
+                    if id in self.__containers:
+                        self.__containers[id]["name"] = attributes.get("name", "")
+                elif action in containerTransitions:
+                    entry = self.__containers.setdefault(id, {"name":attributes.get("name", ""),"status":None})
+                    entry["status"] = containerTransitions[action]
+            elif type == "network":
+                if action == "create":
+                    self.__networks[id] = attributes.get("name", "")
+                elif action == "destroy":
+                    self.__networks.pop(id, None)
+            elif type == "volume":
+                if action == "create":
+                    self.__volumes[id] = id
+                elif action == "destroy":
+                    self.__volumes.pop(id, None)
+        if type == "container" and (action in containerTransitions or action in ["destroy", "rename"]):
+            self.__notify()
+
+    # Calls all listeners
+    def __notify(self):
+        with self.__lock:
+            listeners = list(self.__listeners)
+        for listener in listeners:
+            try:
+                listener()
+            except Exception as e:
+                print("Docker state listener failed: " + str(e))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - streaming downloads with in-process extraction and integrity checks
+# © 2021 Johannes Kreutz.
+
+# Include dependencies
+import hashlib
+import os
+import tarfile
+import threading
+import urllib.error
+import urllib.request
+
+# Include modules
+import config
+import modules.filesystem as fs
+
+# Raised by a conditional download if the server reports that the content did not change
+class notModified(Exception):
+    pass
+
+# Byte counters of a running transfer
+class progress:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__done = 0
+        self.__total = 0
+
+    # Starts counting a new transfer with the given total size, 0 if unknown
+    def reset(self, total):
+        with self.__lock:
+            self.__done = 0
+            self.__total = total
+
+    # Adds transferred bytes
+    def add(self, count):
+        with self.__lock:
+            self.__done += count
+
+    # Returns the counters as a dict
+    def get(self):
+        with self.__lock:
+            return {"bytesDone":self.__done,"bytesTotal":self.__total}
+
+# File-like wrapper hashing and counting everything read from the response
+class hashingReader:
+    def __init__(self, response, progressObject):
+        self.__response = response
+        self.__progress = progressObject
+        self.__hash = hashlib.sha256()
+
+    # Reads from the response and updates hash and counters
+    def read(self, size = -1):
+        data = self.__response.read(size)
+        self.__hash.update(data)
+        if self.__progress is not None:
+            self.__progress.add(len(data))
+        return data
+
+    # Reads the rest of the response, so the hash covers the whole artifact
+    def drain(self):
+        while len(self.read(1024 * 1024)) > 0:
+            pass
+
+    # Returns the sha256 of everything read so far
+    def hexdigest(self):
+        return self.__hash.hexdigest()
+
+# Class definition
+class download:
+    # Downloads the url into a file. Returns the sha256 of the content, raises ValueError if it does not match the expected one.
+    # validators is an optional dict with the "etag" and "lastModified" of a known copy, it makes the request conditional
+    # and receives the values of the response
+    @staticmethod
+    def toFile(url, path, sha256 = None, progressObject = None, validators = None):
+        try:
+            with download.__open(url, progressObject, validators) as response:
+                reader = hashingReader(response, progressObject)
+                with open(path, "wb") as f:
+                    for block in iter(lambda: reader.read(1024 * 1024), b""):
+                        f.write(block)
+        except OSError:
+            # Network errors and timeouts leave a partial file
+            fs.filesystem.removeElement(path)
+            raise
+        download.__verify(reader, sha256, path)
+        return reader.hexdigest()
+
+    # Downloads a .tar.gz archive and unpacks it while it arrives. Returns the sha256 of the archive, raises ValueError on checksum mismatch or unsafe members.
+    # validators work like for toFile
+    @staticmethod
+    def extractTo(url, destination, sha256 = None, stripComponents = 0, progressObject = None, validators = None):
+        os.makedirs(destination, exist_ok=True)
+        destination = os.path.realpath(destination)
+        try:
+            with download.__open(url, progressObject, validators) as response:
+                reader = hashingReader(response, progressObject)
+                with tarfile.open(fileobj=reader, mode="r|gz") as tar:
+                    for member in tar:
+                        if download.__prepareMember(member, destination, stripComponents):
+                            download.__extractMember(tar, member, destination)
+                reader.drain()
+        except (tarfile.TarError, ValueError, EOFError, OSError, notModified):
+            # Broken archives, network errors and timeouts leave a half extracted destination
+            fs.filesystem.removeElement(destination)
+            raise
+        download.__verify(reader, sha256, destination)
+        return reader.hexdigest()
+
+    # PRIVATE HELPER FUNCTIONS
+    # Opens the url and initializes the progress counters. A server which sends nothing for config.downloadtimeout seconds raises a timeout
+    @staticmethod
+    def __open(url, progressObject, validators):
+        headers = {}
+        if validators is not None:
+            if validators.get("etag") is not None:
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("lastModified") is not None:
+                headers["If-Modified-Since"] = validators["lastModified"]
+        try:
+            response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=config.downloadtimeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and len(headers) > 0:
+                e.close()
+                raise notModified()
+            raise
+        if validators is not None and hasattr(response, "headers"):
+            validators["etag"] = response.headers.get("ETag")
+            validators["lastModified"] = response.headers.get("Last-Modified")
+        if progressObject is not None:
+            length = response.headers.get("Content-Length") if hasattr(response, "headers") else None
+            progressObject.reset(int(length) if length is not None and length.isdigit() else 0)
+        return response
+
+    # Compares the computed sha256 with the expected one and removes the result on mismatch
+    @staticmethod
+    def __verify(reader, sha256, path):
+        if sha256 is not None and sha256 != "" and reader.hexdigest() != sha256.lower():
+            fs.filesystem.removeElement(path)
+            raise ValueError("Checksum mismatch: expected " + sha256 + ", got " + reader.hexdigest())
+
+    # Strips leading components and checks that the member stays inside the destination. Returns false for members to skip
+    @staticmethod
+    def __prepareMember(member, destination, stripComponents):
+        parts = [part for part in member.name.split("/") if part not in ("", ".")]
+        if len(parts) <= stripComponents:
+            return False
+        if member.name.startswith("/") or ".." in parts:
+            raise ValueError("Unsafe path in archive: " + member.name)
+        member.name = "/".join(parts[stripComponents:])
+        if member.ischr() or member.isblk() or member.isfifo():
+            return False
+        if member.islnk():
+            linkParts = [part for part in member.linkname.split("/") if part not in ("", ".")]
+            if member.linkname.startswith("/") or ".." in linkParts or len(linkParts) <= stripComponents:
+                raise ValueError("Unsafe hard link in archive: " + member.name)
+            member.linkname = "/".join(linkParts[stripComponents:])
+        elif member.issym():
+            target = os.path.realpath(os.path.join(destination, os.path.dirname(member.name), member.linkname))
+            if os.path.isabs(member.linkname) or os.path.commonpath([destination, target]) != destination:
+                raise ValueError("Unsafe symbolic link in archive: " + member.name)
+        target = os.path.realpath(os.path.join(destination, member.name))
+        if os.path.commonpath([destination, target]) != destination:
+            raise ValueError("Unsafe path in archive: " + member.name)
+        # Never restore ownership or special permission bits from downloaded archives
+        member.mode &= 0o777
+        member.uid = os.getuid()
+        member.gid = os.getgid()
+        return True
+
+    # Extracts a single member, using the stdlib safety filter where available
+    @staticmethod
+    def __extractMember(tar, member, destination):
+        if hasattr(tarfile, "data_filter"):
+            tar.extract(member, destination, set_attrs=True, filter="data")
+        else:
+            tar.extract(member, destination, set_attrs=True)
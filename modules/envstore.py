@@ -7,9 +7,14 @@
 import os
 import json
 import socket
+import threading
 
 # Include modules
 import config
+import modules.filesystem as fs
+
+# Serializes read-modify-write cycles of all stores in this process
+storeLock = threading.RLock()
 
 # Class definition
 class envman:
@@ -19,24 +24,29 @@ class envman:
         else:
             self.__path = config.servicepath + service + "/env.json"
         self.__storage = {}
-        if not os.path.exists(self.__path):
-            self.write()
-        else:
-            self.load()
+        self.__signature = None
+        with storeLock:
+            if not os.path.exists(self.__path):
+                self.write()
+            else:
+                self.load()
         if service is None:
             self.updateLocalIp()
 
-    # Read stored environment variables and their descriptions from configuration files
+    # Read stored environment variables and their descriptions from configuration files, if they changed since the last read
     def load(self):
+        signature = self.__fileSignature()
+        if signature is not None and signature == self.__signature:
+            return
         envfile = open(self.__path, "r")
         self.__storage = json.loads(envfile.read())
         envfile.close()
+        self.__signature = signature
 
     # Writes actual environment variables and their descriptions to the storage files
     def write(self):
-        envfile = open(self.__path, "w")
-        envfile.write(json.dumps(self.__storage, sort_keys=True, indent=4))
-        envfile.close()
+        fs.filesystem.writeAtomic(self.__path, json.dumps(self.__storage, sort_keys=True, indent=4))
+        self.__signature = self.__fileSignature()
 
     # Returns the value of an environment variable with the given id if available
     def getValue(self, id):
@@ -46,6 +56,14 @@ class envman:
         else:
             return False
 
+    # Returns all environment variable values as a dict
+    def getValues(self):
+        self.load()
+        values = {}
+        for id, entry in self.__storage.items():
+            values[id] = entry["value"]
+        return values
+
     # Returns the description of an environment variable with the given id if available
     def getDescription(self, id):
         self.load()
@@ -64,15 +82,23 @@ class envman:
 
     # Returns all environment variables as json
     def getJson(self):
+        self.load()
         return json.dumps(self.__storage)
 
     # Stores a new environment variable
     def storeValue(self, id, value, description = None, mutable = False):
-        self.load()
-        description = "" if description == None else description
-        entry = {"value":value,"description":description,"mutable":mutable}
-        self.__storage[id] = entry
-        self.write()
+        self.storeValues({id: {"value":value,"description":description,"mutable":mutable}})
+
+    # Stores many environment variables with a single write. Entries maps ids to dicts with value, description and mutable
+    def storeValues(self, entries):
+        if len(entries) == 0:
+            return
+        with storeLock:
+            self.load()
+            for id, entry in entries.items():
+                description = "" if entry.get("description") == None else entry["description"]
+                self.__storage[id] = {"value":entry["value"],"description":description,"mutable":entry.get("mutable", False)}
+            self.write()
 
     # Returns true if a environment variable for a given id exists
     def doesKeyExist(self, id):
@@ -81,9 +107,9 @@ class envman:
 
     # Updates the environment variable storing the hosts IP address
     def updateLocalIp(self):
-        self.load()
-        self.storeValue("HOST_NETWORK_ADDRESS", self.getLocalIp(), "Die lokale IP-Addresse des Hostsystems.")
-        self.write()
+        ip = self.getLocalIp()
+        if self.getValue("HOST_NETWORK_ADDRESS") != ip:
+            self.storeValue("HOST_NETWORK_ADDRESS", ip, "Die lokale IP-Addresse des Hostsystems.")
 
     # Helper function to get local machine ip on the default interface
     def getLocalIp(self):
@@ -97,3 +123,12 @@ class envman:
         finally:
             s.close()
         return IP
+
+    # PRIVATE HELPER FUNCTIONS
+    # Returns a signature of the storage file, which changes whenever the file gets rewritten or replaced
+    def __fileSignature(self):
+        try:
+            stat = os.stat(self.__path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - event bus for state transitions and progress
+# © 2021 Johannes Kreutz.
+
+# Events are dicts with an increasing "id", a "time" and a "type":
+# status: {"service":<name>,"status":<status>}, a service changed its status
+# job: {"service":<name>,"job":<id>,"details":<job dict>}, a job was queued, started, finished or began a step
+# progress: {"service":<name>,"job":<id>,"progress":<progress dict>}, the progress of a running job changed
+# The newest events are kept, so clients can pick up everything that happened since the last event they saw.
+
+# Include dependencies
+import threading
+import time
+from collections import deque
+
+# Include modules
+import config
+
+# Shared instance
+sharedBus = None
+sharedLock = threading.Lock()
+
+# Returns the shared event bus
+def getEventBus():
+    global sharedBus
+    with sharedLock:
+        if sharedBus is None:
+            sharedBus = eventBus()
+        return sharedBus
+
+# Returns a filter function matching the events of a service and/or a job, None matches everything
+def createFilter(service = None, job = None):
+    def matches(event):
+        if service is not None and event.get("service") != service:
+            return False
+        if job is not None and event.get("job") != job:
+            return False
+        return True
+    return matches
+
+# Class definition
+class eventBus:
+    def __init__(self, history = None):
+        self.__condition = threading.Condition()
+        self.__events = deque(maxlen=config.eventhistory if history is None else history)
+        self.__lastId = 0
+        self.__subscribers = []
+
+    # Publishes an event to all waiting clients and subscribers
+    def publish(self, type, **fields):
+        with self.__condition:
+            self.__lastId += 1
+            event = {"id":self.__lastId,"time":time.time(),"type":type}
+            event.update(fields)
+            self.__events.append(event)
+            self.__condition.notify_all()
+            subscribers = list(self.__subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber(event)
+            except Exception as e:
+                print("Event subscriber failed: " + str(e))
+
+    # Calls the function with every published event, on the publishing thread
+    def subscribe(self, function):
+        with self.__condition:
+            self.__subscribers.append(function)
+
+    # Returns the id of the newest event
+    def getLastId(self):
+        with self.__condition:
+            return self.__lastId
+
+    # Returns the matching events newer than since, if older events have already been dropped and the newest event id
+    def getSince(self, since, matches = None):
+        with self.__condition:
+            return self.__collect(since, matches)
+
+    # Like getSince, but blocks up to timeout seconds until a matching event arrives
+    def wait(self, since, timeout, matches = None):
+        deadline = time.monotonic() + timeout
+        with self.__condition:
+            while True:
+                events, missed, lastId = self.__collect(since, matches)
+                remaining = deadline - time.monotonic()
+                if len(events) > 0 or missed or remaining <= 0:
+                    return events, missed, lastId
+                self.__condition.wait(remaining)
+
+    # PRIVATE HELPER FUNCTIONS
+    # Collects the matching events newer than since, the condition has to be held
+    def __collect(self, since, matches):
+        missed = len(self.__events) > 0 and self.__events[0]["id"] > since + 1
+        if since >= self.__lastId:
+            return [], False, self.__lastId
+        return [event for event in self.__events if event["id"] > since and (matches is None or matches(event))], missed, self.__lastId
@@ -3,32 +3,309 @@
 # SchoolConnect Server-Manager - filesystem helpers
 # © 2019 Johannes Kreutz.
 
+# Folders are not deleted on the calling thread: they are renamed into a trash folder on the same filesystem,
+# which is atomic and instant, and a background reaper deletes them afterwards. The trash folder is
+# config.trashpath if it is on the same filesystem and belongs to this user, otherwise a .trash folder next to the
+# removed element. Such .trash folders are recorded in a file next to config.trashpath, so the leftovers of a crashed
+# or restarted process are deleted as well. Scripts exiting right after a removal call waitForTrash() or use
+# deleteTree() directly.
+
 # Include dependencies
+import json
 import os
-from pathlib import Path
+import stat
+import tempfile
+import threading
+import uuid
+
+# Include modules
+import config
+
+# Folders in which no .trash folder may be created, docker would take it for a volume. Removals there are synchronous
+noTrashFolders = ["/var/lib/docker/"]
+
+# Shared instance
+sharedTrash = None
+sharedLock = threading.Lock()
+
+# Returns the shared trash of this process
+def getTrash():
+    global sharedTrash
+    with sharedLock:
+        if sharedTrash is None:
+            sharedTrash = trash()
+        return sharedTrash
+
+# Waits until the trash of this process has been deleted
+def waitForTrash():
+    with sharedLock:
+        instance = sharedTrash
+    if instance is not None:
+        instance.drain()
 
 # Class definition
 class filesystem:
-    # Removes given element, wether it's a file or folder
+    # Removes given element, wether it's a file or folder. Folders are moved to the trash and deleted in the background
     @staticmethod
     def removeElement(path):
-        if os.path.exists(path):
-            if os.path.isdir(path):
-                filesystem.emptyFolderWorker(Path(path))
-            else:
-                os.remove(path)
+        if os.path.islink(path):
+            os.remove(path)
+        elif os.path.isdir(path):
+            getTrash().put(path)
+        elif os.path.exists(path):
+            os.remove(path)
 
-    # Deletes everythin inside the given folder
+    # Deletes the given folder including its content, in the background
     @staticmethod
     def emptyFolder(path):
-        filesystem.emptyFolderWorker(Path(path))
+        getTrash().put(str(path))
 
-    # Helper
+    # Deletes a file or folder on the calling thread, calling onFile with the size of every removed file. Works
+    # iteratively on directory file descriptors, so neither deep trees nor symlinks swapped in during the walk are a problem
     @staticmethod
-    def emptyFolderWorker(path):
-        for sub in path.iterdir():
-            if sub.is_dir():
-                filesystem.emptyFolderWorker(sub)
-            else:
-                sub.unlink()
-        path.rmdir()
+    def deleteTree(path, onFile = None):
+        path = str(path).rstrip("/")
+        parentFd = os.open(os.path.dirname(path) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        stack = []
+        try:
+            info = os.stat(os.path.basename(path), dir_fd=parentFd, follow_symlinks=False)
+            if not stat.S_ISDIR(info.st_mode):
+                os.unlink(os.path.basename(path), dir_fd=parentFd)
+                if onFile is not None:
+                    onFile(info.st_size)
+                return
+            # Every stack entry is a folder with the descriptor of its parent and its own descriptor once opened.
+            # A folder is removed when it is on top again after all its subfolders have been processed.
+            stack = [[parentFd, os.path.basename(path), None]]
+            while len(stack) > 0:
+                top = stack[-1]
+                if top[2] is None:
+                    top[2] = os.open(top[1], os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=top[0])
+                    subfolders = []
+                    with os.scandir(top[2]) as iterator:
+                        for entry in iterator:
+                            if entry.is_dir(follow_symlinks=False):
+                                subfolders.append(entry.name)
+                            else:
+                                size = entry.stat(follow_symlinks=False).st_size
+                                os.unlink(entry.name, dir_fd=top[2])
+                                if onFile is not None:
+                                    onFile(size)
+                    if len(subfolders) > 0:
+                        stack.extend([top[2], name, None] for name in subfolders)
+                        continue
+                stack.pop()
+                os.close(top[2])
+                os.rmdir(top[1], dir_fd=top[0])
+        finally:
+            for entry in stack:
+                if entry[2] is not None:
+                    try:
+                        os.close(entry[2])
+                    except OSError:
+                        pass
+            os.close(parentFd)
+
+    # Atomically replaces the file at the given path with the given content
+    @staticmethod
+    def writeAtomic(path, content):
+        directory = os.path.dirname(path)
+        fd, tmpPath = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", dir=directory if directory != "" else ".")
+        try:
+            if os.path.exists(path):
+                os.chmod(tmpPath, os.stat(path).st_mode & 0o777)
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmpPath, path)
+        except:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
+# Moves folders out of the way and deletes them on a background thread
+class trash:
+    def __init__(self):
+        self.__lock = threading.Condition()
+        self.__queue = []
+        self.__thread = None
+        self.__busy = False
+        self.__pendingBytes = 0
+        self.__pendingItems = 0
+        self.__reapedBytes = 0
+        self.__reapedItems = 0
+        self.__failures = 0
+        # .trash folders which may still contain something, also the ones of earlier runs
+        self.__recordPath = config.trashpath.rstrip("/") + "folders.json"
+        self.__folders = set(self.__readRecord())
+        # Leftovers of an earlier run are deleted as well
+        if self.__ownsTrashPath():
+            self.__enqueueFolder(config.trashpath.rstrip("/"))
+        for folder in sorted(self.__folders):
+            self.__enqueueFolder(folder)
+
+    # Moves a folder into the trash and returns immediately. Deletes it on the calling thread if it can not be moved
+    def put(self, path):
+        path = os.path.abspath(path)
+        for folder in self.__candidates(path):
+            try:
+                # The reaper removes empty .trash folders while holding the lock, so a folder can not vanish in between
+                with self.__lock:
+                    if os.path.basename(folder) == ".trash":
+                        self.__remember(folder)
+                    os.makedirs(folder, exist_ok=True)
+                    os.rename(path, os.path.join(folder, uuid.uuid4().hex))
+            except OSError:
+                continue
+            self.__enqueueFolder(folder)
+            return
+        filesystem.deleteTree(path)
+
+    # Blocks until everything in the trash has been deleted
+    def drain(self):
+        with self.__lock:
+            while self.__busy or len(self.__queue) > 0:
+                self.__lock.wait()
+
+    # Returns counters of the pending and deleted trash
+    def getStats(self):
+        with self.__lock:
+            return {"pendingBytes":self.__pendingBytes,"pendingItems":self.__pendingItems,"reapedBytes":self.__reapedBytes,"reapedItems":self.__reapedItems,"failures":self.__failures}
+
+    # PRIVATE HELPER FUNCTIONS
+    # Returns the trash folders to try for a path, only ones on the same filesystem allow an atomic rename
+    def __candidates(self, path):
+        parent = os.path.dirname(path)
+        candidates = []
+        try:
+            device = os.stat(parent).st_dev
+            trashParent = os.path.dirname(config.trashpath.rstrip("/"))
+            if os.stat(trashParent).st_dev == device and not (path + "/").startswith(config.trashpath) and self.__ownsTrashPath():
+                candidates.append(config.trashpath.rstrip("/"))
+        except OSError:
+            pass
+        if os.path.basename(parent) != ".trash" and not any((parent + "/").startswith(folder) for folder in noTrashFolders):
+            candidates.append(os.path.join(parent, ".trash"))
+        return candidates
+
+    # Returns if config.trashpath exists and belongs to this user, a trash of another user could not be deleted
+    def __ownsTrashPath(self):
+        try:
+            return os.stat(config.trashpath).st_uid == os.geteuid()
+        except OSError:
+            return False
+
+    # Records a .trash folder before something is moved into it, the lock has to be held
+    def __remember(self, folder):
+        if not folder in self.__folders:
+            self.__folders.add(folder)
+            self.__writeRecord()
+
+    # Drops a .trash folder which has been removed from the record, the lock has to be held
+    def __forget(self, folder):
+        if folder in self.__folders:
+            self.__folders.discard(folder)
+            self.__writeRecord()
+
+    # Returns the recorded .trash folders
+    def __readRecord(self):
+        try:
+            with open(self.__recordPath, "r") as f:
+                folders = json.loads(f.read())
+        except (OSError, ValueError):
+            return []
+        return [folder for folder in folders if isinstance(folder, str) and os.path.basename(folder) == ".trash"]
+
+    # Stores the recorded .trash folders, merged with the ones other processes recorded meanwhile
+    def __writeRecord(self):
+        folders = set(folder for folder in self.__readRecord() if os.path.isdir(folder)) | self.__folders
+        try:
+            filesystem.writeAtomic(self.__recordPath, json.dumps(sorted(folders)))
+        except OSError as e:
+            print("Recording trash folders failed: " + str(e))
+
+    # Queues all entries of a trash folder for deletion and starts the reaper if needed
+    def __enqueueFolder(self, folder):
+        with self.__lock:
+            if not folder in self.__queue:
+                self.__queue.append(folder)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__reap, daemon=True)
+                self.__thread.start()
+            self.__lock.notify_all()
+
+    # Deletes the content of all queued trash folders, then waits for new ones
+    def __reap(self):
+        while True:
+            with self.__lock:
+                while len(self.__queue) == 0:
+                    self.__busy = False
+                    self.__lock.notify_all()
+                    self.__lock.wait()
+                folder = self.__queue.pop(0)
+                self.__busy = True
+            try:
+                names = os.listdir(folder)
+            except FileNotFoundError:
+                with self.__lock:
+                    self.__forget(folder)
+                continue
+            except OSError:
+                continue
+            # Measuring first makes the pending size visible before the slow part starts
+            sizes = {}
+            for name in names:
+                sizes[name] = self.__measure(os.path.join(folder, name))
+                with self.__lock:
+                    self.__pendingBytes += sizes[name]
+                    self.__pendingItems += 1
+            for name in names:
+                self.__reapItem(os.path.join(folder, name), sizes[name])
+            if os.path.basename(folder) == ".trash":
+                with self.__lock:
+                    try:
+                        os.rmdir(folder)
+                        self.__forget(folder)
+                    except OSError:
+                        pass
+
+    # Deletes a single element of the trash and updates the counters
+    def __reapItem(self, path, size):
+        removed = 0
+        # Counts a deleted file
+        def onFile(fileSize):
+            nonlocal removed
+            removed += fileSize
+            with self.__lock:
+                self.__pendingBytes -= fileSize
+                self.__reapedBytes += fileSize
+        try:
+            filesystem.deleteTree(path, onFile)
+        except OSError as e:
+            print("Deleting trash " + path + " failed: " + str(e))
+            with self.__lock:
+                self.__failures += 1
+                self.__pendingBytes -= size - removed
+        with self.__lock:
+            self.__pendingItems -= 1
+            self.__reapedItems += 1
+
+    # Returns the size of all files below a path, without following symlinks
+    def __measure(self, path):
+        total = 0
+        stack = [path]
+        while len(stack) > 0:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as iterator:
+                    for entry in iterator:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+            except NotADirectoryError:
+                total += os.lstat(current).st_size
+            except OSError:
+                pass
+        return total
@@ -13,17 +13,10 @@
 
 # Include dependencies
 import docker
-import urllib.request
-import os
-from subprocess import Popen
 
 # Include modules
-import config
-import modules.filesystem as fs
-import modules.essentials as ess
-
-# Create docker connection
-client = docker.from_env()
+import modules.artifactcache as artifactcache
+import modules.dockerclient as dockerclient
 
 # Class definition
 class image:
@@ -32,7 +25,7 @@ class image:
         self.__name = name
         if exists:
             try:
-                self.__image = client.images.get(name=name)
+                self.__image = dockerclient.getClient().images.get(name=name)
                 self.__status = 1
             except docker.errors.ImageNotFound:
                 self.__status = 3
@@ -51,47 +44,42 @@ class image:
         if "prebuilt" in self.__wantedVersion:
             return self.__pull(self.__wantedVersion["prebuilt"]["name"] + ":" + self.__wantedVersion["prebuilt"]["version"])
         elif "url" in self.__wantedVersion:
-            return self.__build(self.__wantedVersion["url"])
+            return self.__build(self.__wantedVersion["url"], True, self.__wantedVersion.get("sha256"))
         else:
             return self.__build(self.__wantedVersion["path"], False)
 
     # Pulls an image from the docker hub
     def __pull(self, name):
         try:
-            self.__image = client.images.pull(name)
+            self.__image = dockerclient.getLongClient().images.pull(name)
             self.__status = 1
             return self.__image.id
         except docker.errors.APIError:
             self.__status = 5
             return False
 
-    # Builds an image from a given url
-    def __build(self, url, download = True):
+    # Builds an image from a given url, sha256 is the checksum of the archive if the service description lists one
+    def __build(self, url, download = True, sha256 = None):
         if download:
-            if not os.path.exists(config.servicepath + "buildcache"):
-                os.makedirs(config.servicepath + "buildcache")
-            randomString = ess.essentials.randomString(10)
-            fs.filesystem.removeElement(config.servicepath + "buildcache/" + self.__name + "_" + randomString)
-            fs.filesystem.removeElement(config.servicepath + "buildcache/" + self.__name + "_" + randomString + ".tar.gz")
-            os.makedirs(config.servicepath + "buildcache/" + self.__name + "_" + randomString)
-            urllib.request.urlretrieve(url, config.servicepath + "buildcache/" + self.__name + "_" + randomString + ".tar.gz")
-            tar = Popen(["/bin/tar", "-zxf", config.servicepath + "buildcache/" + self.__name + "_" + randomString + ".tar.gz", "--directory", config.servicepath + "buildcache/" + self.__name + "_" + randomString])
-            tar.wait()
-            fs.filesystem.removeElement(config.servicepath + "buildcache/" + self.__name + "_" + randomString + ".tar.gz")
-            dircount = 0
-            sourcePath = ""
-            for filename in os.listdir(config.servicepath + "buildcache/" + self.__name + "_" + randomString):
-                if os.path.isdir(config.servicepath + "buildcache/" + self.__name + "_" + randomString + "/" + filename):
-                    sourcePath = config.servicepath + "buildcache/" + self.__name + "_" + randomString + "/" + filename
-                    dircount += 1
-            if dircount != 1:
+            # Build contexts are shared through the artifact cache. Rebuilds reuse the extracted tree right away if the
+            # checksum is known, otherwise after the server confirmed that the archive did not change
+            try:
+                with artifactcache.getArtifactCache().tree(url, sha256) as cachedPath:
+                    sourcePath = artifactcache.getSingleSubdir(cachedPath)
+                    if sourcePath == False:
+                        self.__status = 4
+                        return False
+                    return self.__buildFromPath(sourcePath)
+            except (OSError, ValueError) as e:
+                self.__status = 4
+                print("Downloading build context failed: " + str(e))
                 return False
-        else:
-            sourcePath = url
+        return self.__buildFromPath(url)
+
+    # Builds an image from a local build context
+    def __buildFromPath(self, sourcePath):
         try:
-            self.__image = client.images.build(path=sourcePath, rm=True, pull=True)[0]
-            if download:
-                fs.filesystem.removeElement(config.servicepath + "buildcache/" + self.__name + "_" + randomString)
+            self.__image = dockerclient.getLongClient().images.build(path=sourcePath, rm=True, pull=True)[0]
             self.__status = 1
             return self.__image.id
         except docker.errors.BuildError:
@@ -108,6 +96,18 @@ class image:
             return self.__image.id
         return False
 
+    # Returns the image status
+    def getStatus(self):
+        switcher = {
+            0: "undefined",
+            1: "built",
+            2: "building",
+            3: "notfound",
+            4: "builderror",
+            5: "error"
+        }
+        return switcher.get(self.__status, False)
+
     # Deletes this image from the local machine
     def delete(self):
-        client.images.remove(image=self.__name)
+        dockerclient.getClient().images.remove(image=self.__name)
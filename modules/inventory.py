@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - bulk inventory of the docker objects managed by the servermanager
+# © 2021 Johannes Kreutz.
+
+# Include modules
+import modules.dockerclient as dockerclient
+
+# Label names attached to every object the servermanager creates
+serviceLabel = "org.schoolconnect.service"
+versionLabel = "org.schoolconnect.version"
+roleLabel = "org.schoolconnect.role"
+
+# Returns the label set for an object of the given service, version and role
+def labels(service, version, role):
+    return {
+        serviceLabel: service if service is not None else "",
+        versionLabel: version if version is not None else "",
+        roleLabel: role,
+    }
+
+# Class definition
+class inventory:
+    def __init__(self):
+        self.__containers = {}
+        self.__volumes = {}
+        self.__networks = {}
+
+    # Reads the inventory with one list call per object type
+    def load(self):
+        containers = {}
+        for ct in dockerclient.getClient().containers.list(all=True, sparse=True, filters={"label": serviceLabel}):
+            containers[ct.id] = ct
+        volumes = {}
+        for vol in dockerclient.getClient().volumes.list():
+            volumes[vol.id] = vol
+        networks = {}
+        for nw in dockerclient.getClient().networks.list():
+            networks[nw.id] = nw
+        self.__containers = containers
+        self.__volumes = volumes
+        self.__networks = networks
+        return self
+
+    # Returns the docker container object with the given id, or None if it is not part of the inventory
+    def getContainer(self, id):
+        return self.__containers.get(id)
+
+    # Returns the docker volume object with the given id, or None if it is not part of the inventory
+    def getVolume(self, id):
+        return self.__volumes.get(id)
+
+    # Returns the docker network object with the given id, or None if it is not part of the inventory
+    def getNetwork(self, id):
+        return self.__networks.get(id)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - progress and cancellation of long running jobs
+# © 2021 Johannes Kreutz.
+
+# Include dependencies
+import threading
+import time
+
+# Raised inside a job once it has been cancelled
+class jobCancelled(Exception):
+    pass
+
+# Class definition
+class jobControl:
+    def __init__(self, listener = None, interval = 0.5):
+        # The listener receives the counters as a dict, at most once per interval seconds
+        self.__listener = listener
+        self.__interval = interval
+        self.__lock = threading.Lock()
+        self.__cancelled = threading.Event()
+        self.__files = 0
+        self.__bytes = 0
+        self.__lastReport = 0
+
+    # Requests the job to stop at the next check
+    def cancel(self):
+        self.__cancelled.set()
+
+    # Returns if the job has been cancelled
+    def isCancelled(self):
+        return self.__cancelled.is_set()
+
+    # Raises jobCancelled if the job has been cancelled
+    def check(self):
+        if self.__cancelled.is_set():
+            raise jobCancelled()
+
+    # Counts processed files and bytes, reports them to the listener and stops a cancelled job
+    def advance(self, files, bytes):
+        self.check()
+        report = None
+        with self.__lock:
+            self.__files += files
+            self.__bytes += bytes
+            now = time.monotonic()
+            if self.__listener is not None and now - self.__lastReport >= self.__interval:
+                self.__lastReport = now
+                report = {"files":self.__files,"bytes":self.__bytes}
+        if report is not None:
+            self.__listener(report)
+
+    # Returns the counters as a dict
+    def get(self):
+        with self.__lock:
+            return {"files":self.__files,"bytes":self.__bytes}
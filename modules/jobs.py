@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - job manager for long running service operations
+# © 2021 Johannes Kreutz.
+
+# Every mutating operation runs as a job with an id. Jobs run on a bounded pool, which is the global concurrency
+# limit, and jobs of the same service run one after another in the order they were submitted.
+# Job status: queued, running, done, failed, cancelled
+# Status changes and steps of a job are published as job events, the progress of running jobs as progress events.
+
+# Include dependencies
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Include modules
+import config
+import modules.events as events
+from modules.jobcontrol import jobCancelled
+
+# Shared instance
+sharedManager = None
+sharedLock = threading.Lock()
+
+# Returns the shared job manager
+def getJobManager():
+    global sharedManager
+    with sharedLock:
+        if sharedManager is None:
+            sharedManager = jobManager()
+        return sharedManager
+
+# A single operation on a service
+class job:
+    def __init__(self, service, action, function, args):
+        self.__lock = threading.Lock()
+        self.__finished = threading.Event()
+        self.__cancelled = threading.Event()
+        self.__function = function
+        self.__args = args
+        self.__cancelHooks = []
+        self.__discardHooks = []
+        self.__finishHooks = []
+        self.__progress = None
+        self.__lastProgress = None
+        self.__id = uuid.uuid4().hex
+        self.__service = service
+        self.__action = action
+        self.__status = "queued"
+        self.__created = time.time()
+        self.__started = None
+        self.__finishedAt = None
+        self.__steps = []
+        self.__result = None
+        self.__error = None
+
+    # Returns the id of this job
+    def getId(self):
+        return self.__id
+
+    # Returns the name of the service this job works on
+    def getService(self):
+        return self.__service
+
+    # Returns the status of this job
+    def getStatus(self):
+        with self.__lock:
+            return self.__status
+
+    # Returns if this job is done, failed or cancelled
+    def isFinished(self):
+        return self.__finished.is_set()
+
+    # Starts the next step of this job, stops the job here if it has been cancelled
+    def step(self, name):
+        self.check()
+        now = time.time()
+        with self.__lock:
+            if len(self.__steps) > 0 and self.__steps[-1]["finished"] is None:
+                self.__steps[-1]["finished"] = now
+            self.__steps.append({"name":name,"started":now,"finished":None})
+        self.publish()
+
+    # Raises jobCancelled if this job has been cancelled
+    def check(self):
+        if self.__cancelled.is_set():
+            raise jobCancelled()
+
+    # Sets a function returning the progress of the running step as a dict
+    def setProgress(self, function):
+        self.__progress = function
+
+    # Registers a function which is called when this job is cancelled while running
+    def onCancel(self, function):
+        with self.__lock:
+            self.__cancelHooks.append(function)
+
+    # Registers a function which is called when this job is cancelled before it started
+    def onDiscard(self, function):
+        with self.__lock:
+            discarded = self.__finished.is_set() and self.__started is None
+            if not discarded:
+                self.__discardHooks.append(function)
+        if discarded:
+            function()
+
+    # Registers a function which is called with this job once it is done, failed or cancelled
+    def onFinish(self, function):
+        with self.__lock:
+            finished = self.__finished.is_set()
+            if not finished:
+                self.__finishHooks.append(function)
+        if finished:
+            function(self)
+
+    # Cancels this job. Returns false if it has already finished
+    def cancel(self):
+        with self.__lock:
+            if self.__finished.is_set():
+                return False
+            self.__cancelled.set()
+            hooks = list(self.__cancelHooks) if self.__status == "running" else []
+        for hook in hooks:
+            hook()
+        return True
+
+    # Blocks until this job has finished and returns its result
+    def wait(self, timeout = None):
+        self.__finished.wait(timeout)
+        return self.__result
+
+    # Returns this job as a dict
+    def toDict(self):
+        with self.__lock:
+            response = {"id":self.__id,"service":self.__service,"action":self.__action,"status":self.__status,"created":self.__created,"started":self.__started,"finished":self.__finishedAt,"steps":[dict(step) for step in self.__steps],"result":self.__result,"error":self.__error}
+        if self.__progress is not None and response["status"] == "running":
+            response["progress"] = self.__progress()
+        return response
+
+    # Publishes the state of this job as job event
+    def publish(self):
+        events.getEventBus().publish("job", service=self.__service, job=self.__id, details=self.toDict())
+
+    # Publishes the progress of this job as progress event if it changed since the last call
+    def publishProgress(self):
+        if self.__progress is None or self.getStatus() != "running":
+            return
+        progress = self.__progress()
+        if progress != self.__lastProgress:
+            self.__lastProgress = progress
+            events.getEventBus().publish("progress", service=self.__service, job=self.__id, progress=progress)
+
+    # Runs the job function, called by the job manager
+    def run(self):
+        with self.__lock:
+            cancelled = self.__cancelled.is_set()
+            if cancelled:
+                self.__finish("cancelled", None, None)
+            else:
+                self.__status = "running"
+                self.__started = time.time()
+        self.publish()
+        if cancelled:
+            for hook in self.__discardHooks:
+                hook()
+            self.__callFinishHooks()
+            return
+        try:
+            result = self.__function(self, *self.__args)
+            # Service operations report failures by returning False
+            status = "failed" if result is False else "done"
+            error = None
+        except jobCancelled:
+            status, result, error = "cancelled", None, None
+        except Exception as e:
+            print("Job " + self.__action + " of " + str(self.__service) + " failed: " + str(e))
+            status, result, error = "failed", None, str(e)
+        with self.__lock:
+            self.__finish(status, result, error)
+        self.publish()
+        self.__callFinishHooks()
+
+    # Stores the outcome and wakes up waiting threads, the lock has to be held
+    def __finish(self, status, result, error):
+        now = time.time()
+        if len(self.__steps) > 0 and self.__steps[-1]["finished"] is None:
+            self.__steps[-1]["finished"] = now
+        self.__status = status
+        self.__result = result if isinstance(result, (str, int, float, bool, dict, list)) or result is None else str(result)
+        self.__error = error
+        self.__finishedAt = now
+        self.__finished.set()
+
+    # Calls the functions registered with onFinish, after the job has finished
+    def __callFinishHooks(self):
+        with self.__lock:
+            hooks = list(self.__finishHooks)
+        for hook in hooks:
+            try:
+                hook(self)
+            except Exception as e:
+                print("Finish hook of job " + self.__action + " of " + str(self.__service) + " failed: " + str(e))
+
+# Class definition
+class jobManager:
+    def __init__(self, workers = None, history = None):
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=config.jobworkers if workers is None else workers)
+        self.__history = config.jobhistory if history is None else history
+        self.__reporter = None
+        self.__jobs = {}
+        self.__finished = deque()
+        # Waiting jobs by service, the first job of every queue is the one running or dispatched
+        self.__queues = {}
+
+    # Queues a function as a job of the given service and returns the job. The function gets the job as first argument
+    def submit(self, service, action, function, *args):
+        newJob = job(service, action, function, args)
+        newJob.publish()
+        with self.__lock:
+            self.__jobs[newJob.getId()] = newJob
+            queue = self.__queues.setdefault(service, deque())
+            queue.append(newJob)
+            if len(queue) == 1:
+                self.__executor.submit(self.__run, newJob)
+            if self.__reporter is None:
+                self.__reporter = threading.Thread(target=self.__reportProgress, daemon=True)
+                self.__reporter.start()
+        return newJob
+
+    # Returns the job with the given id, or None
+    def get(self, id):
+        with self.__lock:
+            return self.__jobs.get(id)
+
+    # Returns all known jobs, optionally only the ones of a service, oldest first
+    def list(self, service = None):
+        with self.__lock:
+            jobs = list(self.__jobs.values())
+        return [listed for listed in jobs if service is None or listed.getService() == service]
+
+    # Returns if the service has a queued or running job
+    def isBusy(self, service):
+        with self.__lock:
+            return len(self.__queues.get(service, ())) > 0
+
+    # Cancels a job, queued jobs never start. Returns false if it does not exist or has finished already
+    def cancel(self, id):
+        found = self.get(id)
+        return found.cancel() if found is not None else False
+
+    # PRIVATE HELPER FUNCTIONS
+    # Runs a job on the pool and dispatches the next job of the same service afterwards
+    def __run(self, runningJob):
+        try:
+            runningJob.run()
+        finally:
+            with self.__lock:
+                queue = self.__queues[runningJob.getService()]
+                queue.popleft()
+                if len(queue) > 0:
+                    self.__executor.submit(self.__run, queue[0])
+                else:
+                    del self.__queues[runningJob.getService()]
+                # Keep the newest finished jobs only
+                self.__finished.append(runningJob.getId())
+                while len(self.__finished) > self.__history:
+                    self.__jobs.pop(self.__finished.popleft(), None)
+
+    # Publishes the progress of the running jobs periodically, stops when no job is left
+    def __reportProgress(self):
+        while True:
+            time.sleep(config.eventprogressinterval)
+            with self.__lock:
+                running = [queue[0] for queue in self.__queues.values()]
+                if len(running) == 0:
+                    self.__reporter = None
+                    return
+            for runningJob in running:
+                runningJob.publishProgress()
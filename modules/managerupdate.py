@@ -4,17 +4,17 @@
 # © 2019 - 2020 Johannes Kreutz.
 
 # Include dependencies
-import urllib.request
 import os
 from subprocess import Popen
-from pathlib import Path
 
 # Include modules
 import config
 import modules.repository as repository
+import modules.filesystem as fs
+from modules.download import download
 
 # Manager objects
-repo = repository.repository()
+repo = repository.getRepository()
 
 # Class definition
 class managerupdate:
@@ -22,25 +22,20 @@ class managerupdate:
     @staticmethod
     def installUpdate(version):
         managerupdate.backup()
-        managerupdate.downloadVersion(repo.getUrl("servermanager", version), version)
+        try:
+            managerupdate.downloadVersion(repo.getUrl("servermanager", version), version, repo.getChecksum("servermanager", version))
+        except (OSError, ValueError) as e:
+            print("Downloading servermanager " + version + " failed: " + str(e))
+            return False
         managerupdate.doUpdateInstallation()
-
-    # Helper function to empty and delete a folder
-    @staticmethod
-    def emptyFolder(path):
-        for sub in path.iterdir():
-            if sub.is_dir():
-                managerupdate.emptyFolder(sub)
-            else:
-                sub.unlink()
-        path.rmdir()
+        return True
 
     # Backup old version
     @staticmethod
     def backup():
         # Delete old backups
         if os.path.exists(config.backuppath + "backup"):
-            managerupdate.emptyFolder(Path(config.backuppath + "backup"))
+            fs.filesystem.removeElement(config.backuppath + "backup")
         # Create a new backup folder
         os.makedirs(config.backuppath + "backup", 0o777)
         # Copy actual servermanager executable files
@@ -49,19 +44,13 @@ class managerupdate:
 
     # Download and extract a new servermanager version
     @staticmethod
-    def downloadVersion(url, version):
+    def downloadVersion(url, version, sha256 = None):
         # Cleanup first
         if os.path.exists(config.backuppath + "update"):
-            managerupdate.emptyFolder(Path(config.backuppath + "update"))
-        # Download and extract
+            fs.filesystem.removeElement(config.backuppath + "update")
+        # Download and extract the servermanager/ folder of the release straight into the update folder
         os.makedirs(config.backuppath + "update", 0o777)
-        urllib.request.urlretrieve(url, config.backuppath + "servermanager_update.tar.gz")
-        tar = Popen(["/bin/tar", "-zxf", config.backuppath + "servermanager_update.tar.gz", "--directory", config.backuppath])
-        tar.wait()
-        os.remove(config.backuppath + "servermanager_update.tar.gz")
-        copy = Popen(["cp", "-R", config.backuppath + "servermanager/.", config.backuppath + "update"])
-        copy.wait()
-        managerupdate.emptyFolder(Path(config.backuppath + "servermanager"))
+        download.extractTo(url, config.backuppath + "update", sha256, 1)
 
     # Install a downloaded version
     @staticmethod
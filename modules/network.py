@@ -6,22 +6,24 @@
 # Include dependencies
 import docker
 
-# Create docker connection
-client = docker.from_env()
+# Include modules
+import modules.dockerclient as dockerclient
 
 # Class definition
 class network:
-    def __init__(self, exists, id, name, internal):
-        if exists:
+    def __init__(self, exists, id, name, internal, labels = None, dockerObject = None):
+        if dockerObject is not None:
+            self.__network = dockerObject
+        elif exists:
             try:
-                self.__network = client.networks.get(network_id=id)
+                self.__network = dockerclient.getClient().networks.get(network_id=id)
             except docker.errors.NotFound:
                 print("Network lookup error. No network with the given id existing.")
             except docker.errors.APIError:
                 print("Didn't expect to get here. Figure out why this code ran.")
         else:
             try:
-                self.__network = client.networks.create(name=name, driver="bridge", check_duplicate=True, internal=internal)
+                self.__network = dockerclient.getClient().networks.create(name=name, driver="bridge", check_duplicate=True, internal=internal, labels=labels)
             except docker.errors.APIError:
                 print("Network creation error. Check inputs.")
 
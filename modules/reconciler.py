@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - startup reconciler
+# © 2021 Johannes Kreutz.
+
+# Include dependencies
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Include modules
+import config
+import modules.service as service
+import modules.inventory as inventory
+
+# Class definition
+class reconciler:
+    def __init__(self, workers = None):
+        self.__workers = config.startupworkers if workers is None else workers
+        self.__timings = {}
+        self.__inventory = None
+        self.__lock = threading.Lock()
+
+    # Loads the services with the given names concurrently and drives their containers to the wanted state. Returns the loaded services in the given order
+    def run(self, names):
+        services = []
+        if len(names) == 0:
+            return services
+        self.__inventory = inventory.inventory().load()
+        with ThreadPoolExecutor(max_workers=min(self.__workers, len(names))) as pool:
+            futures = [pool.submit(self.__reconcileService, name) for name in names]
+            for name, future in zip(names, futures):
+                try:
+                    services.append(future.result())
+                except Exception as e:
+                    print("Loading service " + name + " failed: " + str(e))
+        return services
+
+    # Returns the load and reconcile durations in seconds for every service
+    def getTimings(self):
+        with self.__lock:
+            return dict(self.__timings)
+
+    # PRIVATE HELPER FUNCTIONS
+    # Loads and reconciles a single service, measuring both steps
+    def __reconcileService(self, name):
+        begin = time.monotonic()
+        newService = service.service(name, False, self.__inventory)
+        loaded = time.monotonic()
+        newService.reconcile()
+        done = time.monotonic()
+        with self.__lock:
+            self.__timings[name] = {"load":round(loaded - begin, 3),"reconcile":round(done - loaded, 3)}
+        print("Reconciled service " + name + " in " + str(round(done - begin, 2)) + "s (load " + str(round(loaded - begin, 2)) + "s, containers " + str(round(done - loaded, 2)) + "s)")
+        return newService
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - registry of the installed services
+# © 2021 Johannes Kreutz.
+
+# Include dependencies
+import threading
+
+# Class definition
+class serviceRegistry:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__services = {}
+
+    # Adds a service under the given name. Returns false if another service already uses this name
+    def add(self, name, service):
+        with self.__lock:
+            if name in self.__services and self.__services[name] is not service:
+                return False
+            self.__services[name] = service
+            return True
+
+    # Removes the service with the given name, returns it or None if there was none
+    def remove(self, name):
+        with self.__lock:
+            return self.__services.pop(name, None)
+
+    # Removes the service with the given name only if it is still the given service, returns if it was removed
+    def removeIf(self, name, service):
+        with self.__lock:
+            if self.__services.get(name) is not service:
+                return False
+            del self.__services[name]
+            return True
+
+    # Returns the service with the given name, or False
+    def get(self, name):
+        with self.__lock:
+            return self.__services.get(name, False)
+
+    # Returns if a service with the given name exists
+    def contains(self, name):
+        with self.__lock:
+            return name in self.__services
+
+    # Returns a snapshot of all services in the order they were added, safe to iterate while services change
+    def list(self):
+        with self.__lock:
+            return list(self.__services.values())
+
+    # Returns the names of all services
+    def names(self):
+        with self.__lock:
+            return list(self.__services.keys())
@@ -4,61 +4,213 @@
 # © 2019 - 2020 Johannes Kreutz.
 
 # Include dependencies
-from pathlib import Path
+from bisect import bisect_right
+from functools import lru_cache
 import json
+import os
+import threading
 import requests
 import time
 
 # Include modules
 import config
+import modules.filesystem as fs
+
+# Shared instance
+sharedRepository = None
+sharedLock = threading.Lock()
+
+# Returns the process-wide repository instance, creating it on first use
+def getRepository():
+    global sharedRepository
+    with sharedLock:
+        if sharedRepository is None:
+            sharedRepository = repository()
+        return sharedRepository
+
+# Parses a version string like 1.2.0 or 1.3.0-beta.2 into a comparable tuple. Pre-releases sort before their release
+@lru_cache(maxsize=1024)
+def parseVersion(version):
+    core, _, prerelease = version.split("+")[0].partition("-")
+    numbers = []
+    for part in (core.split(".") + ["0", "0", "0"])[:3]:
+        numbers.append(int(part) if part.isdigit() else 0)
+    if prerelease == "":
+        return (numbers[0], numbers[1], numbers[2], 1, ())
+    identifiers = []
+    for part in prerelease.split("."):
+        # Numeric identifiers sort before alphanumeric ones, like in semver
+        identifiers.append((0, int(part), "") if part.isdigit() else (1, 0, part))
+    return (numbers[0], numbers[1], numbers[2], 0, tuple(identifiers))
+
+# Builds the lookup index for one module: versions by name, sorted by version and sorted by minimum required version
+def buildModuleIndex(module):
+    entries = [version for version in module.get("versions", []) if "version" in version]
+    byVersion = {}
+    for entry in entries:
+        byVersion[entry["version"]] = entry
+    sortedEntries = sorted(entries, key=lambda entry: parseVersion(entry["version"]))
+    byRequired = sorted(entries, key=lambda entry: parseVersion(entry.get("required", "0.0.0")))
+    # For every prefix of byRequired, remember the newest version it contains
+    bestCompatible = []
+    best = None
+    for entry in byRequired:
+        if best is None or parseVersion(entry["version"]) > parseVersion(best["version"]):
+            best = entry
+        bestCompatible.append(best)
+    return {
+        "byVersion": byVersion,
+        "sorted": sortedEntries,
+        "requiredKeys": [parseVersion(entry.get("required", "0.0.0")) for entry in byRequired],
+        "bestCompatible": bestCompatible,
+    }
 
 # Class definition
 class repository:
     def __init__(self):
-        self.update()
+        self.__repo = {"modules":{}}
+        self.__index = {}
+        self.__revision = 0
+        self.__lastupdate = 0
+        self.__etag = None
+        self.__lastModified = None
+        self.__url = None
+        self.__updateLock = threading.Lock()
+        self.__refreshThread = None
+        if self.__loadCache():
+            # Serve the cached copy right away and revalidate it in the background
+            self.refreshAsync()
+        else:
+            # Nothing cached yet, so the very first load has to wait for the network
+            self.update()
 
     # Returns the module element with the given name if available
     def getModuleByName(self, wantedName):
-        for name, module in self.__repo["modules"].items():
-            if name == wantedName:
-                return module
-        return False
+        return self.__repo["modules"].get(wantedName, False)
+
+    # Returns the precomputed version index of the module with the given name if available
+    def __getModuleIndex(self, name):
+        return self.__index.get(name, False)
+
+    # Replaces the repository content and rebuilds the version index
+    def __setRepo(self, repo):
+        index = {}
+        for name, module in repo.get("modules", {}).items():
+            index[name] = buildModuleIndex(module)
+        self.__index = index
+        self.__repo = repo
+        self.__revision += 1
+
+    # Returns a number which changes whenever the repository content is replaced
+    def getRevision(self):
+        return self.__revision
 
-    # Checks if the actual version is older than 5 minutes and reloads it if necessary
+    # Checks if the actual version is older than the refresh interval and revalidates it in the background if necessary,
+    # an empty repository is retried sooner
     def updateIfRequired(self):
-        if (time.time() - 300) > self.__lastupdate:
-            self.update()
+        refresh = config.repositoryrefresh if len(self.__repo["modules"]) > 0 else config.repositoryretry
+        if (time.time() - refresh) > self.__lastupdate:
+            self.refreshAsync()
+
+    # Starts a background revalidation unless one is already running
+    def refreshAsync(self):
+        with self.__updateLock:
+            if self.__refreshThread is not None and self.__refreshThread.is_alive():
+                return
+            self.__lastupdate = time.time()
+            self.__refreshThread = threading.Thread(target=self.update, daemon=True)
+            self.__refreshThread.start()
 
-    # Reload repository
+    # Reload repository, sending the cache validators of the last good copy
     def update(self):
         self.__lastupdate = time.time()
-        repo = None
         with open(config.configpath + "repo.txt", "r") as f:
-            repo = json.loads(f.read())
-        self.__repo = json.loads(requests.get(repo["url"]).text)
+            url = json.loads(f.read())["url"]
+        headers = {}
+        if url == self.__url:
+            if self.__etag is not None:
+                headers["If-None-Match"] = self.__etag
+            if self.__lastModified is not None:
+                headers["If-Modified-Since"] = self.__lastModified
+        try:
+            response = requests.get(url, headers=headers, timeout=config.repositorytimeout)
+            if response.status_code == 304:
+                return True
+            response.raise_for_status()
+            repo = json.loads(response.text)
+        except (requests.RequestException, ValueError) as e:
+            print("Repository update failed, keeping the last known copy: " + str(e))
+            return False
+        self.__setRepo(repo)
+        self.__url = url
+        self.__etag = response.headers.get("ETag")
+        self.__lastModified = response.headers.get("Last-Modified")
+        self.__storeCache()
+        return True
+
+    # Loads the last good copy from disk, returns false if there is none for the configured url
+    def __loadCache(self):
+        if not os.path.exists(config.backuppath + "repositorycache.json"):
+            return False
+        try:
+            with open(config.backuppath + "repositorycache.json", "r") as f:
+                cache = json.loads(f.read())
+            with open(config.configpath + "repo.txt", "r") as f:
+                url = json.loads(f.read())["url"]
+        except (OSError, ValueError):
+            return False
+        if cache.get("url") != url or not "repo" in cache:
+            return False
+        self.__setRepo(cache["repo"])
+        self.__url = cache["url"]
+        self.__etag = cache.get("etag")
+        self.__lastModified = cache.get("lastModified")
+        return True
+
+    # Persists the actual copy together with its cache validators
+    def __storeCache(self):
+        cache = {
+            "url": self.__url,
+            "etag": self.__etag,
+            "lastModified": self.__lastModified,
+            "repo": self.__repo,
+        }
+        try:
+            fs.filesystem.writeAtomic(config.backuppath + "repositorycache.json", json.dumps(cache))
+        except OSError as e:
+            print("Could not store repository cache: " + str(e))
 
     # Returns the url of the service with the given name for the specified version, if available
     def getUrl(self, name, wantedVersion):
         self.updateIfRequired()
-        for version in self.getModuleByName(name)["versions"]:
-            if version["version"] == wantedVersion:
-                return version["url"]
-        return False
+        index = self.__getModuleIndex(name)
+        if index == False or not wantedVersion in index["byVersion"]:
+            return False
+        return index["byVersion"][wantedVersion]["url"]
+
+    # Returns the sha256 of the artifact of the given version if the repository lists one, None otherwise
+    def getChecksum(self, name, wantedVersion):
+        self.updateIfRequired()
+        index = self.__getModuleIndex(name)
+        if index == False or not wantedVersion in index["byVersion"]:
+            return None
+        return index["byVersion"][wantedVersion].get("sha256")
 
     # Returns the latest available version number for the given service name, NOT respecting minimum required versions
     def getLatestAvailable(self, name):
         self.updateIfRequired()
-        latest = None
-        for version in self.getModuleByName(name)["versions"]:
-            if "version" in version:
-                if latest == None or self.compareVersions(latest["version"], version["version"]) == 1:
-                    latest = version
-        return latest
+        index = self.__getModuleIndex(name)
+        if index == False or len(index["sorted"]) == 0:
+            return None
+        return index["sorted"][-1]
 
     # Returns all available versions for the given service name
     def getAllVersions(self, name):
         self.updateIfRequired()
-        return self.getModuleByName(name)["versions"]
+        module = self.getModuleByName(name)
+        if module == False:
+            return []
+        return module["versions"]
 
     # Returns a list of all available services for the given type
     def getAvailable(self, type):
@@ -77,35 +229,39 @@ class repository:
     # Returns the latest available version number for the given service name, respecting minimum required versions
     def getLatestCompatible(self, name, actual):
         self.updateIfRequired()
-        if self.getLatestAvailable(name) == actual:
+        index = self.__getModuleIndex(name)
+        if index == False:
+            return actual
+        position = bisect_right(index["requiredKeys"], parseVersion(actual))
+        if position == 0:
+            return actual
+        latestCompatible = index["bestCompatible"][position - 1]
+        if parseVersion(latestCompatible["version"]) < parseVersion(actual):
             return actual
-        latestCompatible = None
-        for version in self.getModuleByName(name)["versions"]:
-            if self.compareVersions(version["required"], actual) >= 0 and latestCompatible == None or self.compareVersions(latestCompatible["version"], version["version"]) == 1:
-                latestCompatible = version
         return latestCompatible["version"]
 
     # Returns if reverting to a previous version is possible with the actual installed version
     def isRevertPossible(self, name, actual):
         self.updateIfRequired()
-        isPossible = False
-        for version in self.getModuleByName(name)["versions"]:
-            if "version" in version:
-                if version["version"] == actual:
-                    isPossible = version["revert"]
-        return isPossible
+        index = self.__getModuleIndex(name)
+        if index == False or not actual in index["byVersion"]:
+            return False
+        return index["byVersion"][actual]["revert"]
 
     # Compares version numbers
     def compareVersions(self, v1, v2):
-        l1 = v1.split(".")
-        l2 = v2.split(".")
-        for i in range(3):
-            if int(l1[i]) > int(l2[i]):
-                return -1
-            elif int(l1[i]) < int(l2[i]):
-                return 1
+        p1 = parseVersion(v1)
+        p2 = parseVersion(v2)
+        if p1 > p2:
+            return -1
+        elif p1 < p2:
+            return 1
         return 0
 
-    # Returns the type of this service
+    # Returns the type of this service, None if the repository does not know it
     def getType(self, name):
-        return self.getModuleByName(name)["type"]
+        self.updateIfRequired()
+        module = self.getModuleByName(name)
+        if module == False:
+            return None
+        return module.get("type")
@@ -27,8 +27,7 @@ import os
 import json
 import threading
 import time
-import queue
-from subprocess import Popen
+from concurrent.futures import ThreadPoolExecutor
 
 # Include modules
 import config
@@ -38,9 +37,16 @@ import modules.network as network
 import modules.prune as prune
 import modules.servicedescription as description
 import modules.filesystem as fs
-import modules.builderThread as bt
+import modules.buildscheduler as bs
 import modules.repository as repository
+import modules.inventory as inventory
+import modules.download as download
+import modules.backupclient as backupclient
+import modules.jobs as jobs
+import modules.events as events
+from modules.jobcontrol import jobCancelled
 from modules.envstore import envman
+from modules.configstore import configStore
 
 # Manager objects
 env = envman()
@@ -48,19 +54,18 @@ env = envman()
 # Class definition
 class service:
     networks = []
-    def __init__(self, name, firstinstall):
+    globalNetwork = None
+    globalNetworkLock = threading.Lock()
+    def __init__(self, name, firstinstall, dockerInventory = None):
         # Init vars
         self.__name = name
         self.__containers = {"actual":[],"previous":[]}
         self.__volumes = []
         self.__description = None
         self.__errors = 0
-        self.__installThread = None
-        self.__updateThread = None
-        self.__revertThread = None
-        self.__deleteThread = None
-        self.__rebuildThread = None
+        self.__job = None
         self.__localEnv = None
+        self.__progress = download.progress()
         if not firstinstall:
             # Read container configuration
             configFile = open(config.servicepath + name + "/config.json", "r")
@@ -69,28 +74,17 @@ class service:
             # Create service description object
             self.__desc = description.serviceDescription(False, self.__name, self.__config["actualVersion"])
             self.__localEnv = envman(self.__name)
-            # Create docker references for volumes
+            # Create docker references, taking the objects from the bulk inventory where available
+            if dockerInventory is None:
+                dockerInventory = inventory.inventory()
             for storedVolume in self.__config["volumes"]:
-                self.__volumes.append(volume.volume(True, storedVolume["id"], None))
-            # Create docker references for networks
+                self.__volumes.append(volume.volume(True, storedVolume["id"], None, dockerObject=dockerInventory.getVolume(storedVolume["id"])))
             for storedNetwork in self.__config["networks"]:
-                self.networks.append(network.network(True, storedNetwork["id"], None, None))
-            # Create docker references for containers
+                self.networks.append(network.network(True, storedNetwork["id"], None, None, dockerObject=dockerInventory.getNetwork(storedNetwork["id"])))
             for storedContainer in self.__config["containers"]["actual"]:
-                self.__containers["actual"].append(container.container(True, storedContainer["id"], self.__name))
+                self.__containers["actual"].append(container.container(True, storedContainer["id"], self.__name, dockerInventory.getContainer(storedContainer["id"])))
             for storedContainer in self.__config["containers"]["previous"]:
-                self.__containers["previous"].append(container.container(True, storedContainer["id"], self.__name))
-            # Check container status and turn containers to wanted status
-            if self.__config["wanted"]:
-                for containerObject in self.__containers["actual"]:
-                    if not containerObject.isRunning():
-                        containerObject.start()
-                self.__config["status"] = "running"
-            else:
-                for containerObject in self.__containers["actual"]:
-                    if containerObject.isRunning():
-                        containerObject.stop()
-                self.__config["status"] = "paused"
+                self.__containers["previous"].append(container.container(True, storedContainer["id"], self.__name, dockerInventory.getContainer(storedContainer["id"])))
         else:
             self.__config = {
                 "networks": [],
@@ -101,93 +95,121 @@ class service:
                 "actualVersion": "",
                 "previousVersion": "",
             }
+        # Description volume names mapped to the snapshot volumes replacing them, and snapshot volumes kept for a revert
+        self.__config.setdefault("volumeAliases", {})
+        self.__config.setdefault("snapshots", {})
+        self.__snapshotLock = threading.Lock()
+        self.__advanceLock = threading.RLock()
+        self.__store = configStore(self.__config)
+        if self.__name is not None:
+            self.__store.setPath(config.servicepath + self.__name + "/config.json")
+
+    # Check container status and turn containers to wanted status, one container after another in the stored order
+    def reconcile(self):
+        if self.__config["wanted"]:
+            for containerObject in self.__containers["actual"]:
+                if not containerObject.isRunning():
+                    containerObject.start()
+            self.__setStatus("running")
+        else:
+            for containerObject in self.__containers["actual"]:
+                if containerObject.isRunning():
+                    containerObject.stop()
+            self.__setStatus("paused")
 
     # SERVICE BUILDING
+    # Job wrapper for prepareBuild, returns the job
+    def asyncPrepareBuild(self, name, url, version):
+        self.__name = name
+        return self.__submit("prepareBuild", self.prepareBuild, name, url, version)
+
     # Build a version of this service
     def prepareBuild(self, name, url, version):
         if self.__config["status"] != "empty":
             print("Error calling prepareBuild: this service is not in 'empty' state")
             return False
         self.__name = name
-        self.__config["status"] = "preparing"
+        self.__setStatus("preparing")
         self.__config["actualVersion"] = version
         # Create service folder
         fs.filesystem.removeElement(config.servicepath + name)
         os.makedirs(config.servicepath + name)
         self.__saveConfiguration()
         # Download service description
-        self.__desc = description.serviceDescription(True, self.__name, self.__config["actualVersion"], url)
+        self.__desc = description.serviceDescription(True, self.__name, self.__config["actualVersion"], url, self.__progress)
         self.__localEnv = envman(self.__name)
         # Check if all required environment variables are set
         requiredVars = self.__requiredEnvironmentVariables()
-        self.__config["status"] = "installPending"
+        self.__setStatus("installPending")
+        self.__saveConfiguration()
+        self.flushConfiguration()
         if requiredVars == False:
             return True
         else:
-            self.__saveConfiguration()
             return requiredVars
 
     # Return a dict with all required environment variables, or false if there are none
     def __requiredEnvironmentVariables(self):
         requiredVars = {}
+        localDefaults = {}
+        globalDefaults = {}
         for var in self.__desc.getEnvironment():
             if "private" in var and var["private"] == True:
-                if not self.__localEnv.doesKeyExist(var["name"]):
+                if not self.__localEnv.doesKeyExist(var["name"]) and not var["name"] in localDefaults:
                     if "default" in var:
-                        self.__localEnv.storeValue(var["name"], var["default"], var["description"], var["mutable"])
+                        localDefaults[var["name"]] = {"value":var["default"],"description":var["description"],"mutable":var["mutable"]}
                     else:
                         requiredVars["[" + self.__name + "]" + var["name"]] = {"description":var["description"],"mutable":var["mutable"]}
             else:
-                if not env.doesKeyExist(var["name"]):
+                if not env.doesKeyExist(var["name"]) and not var["name"] in globalDefaults:
                     if "default" in var:
-                        env.storeValue(var["name"], var["default"], var["description"], var["mutable"])
+                        globalDefaults[var["name"]] = {"value":var["default"],"description":var["description"],"mutable":var["mutable"]}
                     else:
                         requiredVars[var["name"]] = {"description":var["description"],"mutable":var["mutable"]}
+        self.__localEnv.storeValues(localDefaults)
+        env.storeValues(globalDefaults)
         if len(requiredVars) > 0:
             return requiredVars
         else:
             return False
 
-    # Thread wrapper for continue installation
+    # Job wrapper for continue installation, returns the job
     def asyncContinueInstallation(self):
-        self.__installThread = threading.Thread(target = self.continueInstallation)
-        self.__installThread.start()
+        return self.__submitWithStatus("installing", "install", self.continueInstallation)
 
     # Continues installation if all requirements are fulfilled
     def continueInstallation(self):
-        self.__config["status"] = "installing"
+        self.__setStatus("installing")
         requiredVars = self.__requiredEnvironmentVariables()
         if requiredVars != False:
             return False
+        self.__step("build containers")
         self.__buildInfrastructure()
         self.__saveConfiguration()
-        containerList = self.__desc.getContainers()
-        # Prepare threads
-        self.__buildThreads = []
-        self.__queueLock = threading.Lock()
-        self.__buildQueue = queue.Queue(self.__desc.getContainerCount())
-        self.__containerArray = []
-        # Add containers to queue
-        self.__queueLock.acquire()
-        for name in containerList:
-            containerObject = {"object":self.__desc.getContainerObject(name),"image":self.__desc.getImageSource(name),"volumeSource":None,"name":self.__name}
-            self.__buildQueue.put(containerObject)
-        self.__queueLock.release()
-        # Create and start threads
-        for x in range(self.__desc.getContainerCount()):
-            thread = bt.builderThread(x, self.__buildQueue, self.__queueLock, self.__containerArray)
-            thread.start()
-            self.__buildThreads.append(thread)
-        # Wait for the threads to end
-        for thread in self.__buildThreads:
-            thread.join()
+        # Build images and containers in dependency order on the bounded scheduler
+        jobs = {}
+        for name in self.__desc.getContainers():
+            jobs[name] = {"object":self.__desc.getContainerObject(name),"image":self.__desc.getImageSource(name),"volumeSource":None,"name":self.__name,"labels":self.__labels("container"),"volumeAliases":self.__config["volumeAliases"]}
+        scheduler = bs.buildScheduler(jobs, self.__desc.getDependencyMap())
+        createdContainers, failures = scheduler.run()
         # Store all containers
-        for container in self.__containerArray:
+        for container in createdContainers:
             self.__config["containers"]["actual"].append({"name":container["container"].getName(), "id":container["container"].getId(), "image":container["image"]})
             self.__containers["actual"].append(container["container"])
             self.__saveConfiguration()
             self.__connectNetworks(container["container"].getName())
-        self.__config["status"] = "paused"
+        self.__config["buildErrors"] = failures
+        if len(failures) > 0:
+            for name, reason in failures.items():
+                print("Building container " + name + " of service " + self.__name + " failed: " + reason)
+            self.__setStatus("undefined")
+            self.__saveConfiguration()
+            self.flushConfiguration()
+            return False
+        self.__setStatus("paused")
+        self.__saveConfiguration()
+        self.flushConfiguration()
+        return True
 
     # Build infrastructure around the containers (volumes and networks)
     def __buildInfrastructure(self):
@@ -206,11 +228,11 @@ class service:
 
     # Create a new docker network
     def __createNewNetwork(self, name, internal):
-        return network.network(False, None, name, internal)
+        return network.network(False, None, name, internal, self.__labels("network"))
 
     # Create a new docker volume
     def __createNewVolume(self, name):
-        return volume.volume(False, None, name)
+        return volume.volume(False, None, name, self.__labels("volume"))
 
     # Connects the other networks to a created container
     def __connectNetworks(self, name):
@@ -224,14 +246,25 @@ class service:
                     first = False
 
     # SERVICE CONTROLLING
+    # Job wrapper for start, returns the job
+    def asyncStart(self):
+        return self.__submit("start", self.start)
+
+    # Job wrapper for stop, returns the job
+    def asyncStop(self):
+        return self.__submit("stop", self.stop)
+
     # Start all containers of this service in the order defined in the service description
     def start(self):
         self.__config["wanted"] = True
         self.__saveConfiguration()
-        for name in self.__desc.getContainers():
-            self.__getContainerByName(name).start()
-        self.__config["status"] = "running"
+        for name in self.__desc.getStartOrder():
+            containerObject = self.__getContainerByName(name)
+            if containerObject is not None:
+                containerObject.start()
+        self.__setStatus("running")
         self.__saveConfiguration()
+        self.flushConfiguration()
 
     # Stop all containers of this service
     def stop(self):
@@ -239,8 +272,9 @@ class service:
         self.__saveConfiguration()
         for containerObject in self.__containers["actual"]:
             containerObject.stop()
-        self.__config["status"] = "paused"
+        self.__setStatus("paused")
         self.__saveConfiguration()
+        self.flushConfiguration()
 
     # SERVICE INFORMATIONS
     # Return name
@@ -251,6 +285,16 @@ class service:
     def getStatus(self):
         return self.__config["status"]
 
+    # Starts the next operation of a pending service once nothing blocks it anymore. Returns the job, or None
+    def advance(self):
+        with self.__advanceLock:
+            status = self.__config["status"]
+            if not status in ["installPending", "updatePending"] or self.__requiredEnvironmentVariables() != False:
+                return None
+            if status == "installPending":
+                return self.asyncContinueInstallation()
+            return self.asyncUpdate()
+
     # Return the installed version of this service
     def getInstalledVersion(self):
         return self.__config["actualVersion"]
@@ -270,39 +314,62 @@ class service:
     def isOk(self):
         return self.shouldRun() == self.isRunning()
 
+    # Write pending configuration changes to config.json now
+    def flushConfiguration(self):
+        self.__store.flush()
+
+    # Return the progress of the last service description download or volume backup, restore or archive
+    def getProgress(self):
+        return self.__progress.get()
+
+    # Cancel the running volume backup, restore or archive jobs
+    def cancelVolumeJobs(self):
+        for vol in self.__volumes:
+            vol.cancelBackupJob()
+
+    # Return the build failures of the last installation by container name
+    def getBuildErrors(self):
+        return self.__config.get("buildErrors", {})
+
     # Return if a pervious version is available
     def hasPrevious(self):
         return self.__config["previousVersion"]
 
     # SERVICE DELETION
-    # Thread wrapper for delete
+    # Job wrapper for delete, returns the job or an error string
     def asyncDelete(self):
-        repo = repository.repository()
+        repo = repository.getRepository()
         if repo.getType(self.__name) == "essential":
             return "ERR_IS_ESSENTIAL"
         else:
-            self.__deleteThread = threading.Thread(target = self.__delete)
-            self.__deleteThread.start()
-            return "running"
+            return self.__submit("delete", self.__delete)
 
     # Delete service
     def __delete(self):
-        self.__config["status"] = "deleting"
+        self.__setStatus("deleting")
+        self.__step("stop containers")
         self.stop()
-        self.__config["status"] = "deleting"
+        self.__setStatus("deleting")
         self.__saveConfiguration()
+        self.__step("delete containers and volumes")
         for container in self.__containers["actual"]:
             container.delete()
         for container in self.__containers["previous"]:
             container.delete()
         for volume in self.__volumes:
             volume.delete()
+        self.__discardSnapshots(False)
         prune.prune.networks()
         prune.prune.images()
+        self.__store.discard()
         fs.filesystem.removeElement(config.servicepath + self.__name)
-        self.__config["status"] = "deleted"
+        self.__setStatus("deleted")
 
     # SERVICE UPDATE
+    # Job wrapper for update preparation, returns the job
+    def asyncPrepareUpdate(self, url, version):
+        return self.__submit("prepareUpdate", self.prepareUpdate, url, version)
+
     # Update preparation
     def prepareUpdate(self, url, version):
         # First remove any trash of the previous version
@@ -310,13 +377,15 @@ class service:
             ct.stop()
             ct.delete()
         fs.filesystem.removeElement(config.servicepath + self.__name + "/service_" + self.__config["previousVersion"] + ".json")
+        self.__discardSnapshots(True)
         # Move actual to previous version
         self.__config["previousVersion"] = self.__config["actualVersion"]
         self.__config["actualVersion"] = version
-        self.__config["status"] = "updatePending"
+        self.__setStatus("updatePending")
         self.__saveConfiguration()
         # Download new service description
-        self.__desc = description.serviceDescription(True, self.__name, self.__config["actualVersion"], url)
+        self.__desc = description.serviceDescription(True, self.__name, self.__config["actualVersion"], url, self.__progress)
+        self.flushConfiguration()
         # Check for new environment variables
         vars = self.__requiredEnvironmentVariables()
         if vars != False:
@@ -324,12 +393,9 @@ class service:
         else:
             return "running"
 
-    # Threaded wrapper for update
+    # Job wrapper for update, returns the job
     def asyncUpdate(self):
-        self.__config["status"] = "updating"
-        self.__saveConfiguration()
-        self.__updateThread = threading.Thread(target = self.__update)
-        self.__updateThread.start()
+        return self.__submitWithStatus("updating", "update", self.__update)
 
     # Run update
     def __update(self):
@@ -337,15 +403,16 @@ class service:
         if requiredVars != False:
             return False
         # Stop all running containers
+        self.__step("stop containers")
         self.stop()
-        # Backup all volume contents
-        for volume in self.__volumes:
-            backupPath = env.getValue("USERDATA") + "/PreviousVersions/" + volume.getName() + "_" + self.__config["previousVersion"]
-            if os.path.exists(backupPath):
-                remover = Popen(["sudo", "/usr/local/bin/servermanager/volumebackup.py", backupPath, "delete"])
-                remover.wait()
-            os.makedirs(backupPath)
-            volume.backupContent(backupPath)
+        # Backup all volume contents, either into backup folders or into new snapshot volumes
+        self.__step("back up volumes")
+        if config.backupmode == "swap":
+            backedUp = self.__forEachVolume(self.__snapshotVolume)
+        else:
+            backedUp = self.__forEachVolume(self.__backupVolume)
+        if not backedUp:
+            return self.__abortUpdate()
         # Rename the existing containers and move them to previous
         self.__config["containers"]["previous"].clear()
         for ct in self.__config["containers"]["actual"]:
@@ -356,25 +423,41 @@ class service:
             ct.rename(ct.getName() + "_" + self.__config["previousVersion"])
         self.__containers["actual"].clear()
         # Build the new containers
-        self.continueInstallation()
-        self.__config["status"] = "updating"
+        if not self.continueInstallation():
+            return False
+        self.__setStatus("updating")
         # Start the new containers
+        self.__step("start containers")
         self.start()
-        self.__config["status"] = "running"
+        self.__setStatus("running")
         self.__saveConfiguration()
+        self.flushConfiguration()
+        # Keep the previous version in the deduplicating repository, this works on the backups and not on the running volumes
+        if len(self.__config["snapshots"]) == 0:
+            self.__step("archive volumes")
+            if not self.__forEachVolume(self.__archiveVolume):
+                print("Archiving the volumes of service " + self.__name + " failed, the backups are kept.")
+
+    # Goes back to the previous version after its volumes could not be backed up, nothing else has been changed yet
+    def __abortUpdate(self):
+        print("Backing up the volumes of service " + self.__name + " failed, the update is aborted.")
+        self.__discardSnapshots(True)
+        self.__config["actualVersion"] = self.__config["previousVersion"]
+        self.__config["previousVersion"] = ""
+        self.__desc = description.serviceDescription(False, self.__name, self.__config["actualVersion"])
+        self.__saveConfiguration()
+        self.start()
+        return False
 
     # SERVICE REVERT TO PREVIOUS
-    # Threaded wrapper for revert
+    # Job wrapper for revert, returns the job
     def asyncRevert(self):
-        self.__config["status"] = "reverting"
-        self.__saveConfiguration()
-        self.__revertThread = threading.Thread(target=self.revert)
-        self.__revertThread.start()
-        return "running"
+        return self.__submitWithStatus("reverting", "revert", self.revert)
 
     # Revert to the previous version of this service, if available
     def revert(self):
         # Stop the actual containers
+        self.__step("stop containers")
         self.stop()
         # Delete the actual containers and store their names
         names = []
@@ -397,15 +480,23 @@ class service:
                     ct.rename(name)
         # Read old service description
         self.__desc = description.serviceDescription(False, self.__name, self.__config["previousVersion"])
-        # Restore volumes
-        for volume in self.__volumes:
-            backupPath = env.getValue("USERDATA") + "/PreviousVersions/" + volume.getName() + "_" + self.__config["previousVersion"]
-            volume.restoreContent(backupPath)
-            delete = Popen(["sudo", "/usr/local/bin/servermanager/volumebackup.py", backupPath, "delete"])
-            delete.wait()
+        # Restore volumes, or switch to the snapshot volumes without copying any data
+        self.__step("restore volumes")
+        if len(self.__config["snapshots"]) > 0:
+            restored = self.__swapToSnapshots()
+        else:
+            restored = self.__forEachVolume(self.__restoreVolume)
+        if not restored:
+            # The backups and replaced volumes are kept, so the data can still be recovered by hand
+            print("Restoring the volumes of service " + self.__name + " failed.")
+            self.__setStatus("undefined")
+            self.__saveConfiguration()
+            self.flushConfiguration()
+            return False
         # Start old containers
+        self.__step("start containers")
         self.start()
-        self.__config["status"] = "running"
+        self.__setStatus("running")
         self.__saveConfiguration()
         # Delete files
         fs.filesystem.removeElement(config.servicepath + self.__name + "/service_" + self.__config["actualVersion"] + ".json")
@@ -413,19 +504,17 @@ class service:
         self.__config["actualVersion"] = self.__config["previousVersion"]
         self.__config["previousVersion"] = ""
         self.__saveConfiguration()
+        self.flushConfiguration()
 
     # SERVICE REBUILD
-    # Prepare rebuilding thread
+    # Job wrapper for rebuild, returns the job
     def prepareRebuild(self):
-        self.__config["status"] = "installing"
-        self.__saveConfiguration()
-        self.__rebuildThread = threading.Thread(target=self.rebuild)
-        self.__rebuildThread.start()
-        return "running"
+        return self.__submitWithStatus("installing", "rebuild", self.rebuild)
 
     # Execute container rebuild
     def rebuild(self):
         # Stop the actual containers
+        self.__step("stop containers")
         self.stop()
         # Remove the actual containers
         for ct in self.__containers["actual"]:
@@ -434,25 +523,230 @@ class service:
         self.__containers["actual"].clear()
         self.__config["containers"]["actual"].clear()
         # Build the new containers
-        self.continueInstallation()
+        if not self.continueInstallation():
+            return False
         # Start the new containers
+        self.__step("start containers")
         self.start()
-        self.__config["status"] = "running"
+        self.__setStatus("running")
         self.__saveConfiguration()
+        self.flushConfiguration()
 
     # PRIVATE HELPER FUNCTIONS
+    # Queues an operation of this service on the job manager and returns the job
+    def __submit(self, action, function, *args):
+        return jobs.getJobManager().submit(self.__name, action, self.__runJob, function, *args)
+
+    # Sets the status right away and queues the operation. The status goes back if the job is cancelled before it started
+    def __submitWithStatus(self, status, action, function, *args):
+        previous = self.__config["status"]
+        self.__setStatus(status)
+        self.__saveConfiguration()
+        job = self.__submit(action, function, *args)
+        job.onDiscard(lambda: self.__resetStatus(status, previous))
+        return job
+
+    # Sets the status back to the one before a discarded job, unless something else has changed it meanwhile
+    def __resetStatus(self, status, previous):
+        with self.__advanceLock:
+            if self.__config["status"] == status:
+                self.__setStatus(previous)
+                self.__saveConfiguration()
+                self.flushConfiguration()
+
+    # Runs an operation as the current job of this service, the job manager runs one job per service at a time
+    def __runJob(self, job, function, *args):
+        self.__job = job
+        job.setProgress(self.getProgress)
+        job.onCancel(self.cancelVolumeJobs)
+        try:
+            result = function(*args)
+        except jobCancelled:
+            # A cancelled operation leaves the service somewhere in between
+            self.__setStatus("undefined")
+            self.__saveConfiguration()
+            self.flushConfiguration()
+            raise
+        finally:
+            self.__job = None
+        # Pending services continue right away if no environment variables are missing
+        self.advance()
+        return result
+
+    # Sets the status of this service and tells waiting clients about the change
+    def __setStatus(self, status):
+        if self.__config["status"] != status:
+            self.__config["status"] = status
+            events.getEventBus().publish("status", service=self.__name, status=status)
+
+    # Starts the next step of the current job, which stops here if it has been cancelled
+    def __step(self, name):
+        if self.__job is not None:
+            self.__job.step(name)
+
+    # Returns the service, version and role labels for a new docker object of this service
+    def __labels(self, role, version = None):
+        return inventory.labels(self.__name, self.__config["actualVersion"] if version is None else version, role)
+
     # Returns the network object by its name
     def __getNetworkByName(self, name):
         if name == "schoolconnect":
-            mainconfig = open(config.servicepath + "config.json", "r")
-            globalNetwork = network.network(True, json.loads(mainconfig.read())["globalNetwork"], None, False)
-            mainconfig.close()
-            return globalNetwork
+            return service.getGlobalNetwork()
         for nw in self.networks:
             if nw.getName() == name:
                 return nw
         return False
 
+    # Runs the given function for all volumes concurrently, splitting the configured disk throttle between the running jobs.
+    # Returns false if the function failed for any volume
+    def __forEachVolume(self, function):
+        if len(self.__volumes) == 0:
+            return True
+        # The progress counts the bytes processed by all volume jobs, their total is not known in advance
+        self.__progress.reset(0)
+        workers = max(1, min(config.backupvolumeworkers, len(self.__volumes)))
+        rate = config.backupbytespersecond // workers
+        iops = config.backupiops // workers
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = [pool.submit(function, vol, rate, iops) for vol in self.__volumes]
+            return all([result.result() != False for result in results])
+
+    # Returns the path of the backup of the given volume for the previous version
+    def __getBackupPath(self, vol):
+        return env.getValue("USERDATA") + "/PreviousVersions/" + vol.getName() + "_" + self.__config["previousVersion"]
+
+    # Backups a single volume and reports its throughput
+    def __backupVolume(self, vol, rate, iops):
+        backupPath = self.__getBackupPath(vol)
+        if os.path.exists(backupPath):
+            backupclient.deleteBackup(backupPath)
+        os.makedirs(backupPath)
+        return self.__reportVolumeStats("Backup", vol, vol.backupContent(backupPath, rate, iops, self.__progress))
+
+    # Stores the backup of a single volume in the deduplicating repository
+    def __archiveVolume(self, vol, rate, iops):
+        stats = vol.archiveContent(self.__getBackupPath(vol), self.__config["previousVersion"], env.getValue("USERDATA") + "/BackupRepository", config.backupretention, self.__progress)
+        if len(stats) == 0:
+            print("Archiving volume " + vol.getName() + " failed")
+            return False
+        print("Archived volume " + vol.getName() + ": " + str(stats.get("bytes", 0)) + " bytes, " + str(stats.get("bytesStored", 0)) + " bytes of new chunks in " + str(stats.get("seconds", 0)) + "s")
+        return True
+
+    # Restores a single volume from its backup, or from the repository if the backup is gone. Reports its throughput and
+    # deletes the backup, which is kept if the restore failed
+    def __restoreVolume(self, vol, rate, iops):
+        backupPath = self.__getBackupPath(vol)
+        if os.path.exists(backupPath):
+            restored = self.__reportVolumeStats("Restore", vol, vol.restoreContent(backupPath, rate, iops, self.__progress))
+        else:
+            restored = self.__reportVolumeStats("Restore", vol, vol.restoreArchive(self.__config["previousVersion"], env.getValue("USERDATA") + "/BackupRepository", self.__progress))
+        if restored:
+            backupclient.deleteBackup(backupPath)
+        return restored
+
+    # Copies a single volume into a new snapshot volume and records it for a revert. An incomplete snapshot is deleted again
+    def __snapshotVolume(self, vol, rate, iops):
+        key = self.__getVolumeKey(vol)
+        snapshotVolume = volume.volume(False, None, key + "_" + self.__config["previousVersion"] + "_" + str(int(time.time())), self.__labels("snapshot", self.__config["previousVersion"]))
+        if not self.__reportVolumeStats("Snapshot", vol, vol.cloneContent(snapshotVolume.getName(), rate, iops, self.__progress)):
+            self.__deleteVolumes([snapshotVolume])
+            return False
+        with self.__snapshotLock:
+            self.__config["snapshots"][key] = {"id":snapshotVolume.getId(),"name":snapshotVolume.getName()}
+            self.__saveConfiguration()
+        return True
+
+    # Replaces the volumes by their snapshot volumes and recreates the previous containers on them. Returns false if a
+    # container could not be created, the replaced volumes are kept then
+    def __swapToSnapshots(self):
+        replaced = []
+        for key, snapshot in self.__config["snapshots"].items():
+            current = self.__getVolumeByName(key)
+            snapshotVolume = volume.volume(True, snapshot["id"], None)
+            if current != False:
+                index = self.__volumes.index(current)
+                self.__volumes[index] = snapshotVolume
+                self.__config["volumes"][index] = {"id":snapshot["id"]}
+                replaced.append(current)
+            else:
+                self.__volumes.append(snapshotVolume)
+                self.__config["volumes"].append({"id":snapshot["id"]})
+            self.__config["volumeAliases"][key] = snapshot["name"]
+        self.__config["snapshots"] = {}
+        self.__saveConfiguration()
+        # The previous containers still mount the updated volumes, so they are created again from their stored images
+        stored = list(self.__config["containers"]["actual"])
+        for ct in self.__containers["actual"]:
+            ct.delete()
+        self.__containers["actual"].clear()
+        self.__config["containers"]["actual"].clear()
+        failed = False
+        for entry in stored:
+            ct = container.container(False, None, self.__name)
+            if ct.create(entry["image"], self.__desc.getContainerObject(entry["name"]), None, self.__labels("container", self.__config["previousVersion"]), self.__config["volumeAliases"]) != 0:
+                print("Recreating container " + entry["name"] + " of service " + self.__name + " failed.")
+                failed = True
+                continue
+            self.__config["containers"]["actual"].append({"name":ct.getName(), "id":ct.getId(), "image":entry["image"]})
+            self.__containers["actual"].append(ct)
+            self.__connectNetworks(ct.getName())
+        self.__saveConfiguration()
+        if failed:
+            print("Kept the replaced volumes " + ", ".join(vol.getName() for vol in replaced) + " of service " + self.__name + ".")
+            return False
+        # The updated data is not needed anymore
+        threading.Thread(target=self.__deleteVolumes, args=(replaced,), daemon=True).start()
+        return True
+
+    # Deletes the snapshot volumes of the last update, in the background if wanted
+    def __discardSnapshots(self, background):
+        snapshots = [volume.volume(True, snapshot["id"], None) for snapshot in self.__config["snapshots"].values()]
+        self.__config["snapshots"] = {}
+        self.__saveConfiguration()
+        if background:
+            threading.Thread(target=self.__deleteVolumes, args=(snapshots,), daemon=True).start()
+        else:
+            self.__deleteVolumes(snapshots)
+
+    # Deletes the given volumes
+    def __deleteVolumes(self, volumes):
+        for vol in volumes:
+            try:
+                vol.delete()
+            except Exception as e:
+                print("Deleting volume " + vol.getName() + " failed: " + str(e))
+
+    # Returns the name the service description uses for a volume
+    def __getVolumeKey(self, vol):
+        for key, name in self.__config["volumeAliases"].items():
+            if name == vol.getName():
+                return key
+        return vol.getName()
+
+    # Prints the statistics of a volume backup or restore. Returns false if it failed, the backup helper reports no statistics then
+    def __reportVolumeStats(self, action, vol, stats):
+        if len(stats) == 0:
+            print(action + " of volume " + vol.getName() + " failed")
+            return False
+        print(action + " of volume " + vol.getName() + ": " + str(stats.get("bytesCopied", 0)) + " bytes in " + str(stats.get("seconds", 0)) + "s (" + str(round(stats.get("bytesPerSecond", 0) / 1048576, 1)) + " MiB/s, " + stats.get("method", "copy") + ")" + ((", " + str(stats["kept"]) + " unchanged files kept") if stats.get("kept", 0) > 0 else ""))
+        return True
+
+    # Returns the shared reference to the global network, reading it from the main config.json only once
+    @staticmethod
+    def getGlobalNetwork():
+        with service.globalNetworkLock:
+            if service.globalNetwork is None:
+                mainconfig = open(config.servicepath + "config.json", "r")
+                service.globalNetwork = network.network(True, json.loads(mainconfig.read())["globalNetwork"], None, False)
+                mainconfig.close()
+            return service.globalNetwork
+
+    # Sets the shared reference to the global network
+    @staticmethod
+    def setGlobalNetwork(globalNetwork):
+        with service.globalNetworkLock:
+            service.globalNetwork = globalNetwork
+
     # Returns the container object by its name
     def __getContainerByName(self, name):
         for container in self.__containers["actual"]:
@@ -472,13 +766,13 @@ class service:
 
     # Returns the volume object by its name
     def __getVolumeByName(self, name):
+        name = self.__config["volumeAliases"].get(name, name)
         for vol in self.__volumes:
             if vol.getName() == name:
                 return vol
         return False
 
-    # Save service configuration to config.json
+    # Mark the service configuration as changed, the config store writes it to config.json in the background
     def __saveConfiguration(self):
-        configFile = open(config.servicepath + self.__name + "/config.json", "w")
-        configFile.write(json.dumps(self.__config, sort_keys=True, indent=4))
-        configFile.close()
+        self.__store.setPath(config.servicepath + self.__name + "/config.json")
+        self.__store.markDirty()
@@ -4,26 +4,35 @@
 # © 2019 - 2021 Johannes Kreutz.
 
 # Include dependencies
+import hashlib
 import json
-import urllib.request
 import os
+import shutil
 import yaml
-from subprocess import Popen
 
 # Include modules
 import config
-import modules.repository as repo
+import modules.repository as repository
 import modules.filesystem as fs
-from modules.envparser import envParser
+import modules.artifactcache as artifactcache
+import modules.descriptionmodel as descriptionmodel
 
 # Manager objects
-repo = repo.repository()
+repo = repository.getRepository()
+
+# The libyaml based loader is much faster, but not every yaml installation comes with it
+yamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Compiled docker-compose files are stored next to them, a changed layout gets a new format number
+snapshotName = ".docker-compose.snapshot.json"
+snapshotFormat = 1
 
 # Class definition
 class serviceDescription:
-    def __init__(self, firstsetup, name, version, url = ""):
+    def __init__(self, firstsetup, name, version, url = "", progressObject = None):
         self.__name = name
         self.__version = version
+        self.__progress = progressObject
         if firstsetup:
             self.loadDescriptionFile(self.__version)
         else:
@@ -37,31 +46,32 @@ class serviceDescription:
     # Loads a description file
     def loadDescriptionFile(self, version):
         url = repo.getUrl(self.__name, version)
+        checksum = repo.getChecksum(self.__name, version)
+        cache = artifactcache.getArtifactCache()
+        self.__version = version
         if url.endswith(".json"):
             self.dockerComposeFile = False
             localPath = config.servicepath + self.__name + "/service_" + version + ".json"
+            fs.filesystem.removeElement(localPath)
+            with cache.file(url, checksum, self.__progress) as cachedPath:
+                shutil.copyfile(cachedPath, localPath)
         else:
             self.dockerComposeFile = True
-            localPath = config.servicepath + self.__name + "/" + version + ".tar.gz"
-        fs.filesystem.removeElement(localPath)
-        urllib.request.urlretrieve(url, localPath)
-        self.__version = version
-        if self.dockerComposeFile:
-            fs.filesystem.removeElement(config.servicepath + self.__name + "/" + version)
-            os.makedirs(config.servicepath + self.__name + "/" + version)
-            tar = Popen(["/bin/tar", "-zxf", config.servicepath + self.__name + "/" + version + ".tar.gz", "--directory", config.servicepath + self.__name + "/" + version, "--strip-components", "1"])
-            tar.wait()
+            localPath = config.servicepath + self.__name + "/" + version
             fs.filesystem.removeElement(localPath)
+            with cache.tree(url, checksum, self.__progress) as cachedPath:
+                # Release archives contain a single top level folder
+                sourcePath = artifactcache.getSingleSubdir(cachedPath)
+                shutil.copytree(sourcePath if sourcePath != False else cachedPath, localPath, symlinks=True)
         self.readDescriptionFile()
 
-    # Reads a locally stored service file
+    # Reads a locally stored service file and compiles it, the getters only use the compiled model
     def readDescriptionFile(self):
         if self.dockerComposeFile:
-            with open(config.servicepath + self.__name + "/" + self.__version + "/docker-compose.yml", "r") as serviceFile:
-                self.__desc = yaml.safe_load(serviceFile.read())
+            self.__model = descriptionmodel.fromParts(self.__readCompose(config.servicepath + self.__name + "/" + self.__version + "/"))
         else:
             with open(config.servicepath + self.__name + "/service_" + self.__version + ".json", "r") as serviceFile:
-                self.__desc = json.loads(serviceFile.read())
+                self.__model = descriptionmodel.compileJson(json.loads(serviceFile.read()))
 
     # Reload service description
     def checkForUpdate(self):
@@ -86,69 +96,42 @@ class serviceDescription:
     # VALUE GETTERS
     # Returns a list of all containers
     def getContainers(self):
-        list = []
-        if self.dockerComposeFile:
-            for name, container in self.__desc["services"].items():
-                list.append(name)
-        else:
-            for container in self.__desc["containers"]:
-                list.append(container["name"])
-        return list
+        return list(self.__model.containerNames)
 
     # Returns the number of containers
     def getContainerCount(self):
-        return len(self.getContainers())
+        return len(self.__model.containerNames)
+
+    # Returns the names of the containers the given container depends on
+    def getDependencies(self, name):
+        return list(self.__model.dependencies[name])
+
+    # Returns a dict with the dependencies of every container
+    def getDependencyMap(self):
+        dependencies = {}
+        for name in self.__model.containerNames:
+            dependencies[name] = list(self.__model.dependencies[name])
+        return dependencies
+
+    # Returns all container names ordered so that every container comes after its dependencies, keeping the defined order otherwise
+    def getStartOrder(self):
+        return list(self.__model.startOrder)
 
     # Returns a container description for the given name
     def getContainerObject(self, name):
-        for container in self.__getContainerObjectList():
-            if container["name"] == name:
-                return container
-        return False
+        return self.__model.containers.get(name, False)
 
     # Returns an array of all defined networks
     def getNetworks(self):
-        if self.dockerComposeFile:
-            networks = []
-            for name, network in self.__desc["networks"].items():
-                internal = True if network is not None and "internal" in network else False
-                networks.append({
-                    "name": name,
-                    "internal": internal,
-                })
-            return networks
-        else:
-            return self.__desc["networks"]
+        return list(self.__model.networks)
 
     # Returns an array of all defined volumes
     def getVolumes(self):
-        if self.dockerComposeFile:
-            volumes = []
-            for name, volume in self.__desc["volumes"].items():
-                volumes.append({
-                    "name": name,
-                })
-            return volumes
-        else:
-            return self.__desc["volumes"]
+        return list(self.__model.volumes)
 
     # Returns an array of all defined environment variables
     def getEnvironment(self):
-        if self.dockerComposeFile:
-            environment = []
-            names = [] # Cache names we already have
-            for name, container in self.__desc["services"].items():
-                if "env_file" in container:
-                    for file in container["env_file"]:
-                        filename = file[2:] if file.startswith("./") else file
-                        p = envParser(config.servicepath + self.__name + "/" + self.__version + "/" + filename)
-                        for var in p.getEnvironment():
-                            if not var["name"] in names:
-                                names.append(var["name"])
-                                environment.append(var)
-            return environment
-        else:
-            return self.__desc["environment"]
+        return list(self.__model.environment)
 
     # Get image source
     def getImageSource(self, name):
@@ -158,70 +141,59 @@ class serviceDescription:
             response["prebuilt"] = container["prebuilt"]
         elif "url" in container:
             response["url"] = container["url"]
+            if "sha256" in container:
+                response["sha256"] = container["sha256"]
         else:
             response["path"] = container["path"]
         return response
 
     # PRIVATE HELPERS
-    # Get a list with all containet objects
-    def __getContainerObjectList(self):
-        if self.dockerComposeFile:
-            list = []
-            for name, container in self.__desc["services"].items():
-                c = {
-                    "name": name,
-                    "hostname": name,
-                    "ports": [],
-                    "networks": [],
-                    "volumes": [],
-                    "environment": []
-                }
-                # Translate image source
-                if "image" in container:
-                    source = container["image"]
-                    if ":" in source:
-                        parts = source.split(":")
-                        c["prebuilt"] = {
-                            "name": parts[0],
-                            "version": parts[1],
-                        }
-                    else:
-                        c["prebuilt"] = {
-                            "name": container["image"],
-                            "version": "latest",
-                        }
-                else:
-                    c["path"] = config.servicepath + self.__name + "/" + self.__version + "/" + container["build"]
-                # Translate ports
-                if "ports" in container:
-                    for port in container["ports"]:
-                        parts = port.split(":")
-                        c["ports"].append({
-                            "external": parts[0],
-                            "internal": parts[1],
-                        })
-                # Translate networks
-                if "networks" in container:
-                    for network in container["networks"]:
-                        c["networks"].append({
-                            "name": network,
-                        })
-                # Translate volumes
-                if "volumes" in container:
-                    for volume in container["volumes"]:
-                        parts = volume.split(":")
-                        c["volumes"].append({
-                            "name": parts[0],
-                            "mountpoint": parts[1],
-                        })
-                # Translate environment parameters
-                if "env_file" in container:
-                    for envFile in container["env_file"]:
-                        filename = envFile[2:] if envFile.startswith("./") else envFile
-                        p = envParser(config.servicepath + self.__name + "/" + self.__version + "/" + filename)
-                        for var in p.getEnvironment():
-                            c["environment"].append(var["name"])
-                list.append(c)
-            return list
+    # Returns the translated docker-compose file of a version folder, from its snapshot if the file did not change
+    def __readCompose(self, basePath):
+        sourcePath = basePath + "docker-compose.yml"
+        info = os.stat(sourcePath)
+        snapshot = self.__readSnapshot(basePath)
+        if snapshot is not None and snapshot["mtime"] == info.st_mtime_ns and snapshot["size"] == info.st_size:
+            return snapshot["parts"]
+        with open(sourcePath, "rb") as serviceFile:
+            content = serviceFile.read()
+        hash = hashlib.sha256(content).hexdigest()
+        if snapshot is not None and snapshot["hash"] == hash:
+            # Only the modification time changed, a copy for example
+            parts = snapshot["parts"]
         else:
-            return self.__desc["containers"]
+            parts = descriptionmodel.translateCompose(yaml.load(content, Loader=yamlLoader), basePath)
+        self.__writeSnapshot(basePath, {"format":snapshotFormat,"path":basePath,"mtime":info.st_mtime_ns,"size":info.st_size,"hash":hash,"envFiles":self.__getFileStates(basePath, parts["envFiles"]),"parts":parts})
+        return parts
+
+    # Returns the snapshot of a version folder, or None if there is none or the env files it contains have changed
+    def __readSnapshot(self, basePath):
+        try:
+            with open(basePath + snapshotName, "r") as snapshotFile:
+                snapshot = json.loads(snapshotFile.read())
+        except (OSError, ValueError):
+            return None
+        # The parts contain absolute paths, so a copied folder needs a new snapshot
+        if not isinstance(snapshot, dict) or snapshot.get("format") != snapshotFormat or snapshot.get("path") != basePath:
+            return None
+        if snapshot["envFiles"] != self.__getFileStates(basePath, snapshot["parts"]["envFiles"]):
+            return None
+        return snapshot
+
+    # Stores the snapshot of a version folder, a folder which is not writable only costs the speedup
+    def __writeSnapshot(self, basePath, snapshot):
+        try:
+            fs.filesystem.writeAtomic(basePath + snapshotName, json.dumps(snapshot, separators=(",", ":")))
+        except OSError as e:
+            print("Storing the compiled description of " + self.__name + " failed: " + str(e))
+
+    # Returns the modification time and size of the given files in a version folder, None for missing files
+    def __getFileStates(self, basePath, filenames):
+        states = {}
+        for filename in filenames:
+            try:
+                info = os.stat(basePath + filename)
+                states[filename] = [info.st_mtime_ns, info.st_size]
+            except OSError:
+                states[filename] = None
+        return states
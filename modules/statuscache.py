@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - cached status of all installed services
+# © 2021 Johannes Kreutz.
+
+# The status entry of a service is built once and kept until the service publishes an event, a container changes
+# its state or the repository changes. Every entry which changed gets a new revision, so clients can ask for the
+# entries changed since the revision they know. Revisions are handed out as "<epoch>.<revision>" tokens, the epoch is
+# new in every process, so tokens from before a restart are recognized and answered with everything.
+
+# Include dependencies
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Include modules
+import config
+import modules.events as events
+import modules.dockerstate as dockerstate
+import modules.repository as repository
+
+# Class definition
+class statusCache:
+    def __init__(self, services):
+        self.__services = services
+        self.__repo = repository.getRepository()
+        self.__lock = threading.Lock()
+        self.__epoch = uuid.uuid4().hex[:12]
+        self.__revision = 0
+        self.__repoRevision = None
+        # Cached entries by service name: {"revision":<int>,"status":<dict>}, and revisions of removed services
+        self.__entries = {}
+        self.__removed = {}
+        self.__dirty = set()
+        self.__dirtyAll = True
+        events.getEventBus().subscribe(self.__onEvent)
+        dockerstate.getState().subscribe(self.invalidateAll)
+
+    # Marks the entry of a service as outdated
+    def invalidate(self, name):
+        with self.__lock:
+            self.__dirty.add(name)
+
+    # Marks all entries as outdated
+    def invalidateAll(self):
+        with self.__lock:
+            self.__dirtyAll = True
+
+    # Returns the actual revision token and the status entries of all services, in the order they were installed
+    def get(self):
+        self.__refresh()
+        with self.__lock:
+            return self.__getToken(), [self.__entries[name]["status"] for name in self.__services.names() if name in self.__entries]
+
+    # Returns the actual revision token, the status entries changed after the given token, the names of the services
+    # removed since and if the token was unknown. All entries are returned for tokens of another process or invalid ones
+    def getSince(self, token):
+        since = self.__parseToken(token)
+        self.__refresh()
+        with self.__lock:
+            reset = since is None or since > self.__revision
+            if reset:
+                since = 0
+            changed = [self.__entries[name]["status"] for name in self.__services.names() if name in self.__entries and self.__entries[name]["revision"] > since]
+            removed = [name for name, revision in self.__removed.items() if revision > since and not reset]
+            return self.__getToken(), changed, removed, reset
+
+    # PRIVATE HELPER FUNCTIONS
+    # Returns the token of the actual revision, the lock has to be held
+    def __getToken(self):
+        return self.__epoch + "." + str(self.__revision)
+
+    # Returns the revision of a token of this process, or None
+    def __parseToken(self, token):
+        epoch, _, revision = str(token).partition(".")
+        if epoch != self.__epoch or not revision.isdigit():
+            return None
+        return int(revision)
+
+    # Rebuilds the outdated entries, a new entry only gets a new revision if it differs from the cached one
+    def __refresh(self):
+        self.__repo.updateIfRequired()
+        repoRevision = self.__repo.getRevision()
+        services = self.__services.list()
+        with self.__lock:
+            # Without the docker event stream the running state can not be trusted to stay the same
+            if self.__dirtyAll or repoRevision != self.__repoRevision or not dockerstate.getState().isReady():
+                outdated = services
+            else:
+                outdated = [service for service in services if service.getName() in self.__dirty or not service.getName() in self.__entries]
+            self.__dirtyAll = False
+            self.__dirty = set()
+            self.__repoRevision = repoRevision
+            removed = [name for name in self.__entries if not self.__services.contains(name)]
+        if len(outdated) > 1:
+            with ThreadPoolExecutor(max_workers=min(config.statusworkers, len(outdated))) as pool:
+                built = list(pool.map(self.__build, outdated))
+        else:
+            built = [self.__build(service) for service in outdated]
+        with self.__lock:
+            for status in built:
+                entry = self.__entries.get(status["name"])
+                if entry is None or entry["status"] != status:
+                    self.__revision += 1
+                    self.__entries[status["name"]] = {"revision":self.__revision,"status":status}
+                    self.__removed.pop(status["name"], None)
+            for name in removed:
+                if self.__entries.pop(name, None) is not None:
+                    self.__revision += 1
+                    self.__removed[name] = self.__revision
+
+    # Returns the status entry of a single service
+    def __build(self, service):
+        previous = service.hasPrevious()
+        if previous != "":
+            if not self.__repo.isRevertPossible(service.getName(), service.getInstalledVersion()):
+                previous = ""
+        return {
+            "name": service.getName(),
+            "version": service.getInstalledVersion(),
+            "wanted": service.shouldRun(),
+            "status": service.getStatus(),
+            "running": service.isRunning(),
+            "previous": previous,
+            "type": self.__repo.getType(service.getName())
+        }
+
+    # Marks the entry of the service an event belongs to as outdated
+    def __onEvent(self, event):
+        if event["type"] in ["status", "job"] and event.get("service") is not None:
+            self.invalidate(event["service"])
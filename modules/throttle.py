@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - byte rate and operation rate limiter
+# © 2021 Johannes Kreutz.
+
+# Include dependencies
+import threading
+import time
+
+# Class definition
+class throttle:
+    def __init__(self, bytesPerSecond = 0, opsPerSecond = 0):
+        # A limit of 0 means unlimited
+        self.__bytesPerSecond = bytesPerSecond
+        self.__opsPerSecond = opsPerSecond
+        self.__lock = threading.Lock()
+        self.__bytesAllowance = bytesPerSecond
+        self.__opsAllowance = opsPerSecond
+        self.__last = time.monotonic()
+
+    # Returns if any limit is set
+    def isActive(self):
+        return self.__bytesPerSecond > 0 or self.__opsPerSecond > 0
+
+    # Blocks until the given amount of bytes and operations may be processed
+    def consume(self, bytes, ops = 1):
+        if not self.isActive():
+            return
+        with self.__lock:
+            now = time.monotonic()
+            elapsed = now - self.__last
+            self.__last = now
+            delay = 0
+            # Token buckets holding at most one second of allowance, overdrafts are paid back by sleeping
+            if self.__bytesPerSecond > 0:
+                self.__bytesAllowance = min(self.__bytesPerSecond, self.__bytesAllowance + elapsed * self.__bytesPerSecond) - bytes
+                if self.__bytesAllowance < 0:
+                    delay = max(delay, -self.__bytesAllowance / self.__bytesPerSecond)
+            if self.__opsPerSecond > 0:
+                self.__opsAllowance = min(self.__opsPerSecond, self.__opsAllowance + elapsed * self.__opsPerSecond) - ops
+                if self.__opsAllowance < 0:
+                    delay = max(delay, -self.__opsAllowance / self.__opsPerSecond)
+        if delay > 0:
+            time.sleep(delay)
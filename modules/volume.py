@@ -5,28 +5,31 @@
 
 # Include dependencies
 import docker
-from subprocess import Popen
+import threading
 
 # Include modules
 import config
 import modules.filesystem as fs
-
-# Create docker connection
-client = docker.from_env()
+import modules.backupclient as backupclient
+import modules.dockerclient as dockerclient
 
 # Class definition
 class volume:
-    def __init__(self, exists, id, name):
-        if exists:
+    def __init__(self, exists, id, name, labels = None, dockerObject = None):
+        self.__jobLock = threading.Lock()
+        self.__job = None
+        if dockerObject is not None:
+            self.__volume = dockerObject
+        elif exists:
             try:
-                self.__volume = client.volumes.get(volume_id=id)
+                self.__volume = dockerclient.getClient().volumes.get(volume_id=id)
             except docker.errors.NotFound:
                 print("Volume not found. Check inputs.")
             except docker.errors.APIError:
                 print("Volume lookup failed. Check inputs.")
         else:
             try:
-                self.__volume = client.volumes.create(name=name, driver="local")
+                self.__volume = dockerclient.getClient().volumes.create(name=name, driver="local", labels=labels)
             except docker.errors.APIError:
                 print("Volume creation failed. Check inputs.")
 
@@ -39,15 +42,44 @@ class volume:
         return self.__volume.id
 
     # Backups the data content to the given folder. EVERYTING IN THE DESTINATION PATH WILL BE DELETED! WARNING: RUNNING THIS ON A RUNING CONTAINER MIGHT RESULT IN CORRUPTED BACKUPS!
-    def backupContent(self, destPath):
-        backup = Popen(["sudo", "/usr/local/bin/servermanager/volumebackup.py", destPath, self.__volume.name])
-        backup.wait()
+    # Returns the statistics of the backup, rate and iops limit its disk usage (0 is unlimited)
+    def backupContent(self, destPath, rate = 0, iops = 0, progressObject = None):
+        return self.__runBackupJob({"action":"backup","path":destPath,"volume":self.__volume.name,"rate":int(rate),"iops":int(iops)}, progressObject)
 
     # DANGEROUS: Restore a data content backup. RUN THIS ONLY WHEN THE CONTAINER IS PAUSED! RESTORING INTO A RUNNING CONTAINER MIGHT RESULT IN CORRUPTED DATA AND BROKEN SERVICES!
-    def restoreContent(self, sourcePath):
-        restore = Popen(["sudo", "/usr/local/bin/servermanager/volumebackup.py", sourcePath, self.__volume.name, "restore"])
-        restore.wait()
+    def restoreContent(self, sourcePath, rate = 0, iops = 0, progressObject = None):
+        return self.__runBackupJob({"action":"restore","path":sourcePath,"volume":self.__volume.name,"rate":int(rate),"iops":int(iops)}, progressObject)
+
+    # Copies the data content into the volume with the given name. EVERYTHING IN THE TARGET VOLUME WILL BE DELETED!
+    def cloneContent(self, targetName, rate = 0, iops = 0, progressObject = None):
+        return self.__runBackupJob({"action":"clone","volume":self.__volume.name,"target":targetName,"rate":int(rate),"iops":int(iops)}, progressObject)
+
+    # Stores a backup folder of this volume as the given version in the deduplicating backup repository, keeping the newest keep versions
+    def archiveContent(self, sourcePath, version, repository, keep, progressObject = None):
+        return self.__runBackupJob({"action":"archive","path":sourcePath,"volume":self.__volume.name,"version":version,"repository":repository,"keep":keep}, progressObject)
+
+    # DANGEROUS: Restores the given version from the deduplicating backup repository. RUN THIS ONLY WHEN THE CONTAINER IS PAUSED!
+    def restoreArchive(self, version, repository, progressObject = None):
+        return self.__runBackupJob({"action":"restorearchive","version":version,"volume":self.__volume.name,"repository":repository}, progressObject)
+
+    # Cancels the running backup, restore or archive job of this volume
+    def cancelBackupJob(self):
+        with self.__jobLock:
+            if self.__job is not None:
+                self.__job.cancel()
 
     # DANGEROUS: Deletes this volume and its data
     def delete(self):
         self.__volume.remove()
+
+    # PRIVATE HELPER FUNCTIONS
+    # Runs a job on the privileged backup helper and returns the statistics it reports
+    def __runBackupJob(self, job, progressObject):
+        backup = backupclient.backupJob(job, progressObject)
+        with self.__jobLock:
+            self.__job = backup
+        try:
+            return backup.run()
+        finally:
+            with self.__jobLock:
+                self.__job = None
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+
+# SchoolConnect Server-Manager - incremental volume snapshots
+# © 2021 Johannes Kreutz.
+
+# Every snapshot folder <path> comes with a manifest <path>.manifest.json, which lists all entries of the
+# snapshot with type, size, mtime, inode and mode of the file they were taken from. The next snapshot of the
+# same volume hard links every file that did not change since against the previous snapshot, so only changed
+# files are copied.
+# Restoring compares the manifest against the live folder the same way: files still matching their manifest entry
+# are kept, everything else is removed and copied back from the snapshot.
+
+# Include dependencies
+import errno
+import fcntl
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Include modules
+import config
+import modules.filesystem as fs
+from modules.jobcontrol import jobControl
+
+# ioctl request cloning all extents of one file into another (linux/fs.h), supported by btrfs and XFS
+FICLONE = 0x40049409
+
+# Errors telling that the filesystem can not clone at all, as opposed to a single file failing
+cloneUnsupported = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.ENOSYS)
+
+# Copies single files, cloning them copy-on-write while the filesystem supports it
+class fileCopier:
+    def __init__(self, throttleObject = None):
+        self.__reflink = True
+        self.__throttle = throttleObject
+        self.__lock = threading.Lock()
+        self.reflinked = 0
+        self.copied = 0
+
+    # Copies a regular file with its metadata
+    def copy(self, source, target, follow_symlinks = True):
+        if self.__reflink and self.__clone(source, target):
+            if self.__throttle is not None:
+                self.__throttle.consume(0)
+            with self.__lock:
+                self.reflinked += 1
+        else:
+            if self.__throttle is not None and self.__throttle.isActive():
+                self.__copyThrottled(source, target)
+            else:
+                shutil.copy2(source, target, follow_symlinks=False)
+            with self.__lock:
+                self.copied += 1
+        return target
+
+    # Returns which path the copies took: reflink, copy, mixed or none
+    def getMethod(self):
+        if self.reflinked > 0 and self.copied > 0:
+            return "mixed"
+        elif self.reflinked > 0:
+            return "reflink"
+        elif self.copied > 0:
+            return "copy"
+        return "none"
+
+    # Clones a file with the FICLONE ioctl, returns false if the caller has to copy it instead
+    def __clone(self, source, target):
+        try:
+            with open(source, "rb") as sourceFile, open(target, "wb") as targetFile:
+                fcntl.ioctl(targetFile.fileno(), FICLONE, sourceFile.fileno())
+        except OSError as e:
+            if e.errno in cloneUnsupported:
+                self.__reflink = False
+            if os.path.lexists(target):
+                os.remove(target)
+            return False
+        shutil.copystat(source, target, follow_symlinks=False)
+        return True
+
+    # Copies a file block by block, asking the throttle before every block
+    def __copyThrottled(self, source, target):
+        self.__throttle.consume(0)
+        with open(source, "rb") as sourceFile, open(target, "wb") as targetFile:
+            for block in iter(lambda: sourceFile.read(1024 * 1024), b""):
+                self.__throttle.consume(len(block), 0)
+                targetFile.write(block)
+        shutil.copystat(source, target, follow_symlinks=False)
+
+# Runs file copies on a bounded thread pool, limiting the number of queued copies
+class copyPool:
+    def __init__(self, workers):
+        self.__executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.__slots = threading.BoundedSemaphore(max(1, workers) * 4)
+        self.__errors = []
+
+    # Runs the function with the given arguments on the pool
+    def submit(self, function, *args):
+        if self.__executor is None:
+            function(*args)
+            return
+        self.__slots.acquire()
+        future = self.__executor.submit(function, *args)
+        future.add_done_callback(self.__done)
+
+    # Waits for all copies, raising the first error that occurred
+    def finish(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+        if len(self.__errors) > 0:
+            raise self.__errors[0]
+
+    # Waits for the running copies after an error, ignoring their results
+    def abort(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+
+    # Frees the slot of a finished copy and records its error
+    def __done(self, future):
+        self.__slots.release()
+        if future.exception() is not None:
+            self.__errors.append(future.exception())
+
+# Class definition
+class volumeSnapshot:
+    # Returns the manifest path of a snapshot
+    @staticmethod
+    def manifestPath(path):
+        return path.rstrip("/") + ".manifest.json"
+
+    # Reads the manifest of a snapshot, returns None if there is none
+    @staticmethod
+    def readManifest(path):
+        try:
+            with open(volumeSnapshot.manifestPath(path), "r") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    # Returns the newest other snapshot of the given volume in the folder of the destination, or None
+    @staticmethod
+    def findBase(destination, volumeName):
+        folder = os.path.dirname(destination.rstrip("/"))
+        newest = None
+        newestTime = 0
+        if not os.path.isdir(folder):
+            return None
+        for entry in os.scandir(folder):
+            if not entry.name.endswith(".manifest.json"):
+                continue
+            path = entry.path[:-len(".manifest.json")]
+            if path == destination.rstrip("/") or not os.path.isdir(path):
+                continue
+            manifest = volumeSnapshot.readManifest(path)
+            if manifest is not None and manifest.get("volume") == volumeName and manifest.get("created", 0) > newestTime:
+                newest = path
+                newestTime = manifest["created"]
+        return newest
+
+    # Takes a snapshot of the source folder. Unchanged files are hard linked against the base snapshot. Returns statistics
+    # The job control receives the progress and may cancel the backup, which removes the unfinished snapshot
+    @staticmethod
+    def backup(source, destination, volumeName, base = None, workers = None, throttleObject = None, control = None):
+        destination = destination.rstrip("/")
+        baseEntries = {}
+        if base is not None:
+            baseManifest = volumeSnapshot.readManifest(base)
+            if baseManifest is not None:
+                baseEntries = baseManifest["entries"]
+        fs.filesystem.removeElement(destination)
+        fs.filesystem.removeElement(volumeSnapshot.manifestPath(destination))
+        partial = destination + ".partial"
+        fs.filesystem.removeElement(partial)
+        stats = {"files":0,"copied":0,"linked":0,"bytesCopied":0,"bytesLinked":0,"seconds":0}
+        copier = fileCopier(throttleObject)
+        pool = copyPool(config.backupfileworkers if workers is None else workers)
+        control = jobControl() if control is None else control
+        begin = time.monotonic()
+        entries = {}
+        directories = []
+        os.makedirs(partial)
+        try:
+            volumeSnapshot.__scanBackup(source, partial, base, baseEntries, entries, directories, stats, copier, pool, control)
+            pool.finish()
+        except BaseException:
+            pool.abort()
+            fs.filesystem.removeElement(partial)
+            raise
+        # Directory metadata is applied last, creating their content changed their mtimes
+        for sourceDir, targetDir in reversed(directories):
+            shutil.copystat(sourceDir, targetDir, follow_symlinks=False)
+        shutil.copystat(source, partial, follow_symlinks=False)
+        volumeSnapshot.__chown(partial, os.lstat(source))
+        manifest = {"volume":volumeName,"created":time.time(),"base":base,"entries":entries}
+        fs.filesystem.writeAtomic(volumeSnapshot.manifestPath(destination), json.dumps(manifest))
+        os.rename(partial, destination)
+        stats["reflinked"] = copier.reflinked
+        stats["method"] = copier.getMethod()
+        volumeSnapshot.__finishStats(stats, begin)
+        return stats
+
+    # Makes the content of the destination folder equal to the snapshot, cloning files where possible. Returns statistics
+    # Only the differences to the manifest are applied, snapshots without manifest are restored completely
+    # The job control receives the progress and may cancel the restore, which leaves the destination incomplete
+    @staticmethod
+    def restore(snapshot, destination, workers = None, throttleObject = None, control = None):
+        snapshot = snapshot.rstrip("/")
+        destination = destination.rstrip("/")
+        stats = {"files":0,"copied":0,"kept":0,"removed":0,"bytesCopied":0,"bytesKept":0,"seconds":0}
+        copier = fileCopier(throttleObject)
+        pool = copyPool(config.backupfileworkers if workers is None else workers)
+        control = jobControl() if control is None else control
+        begin = time.monotonic()
+        manifest = volumeSnapshot.readManifest(snapshot)
+        directories = []
+        try:
+            if manifest is not None and os.path.isdir(destination):
+                stats["mode"] = "differential"
+                volumeSnapshot.__applyDifferences(snapshot, destination, manifest["entries"], directories, stats, copier, pool, control)
+            else:
+                stats["mode"] = "full"
+                if os.path.exists(destination):
+                    fs.filesystem.emptyFolder(destination)
+                os.makedirs(destination)
+                volumeSnapshot.__scanRestore(snapshot, destination, directories, stats, copier, pool, control)
+            pool.finish()
+        except BaseException:
+            pool.abort()
+            raise
+        for sourceDir, targetDir in reversed(directories):
+            shutil.copystat(sourceDir, targetDir, follow_symlinks=False)
+        shutil.copystat(snapshot, destination, follow_symlinks=False)
+        volumeSnapshot.__chown(destination, os.lstat(snapshot))
+        stats["reflinked"] = copier.reflinked
+        stats["method"] = copier.getMethod()
+        volumeSnapshot.__finishStats(stats, begin)
+        return stats
+
+    # Deletes a snapshot together with its manifest
+    @staticmethod
+    def delete(path):
+        fs.filesystem.removeElement(path.rstrip("/"))
+        fs.filesystem.removeElement(volumeSnapshot.manifestPath(path))
+
+    # PRIVATE HELPER FUNCTIONS
+    # Walks the source folder, linking unchanged files and queueing copies of all others into the partial snapshot
+    @staticmethod
+    def __scanBackup(source, partial, base, baseEntries, entries, directories, stats, copier, pool, control):
+        stack = [""]
+        while len(stack) > 0:
+            relative = stack.pop()
+            control.check()
+            with os.scandir(os.path.join(source, relative)) as iterator:
+                for item in iterator:
+                    itemRelative = os.path.join(relative, item.name)
+                    info = item.stat(follow_symlinks=False)
+                    target = os.path.join(partial, itemRelative)
+                    entry = {"size":info.st_size,"mtime":info.st_mtime_ns,"ino":info.st_ino,"mode":stat.S_IMODE(info.st_mode),"uid":info.st_uid,"gid":info.st_gid}
+                    if stat.S_ISDIR(info.st_mode):
+                        entry["type"] = "d"
+                        os.mkdir(target)
+                        directories.append((item.path, target))
+                        stack.append(itemRelative)
+                    elif stat.S_ISLNK(info.st_mode):
+                        entry["type"] = "l"
+                        entry["target"] = os.readlink(item.path)
+                        os.symlink(entry["target"], target)
+                    elif stat.S_ISREG(info.st_mode):
+                        entry["type"] = "f"
+                        stats["files"] += 1
+                        if volumeSnapshot.__unchanged(baseEntries.get(itemRelative), entry) and volumeSnapshot.__link(os.path.join(base, itemRelative), target):
+                            stats["linked"] += 1
+                            stats["bytesLinked"] += info.st_size
+                            volumeSnapshot.__chown(target, info)
+                            control.advance(1, info.st_size)
+                        else:
+                            pool.submit(volumeSnapshot.__copyFile, copier, item.path, target, info, control)
+                            stats["copied"] += 1
+                            stats["bytesCopied"] += info.st_size
+                    else:
+                        # Sockets, pipes and device nodes are not part of snapshots
+                        continue
+                    if entry["type"] != "f":
+                        volumeSnapshot.__chown(target, info)
+                    entries[itemRelative] = entry
+
+    # Walks the snapshot, recreating folders and links and queueing copies of all files into the destination
+    @staticmethod
+    def __scanRestore(snapshot, destination, directories, stats, copier, pool, control):
+        stack = [""]
+        while len(stack) > 0:
+            relative = stack.pop()
+            control.check()
+            with os.scandir(os.path.join(snapshot, relative)) as iterator:
+                for item in iterator:
+                    itemRelative = os.path.join(relative, item.name)
+                    info = item.stat(follow_symlinks=False)
+                    target = os.path.join(destination, itemRelative)
+                    if stat.S_ISDIR(info.st_mode):
+                        os.mkdir(target)
+                        volumeSnapshot.__chown(target, info)
+                        directories.append((item.path, target))
+                        stack.append(itemRelative)
+                    elif stat.S_ISLNK(info.st_mode):
+                        os.symlink(os.readlink(item.path), target)
+                        volumeSnapshot.__chown(target, info)
+                    elif stat.S_ISREG(info.st_mode):
+                        pool.submit(volumeSnapshot.__copyFile, copier, item.path, target, info, control)
+                        stats["files"] += 1
+                        stats["copied"] += 1
+                        stats["bytesCopied"] += info.st_size
+
+    # Removes everything from the destination that differs from its manifest entry, then restores all missing entries from the snapshot
+    @staticmethod
+    def __applyDifferences(snapshot, destination, entries, directories, stats, copier, pool, control):
+        identical = set()
+        stack = [""]
+        while len(stack) > 0:
+            relative = stack.pop()
+            control.check()
+            with os.scandir(os.path.join(destination, relative)) as iterator:
+                for item in iterator:
+                    itemRelative = os.path.join(relative, item.name)
+                    info = item.stat(follow_symlinks=False)
+                    entry = entries.get(itemRelative)
+                    if entry is not None:
+                        if entry["type"] == "d" and stat.S_ISDIR(info.st_mode):
+                            identical.add(itemRelative)
+                            stack.append(itemRelative)
+                            continue
+                        elif entry["type"] == "l" and stat.S_ISLNK(info.st_mode) and os.readlink(item.path) == entry["target"]:
+                            identical.add(itemRelative)
+                            continue
+                        elif entry["type"] == "f" and stat.S_ISREG(info.st_mode) and volumeSnapshot.__unchanged(entry, {"size":info.st_size,"mtime":info.st_mtime_ns,"ino":info.st_ino,"mode":stat.S_IMODE(info.st_mode),"uid":info.st_uid,"gid":info.st_gid}):
+                            identical.add(itemRelative)
+                            stats["files"] += 1
+                            stats["kept"] += 1
+                            stats["bytesKept"] += info.st_size
+                            control.advance(1, 0)
+                            continue
+                    # Added or changed since the snapshot
+                    if stat.S_ISDIR(info.st_mode):
+                        shutil.rmtree(item.path)
+                    else:
+                        os.remove(item.path)
+                    stats["removed"] += 1
+        # Sorting puts every folder before its content
+        for relative in sorted(entries):
+            source = os.path.join(snapshot, relative)
+            target = os.path.join(destination, relative)
+            if entries[relative]["type"] == "d":
+                directories.append((source, target))
+            if relative in identical:
+                continue
+            control.check()
+            info = os.lstat(source)
+            if stat.S_ISDIR(info.st_mode):
+                os.mkdir(target)
+                volumeSnapshot.__chown(target, info)
+            elif stat.S_ISLNK(info.st_mode):
+                os.symlink(os.readlink(source), target)
+                volumeSnapshot.__chown(target, info)
+            elif stat.S_ISREG(info.st_mode):
+                pool.submit(volumeSnapshot.__copyFile, copier, source, target, info, control)
+                stats["files"] += 1
+                stats["copied"] += 1
+                stats["bytesCopied"] += info.st_size
+        # Kept folders may have got other owners since
+        for source, target in directories:
+            volumeSnapshot.__chown(target, os.lstat(source))
+
+    # Returns if a file is unchanged compared to its entry in the base manifest
+    @staticmethod
+    def __unchanged(baseEntry, entry):
+        if baseEntry is None or baseEntry.get("type") != "f":
+            return False
+        for key in ["size", "mtime", "ino", "mode", "uid", "gid"]:
+            if baseEntry.get(key) != entry[key]:
+                return False
+        return True
+
+    # Hard links a file of the base snapshot, returns false if that is not possible
+    @staticmethod
+    def __link(source, target):
+        try:
+            os.link(source, target)
+            return True
+        except OSError:
+            return False
+
+    # Copies a single file, applies the ownership of the original and counts its progress, runs on the copy pool
+    @staticmethod
+    def __copyFile(copier, source, target, info, control):
+        control.check()
+        copier.copy(source, target)
+        volumeSnapshot.__chown(target, info)
+        control.advance(1, info.st_size)
+
+    # Adds duration and throughput to the statistics
+    @staticmethod
+    def __finishStats(stats, begin):
+        seconds = time.monotonic() - begin
+        stats["seconds"] = round(seconds, 3)
+        stats["bytesPerSecond"] = int(stats["bytesCopied"] / seconds) if seconds > 0 else 0
+
+    # Applies the ownership of the original, which is only possible when running as root
+    @staticmethod
+    def __chown(target, info):
+        if os.geteuid() == 0:
+            os.lchown(target, info.st_uid, info.st_gid)
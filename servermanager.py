@@ -7,7 +7,7 @@
 import sys
 import os
 import json
-from flask import Flask, request
+from flask import Flask, request, Response, stream_with_context
 
 # Include config
 import config
@@ -21,18 +21,28 @@ if not os.path.exists(config.configpath + "repo.txt"):
 import modules.repository as repository
 import modules.service as service
 import modules.network as network
+import modules.dockerstate as dockerstate
+from modules.reconciler import reconciler
 import modules.managerupdate as update
 import modules.essentials as ess
+import modules.filesystem as fs
+import modules.inventory as inventory
+import modules.jobs as jobs
+import modules.events as events
+from modules.registry import serviceRegistry
+from modules.statuscache import statusCache
 from modules.envstore import envman
 
 # Manager objects
-repo = repository.repository()
+repo = repository.getRepository()
 env = envman()
+services = serviceRegistry()
 api = Flask(__name__)
 
 # Variables
-services = []
+deletedServices = set()
 globalNetwork = None
+apiKeyCache = {"signature":None,"token":None}
 
 # First setup
 if len(sys.argv) > 1 and sys.argv[1] == "firstsetup":
@@ -40,17 +50,20 @@ if len(sys.argv) > 1 and sys.argv[1] == "firstsetup":
         print("SchoolConnect Server-Manager seems to be installed already. If you think this is an error, delete the file '.ServerManagerSetupDone' and run this again.")
         sys.exit()
     # Store fixed environment variables
-    env.storeValue("MYSQL_DATABASE", "schoolconnect", "Name der Hauptdatenbank.", False)
-    env.storeValue("MYSQL_USER", "pc_admin_mysql_user", "Nutzername für die Hauptdatenbank.", False)
-    env.storeValue("MYSQL_PASSWORD", ess.essentials.randomString(128), "Interne Zugangskennung für die Hauptdatenbank.", False)
-    #env.storeValue("POSTGRES_DB", "hydra", "Name der Authentifizierungsdatenbank.", False)
-    #env.storeValue("POSTGRES_USER", "hydra_user", "Nutzername für die Authentifizierungsdatenbank.", False)
-    #env.storeValue("POSTGRES_PASSWORD", ess.essentials.randomString(128), "Interne Zugangskennung für die Authentifizierungsdatenbank.", False)
-    #env.storeValue("SECRETS_SYSTEM", ess.essentials.randomString(128), "Sicherheitsschlüssel für Ory Hydra.", False)
-    #env.storeValue("OIDC_SUBJECT_TYPE_PAIRWISE_SALT", ess.essentials.randomString(128), "OpenID Connect Sicherheits-Salt 'pairwise'.", False)
-    env.storeValue("MANAGEMENT_APIS_SHARED_SECRET", ess.essentials.randomString(256), "Shared Secret für Management-APIs.", False)
+    env.storeValues({
+        "MYSQL_DATABASE": {"value":"schoolconnect","description":"Name der Hauptdatenbank.","mutable":False},
+        "MYSQL_USER": {"value":"pc_admin_mysql_user","description":"Nutzername für die Hauptdatenbank.","mutable":False},
+        "MYSQL_PASSWORD": {"value":ess.essentials.randomString(128),"description":"Interne Zugangskennung für die Hauptdatenbank.","mutable":False},
+        #"POSTGRES_DB": {"value":"hydra","description":"Name der Authentifizierungsdatenbank.","mutable":False},
+        #"POSTGRES_USER": {"value":"hydra_user","description":"Nutzername für die Authentifizierungsdatenbank.","mutable":False},
+        #"POSTGRES_PASSWORD": {"value":ess.essentials.randomString(128),"description":"Interne Zugangskennung für die Authentifizierungsdatenbank.","mutable":False},
+        #"SECRETS_SYSTEM": {"value":ess.essentials.randomString(128),"description":"Sicherheitsschlüssel für Ory Hydra.","mutable":False},
+        #"OIDC_SUBJECT_TYPE_PAIRWISE_SALT": {"value":ess.essentials.randomString(128),"description":"OpenID Connect Sicherheits-Salt 'pairwise'.","mutable":False},
+        "MANAGEMENT_APIS_SHARED_SECRET": {"value":ess.essentials.randomString(256),"description":"Shared Secret für Management-APIs.","mutable":False},
+    })
     # Create main network
-    globalNetwork = network.network(False, None, "schoolconnect", False)
+    globalNetwork = network.network(False, None, "schoolconnect", False, inventory.labels("servermanager", config.servermanagerversion, "globalnetwork"))
+    service.service.setGlobalNetwork(globalNetwork)
     mainconfig = open(config.servicepath + "config.json", "w")
     mainconfig.write(json.dumps({"globalNetwork":globalNetwork.getId()}, sort_keys=True, indent=4))
     mainconfig.close()
@@ -65,39 +78,72 @@ if len(sys.argv) > 1 and sys.argv[1] == "firstsetup":
         newService = service.service(essential["name"], True)
         newService.prepareBuild(essential["name"], latestVersion["url"], latestVersion["version"])
         newService.continueInstallation()
-        services.append(newService)
+        services.add(essential["name"], newService)
     sys.exit()
 
 # Normal startup
+# Seed the docker state cache and follow the event stream from now on
+dockerstate.getState()
 # Get main network reference
 mainconfig = open(config.servicepath + "config.json", "r")
 globalNetwork = network.network(True, json.loads(mainconfig.read())["globalNetwork"], None, False)
 mainconfig.close()
-# Check for installed services - create objects
+service.service.setGlobalNetwork(globalNetwork)
+# Removed folders are deleted in the background, leftovers of the last run first
+os.makedirs(config.trashpath, exist_ok=True)
+fs.getTrash()
+# Build contexts live in the artifact cache now, remove what older versions left behind
+fs.filesystem.removeElement(config.servicepath + "buildcache")
+# Check for installed services - create objects and turn them to their wanted state in parallel
+startup = reconciler()
+serviceNames = []
 for filename in os.listdir(config.servicepath):
-    if os.path.isdir(config.servicepath + filename) and "buildcache" not in filename:
-        newService = service.service(filename, False)
-        services.append(newService)
+    if os.path.isdir(config.servicepath + filename) and "buildcache" not in filename and not filename.startswith("."):
+        serviceNames.append(filename)
+for loadedService in startup.run(serviceNames):
+    services.add(loadedService.getName(), loadedService)
+serviceStatus = statusCache(services)
+
+# Deleted services disappear as soon as their deletion has finished
+def onEvent(event):
+    if event["type"] == "status" and event["status"] == "deleted":
+        if services.remove(event["service"]) is not None:
+            deletedServices.add(event["service"])
+events.getEventBus().subscribe(onEvent)
 
 # Helper functions
 # Return the service with the given Name
 def getServiceByName(name):
-    for service in services:
-        if service.getName() == name:
-            return service
-    return False
+    return services.get(name)
 # Returns if a service is installed
 def isInstalled(name):
-    for service in services:
-        if service.getName() == name:
-            return True
-    return False
-# Returns api key
+    return services.contains(name)
+# Returns api key, the file is read again only after it changed
 def getApiKey():
-    apitokenfile = open(config.configpath + config.apitokenfile, "r")
-    token = apitokenfile.read()
-    apitokenfile.close()
-    return token
+    info = os.stat(config.configpath + config.apitokenfile)
+    signature = (info.st_ino, info.st_mtime_ns, info.st_size)
+    if apiKeyCache["signature"] != signature:
+        apitokenfile = open(config.configpath + config.apitokenfile, "r")
+        apiKeyCache["token"] = apitokenfile.read()
+        apitokenfile.close()
+        apiKeyCache["signature"] = signature
+    return apiKeyCache["token"]
+# Waits a bounded time for a job, returns false if it is still queued or running. Such requests answer with the job status and id
+def waitForJob(job):
+    job.wait(config.jobwaittimeout)
+    return job.isFinished()
+# Removes a service from the registry again if its preparation failed or was cancelled, so the installation can be retried
+def removeFailedInstall(name, newService, job):
+    if job.getStatus() in ["failed", "cancelled"]:
+        services.removeIf(name, newService)
+# Returns the event filter and the id of the last event the client has seen from the request
+def getEventRequest(data):
+    since = data.get("since", request.headers.get("Last-Event-ID"))
+    try:
+        since = int(since)
+    except (TypeError, ValueError):
+        since = events.getEventBus().getLastId()
+    return events.createFilter(data.get("service"), data.get("job")), since
 
 # Servermanager update
 def installManagerUpdate(version):
@@ -110,27 +156,24 @@ def index():
     return "Hey there! I'm up and running!"
 
 # STATUS CHECKS
-# Get available containers and their status
+# Get available containers and their status. With since=<revision> only the services changed after that revision are
+# returned, "reset" tells that the revision was unknown and all services are returned. An If-None-Match header with the
+# last ETag is answered with 304 as long as nothing changed
 @api.route("/status", methods=["POST"])
 def getServices():
     data = request.form
     if data.get("apikey") == getApiKey():
-        status = []
-        for service in services:
-            previous = service.hasPrevious()
-            if previous != "":
-                if not repo.isRevertPossible(service.getName(), service.getInstalledVersion()):
-                    previous = ""
-            status.append({
-                "name": service.getName(),
-                "version": service.getInstalledVersion(),
-                "wanted": service.shouldRun(),
-                "status": service.getStatus(),
-                "running": service.isRunning(),
-                "previous": previous,
-                "type": repo.getType(service.getName())
-            })
-        return json.dumps(status)
+        if data.get("since") is not None:
+            revision, changed, removed, reset = serviceStatus.getSince(data.get("since"))
+            etag = '"' + revision + "/" + data.get("since") + '"'
+            payload = {"revision":revision,"changed":changed,"removed":removed,"reset":reset}
+        else:
+            revision, payload = serviceStatus.get()
+            etag = '"' + revision + '"'
+        headers = {"ETag":etag,"X-Status-Revision":revision}
+        if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+            return Response(status=304, headers=headers)
+        return Response(json.dumps(payload), headers=headers)
     else:
         return json.dumps({"error":"ERR_AUTH"})
 
@@ -170,10 +213,12 @@ def controlService():
             return json.dumps({"error":"ERR_SERVICE_NOT_FOUND"})
         else:
             if data.get("action") == "start":
-                service.start()
+                job = service.asyncStart()
             else:
-                service.stop()
-            return json.dumps({"result":service.getStatus()})
+                job = service.asyncStop()
+            if not waitForJob(job):
+                return json.dumps({"result":job.getStatus(),"job":job.getId()})
+            return json.dumps({"result":service.getStatus(),"job":job.getId()})
     else:
         return json.dumps({"error":"ERR_AUTH"})
 
@@ -186,8 +231,15 @@ def installService():
         latestVersion = repo.getLatestAvailable(data.get("service"))
         if latestVersion != None:
             newService = service.service(None, True)
-            services.append(newService)
-            return json.dumps({"result":newService.prepareBuild(data.get("service"), latestVersion["url"], latestVersion["version"])})
+            if not services.add(data.get("service"), newService):
+                return json.dumps({"error":"ERR_SERVICE_INSTALLED"})
+            deletedServices.discard(data.get("service"))
+            job = newService.asyncPrepareBuild(data.get("service"), latestVersion["url"], latestVersion["version"])
+            name = data.get("service")
+            job.onFinish(lambda finishedJob: removeFailedInstall(name, newService, finishedJob))
+            if not waitForJob(job):
+                return json.dumps({"result":job.getStatus(),"job":job.getId()})
+            return json.dumps({"result":job.wait(),"job":job.getId()})
         else:
             return json.dumps({"error":"ERR_SERVICE_NOT_AVAILABLE"})
     else:
@@ -199,7 +251,10 @@ def deleteService():
     if data.get("apikey") == getApiKey():
         service = getServiceByName(data.get("service"))
         if service != False:
-            return json.dumps({"result":service.asyncDelete()})
+            job = service.asyncDelete()
+            if isinstance(job, str):
+                return json.dumps({"result":job})
+            return json.dumps({"result":"running","job":job.getId()})
         else:
             return json.dumps({"error":"ERR_SERVICE_NOT_FOUND"})
     else:
@@ -213,12 +268,15 @@ def executeUpdate():
     if data.get("apikey") == getApiKey():
         service = getServiceByName(data.get("service"))
         if service != False:
-            return json.dumps({"result":service.prepareUpdate(repo.getUrl(data.get("service"), data.get("version")), data.get("version"))})
+            job = service.asyncPrepareUpdate(repo.getUrl(data.get("service"), data.get("version")), data.get("version"))
+            if not waitForJob(job):
+                return json.dumps({"result":job.getStatus(),"job":job.getId()})
+            return json.dumps({"result":job.wait(),"job":job.getId()})
         else:
             return json.dumps({"error":"ERR_SERVICE_NOT_FOUND"})
     else:
         return json.dumps({"error":"ERR_AUTH"})
-# Check the status of a running update
+# Check the status of a running update. Pending services continue on their own, /events pushes the changes instead
 @api.route("/actionstatus", methods=["POST"])
 def checkActionStatus():
     data = request.form
@@ -226,20 +284,15 @@ def checkActionStatus():
         service = getServiceByName(data.get("service"))
         if service != False:
             status = service.getStatus()
-            if status == "updatePending":
-                service.asyncUpdate()
-                return json.dumps({"result":"updating"})
-            elif status == "installPending":
-                service.asyncContinueInstallation()
-                return json.dumps({"result":"installing"})
+            job = service.advance()
+            if job is not None:
+                return json.dumps({"result":"updating" if status == "updatePending" else "installing","job":job.getId()})
             elif status == "installed":
-                service.start()
-                return json.dumps({"result":"installing"})
-            elif status == "deleted":
-                services.remove(service)
-                return json.dumps({"result":"deleted"})
+                return json.dumps({"result":"installing","job":service.asyncStart().getId()})
             else:
-                return json.dumps({"result":status})
+                return json.dumps({"result":status,"progress":service.getProgress()})
+        elif data.get("service") in deletedServices:
+            return json.dumps({"result":"deleted"})
         else:
             return json.dumps({"error":"ERR_SERVICE_NOT_FOUND"})
     else:
@@ -252,7 +305,7 @@ def executeRevert():
         service = getServiceByName(data.get("service"))
         if service != False:
             if repo.isRevertPossible(data.get("service"), service.getInstalledVersion()):
-                return json.dumps({"result":service.asyncRevert()})
+                return json.dumps({"result":"running","job":service.asyncRevert().getId()})
             else:
                 return json.dumps({"error":"ERR_REVERT_NOT_ALLOWED"})
         else:
@@ -281,13 +334,96 @@ def rebuildService():
     if data.get("apikey") == getApiKey():
         service = getServiceByName(data.get("service"))
         if service != False:
-            return json.dumps({"result":service.prepareRebuild()})
+            return json.dumps({"result":"running","job":service.prepareRebuild().getId()})
         else:
             return json.dumps({"error":"ERR_SERVICE_NOT_FOUND"})
     else:
         return json.dumps({"error":"ERR_AUTH"})
 
+# EVENTS
+# Stream status changes, job changes and job progress as server-sent events, optionally of a single service or job
+@api.route("/events", methods=["GET", "POST"])
+def streamEvents():
+    data = request.values
+    if data.get("apikey") == getApiKey():
+        matches, since = getEventRequest(data)
+        # Sends the events as they are published, a comment keeps idle connections open
+        def generate(since):
+            while True:
+                found, missed, lastId = events.getEventBus().wait(since, config.eventtimeout, matches)
+                if missed:
+                    yield "event: reset\ndata: {}\n\n"
+                for event in found:
+                    yield "id: " + str(event["id"]) + "\nevent: " + event["type"] + "\ndata: " + json.dumps(event) + "\n\n"
+                if not missed and len(found) == 0:
+                    yield ": keepalive\n\n"
+                since = lastId
+        return Response(stream_with_context(generate(since)), mimetype="text/event-stream", headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"})
+    else:
+        return json.dumps({"error":"ERR_AUTH"})
+# Long poll for the events after the given id, for clients without server-sent events
+@api.route("/waitevents", methods=["POST"])
+def waitEvents():
+    data = request.form
+    if data.get("apikey") == getApiKey():
+        matches, since = getEventRequest(data)
+        try:
+            timeout = min(float(data.get("timeout", config.eventtimeout)), config.eventtimeout)
+        except ValueError:
+            timeout = config.eventtimeout
+        found, missed, lastId = events.getEventBus().wait(since, timeout, matches)
+        return json.dumps({"result":found,"last":lastId,"missed":missed})
+    else:
+        return json.dumps({"error":"ERR_AUTH"})
+
+# JOBS
+# Get a single job by its id
+@api.route("/job", methods=["POST"])
+def getJob():
+    data = request.form
+    if data.get("apikey") == getApiKey():
+        job = jobs.getJobManager().get(data.get("job"))
+        if job is None:
+            return json.dumps({"error":"ERR_JOB_NOT_FOUND"})
+        return json.dumps({"result":job.toDict()})
+    else:
+        return json.dumps({"error":"ERR_AUTH"})
+# List all known jobs, optionally of a single service
+@api.route("/jobs", methods=["POST"])
+def listJobs():
+    data = request.form
+    if data.get("apikey") == getApiKey():
+        return json.dumps({"result":[job.toDict() for job in jobs.getJobManager().list(data.get("service"))]})
+    else:
+        return json.dumps({"error":"ERR_AUTH"})
+# Cancel a queued or running job
+@api.route("/canceljob", methods=["POST"])
+def cancelJob():
+    data = request.form
+    if data.get("apikey") == getApiKey():
+        if jobs.getJobManager().cancel(data.get("job")):
+            return json.dumps({"result":"cancelling"})
+        return json.dumps({"error":"ERR_JOB_NOT_FOUND"})
+    else:
+        return json.dumps({"error":"ERR_AUTH"})
+
 # SERVERMANAGER CONTROL
+# Load and reconcile durations of all services at startup
+@api.route("/startuptimings", methods=["POST"])
+def startupTimings():
+    data = request.form
+    if data.get("apikey") == getApiKey():
+        return json.dumps({"result":startup.getTimings()})
+    else:
+        return json.dumps({"error":"ERR_AUTH"})
+# Pending and deleted trash of removed folders
+@api.route("/trashstats", methods=["POST"])
+def trashStats():
+    data = request.form
+    if data.get("apikey") == getApiKey():
+        return json.dumps({"result":fs.getTrash().getStats()})
+    else:
+        return json.dumps({"error":"ERR_AUTH"})
 # Servermanager version and available updates
 @api.route("/manager", methods=["POST"])
 def checkManagerVersion():
@@ -304,8 +440,8 @@ def checkManagerVersion():
 def executeManagerUpdate():
     data = request.form
     if data.get("apikey") == getApiKey():
-        update.managerupdate.installUpdate(data.get("version"))
-        return json.dumps({"result":"running"})
+        job = jobs.getJobManager().submit("servermanager", "managerUpdate", lambda job, version: update.managerupdate.installUpdate(version), data.get("version"))
+        return json.dumps({"result":"running","job":job.getId()})
     else:
         return json.dumps({"error":"ERR_AUTH"})
 # Check manager update status
@@ -343,6 +479,7 @@ def setBranch():
                 f.write(json.dumps({"url":"https://philleconnect.org/assets/repository/repository.json", "name":"production"}, sort_keys=True, indent=4))
             elif data.get("branch") == "beta":
                 f.write(json.dumps({"url":"https://philleconnect.org/assets/repository/repository-beta.json", "name":"beta"}, sort_keys=True, indent=4))
+        repo.refreshAsync()
         return json.dumps({"result":"done"})
     else:
         return json.dumps({"error":"ERR_AUTH"})
@@ -354,7 +491,7 @@ def listEnv():
     data = request.form
     if data.get("apikey") == getApiKey():
         main = json.loads(env.getJson())
-        for service in services:
+        for service in services.list():
             localEnv = envman(service.getName())
             data = json.loads(localEnv.getJson())
             for id, content in data.items():
@@ -367,14 +504,24 @@ def listEnv():
 def storeEnv():
     data = request.form
     if data.get("apikey") == getApiKey():
+        globalEntries = {}
+        localEntries = {}
         for key, entry in json.loads(data.get("data")).items():
             if key.startswith("["):
                 parts = key.split("]")
                 serviceName = parts[0][1:]
-                localEnv = envman(serviceName)
-                localEnv.storeValue(parts[1], entry["value"], entry["description"], entry["mutable"])
+                if not serviceName in localEntries:
+                    localEntries[serviceName] = {}
+                localEntries[serviceName][parts[1]] = entry
             else:
-                env.storeValue(key, entry["value"], entry["description"], entry["mutable"])
+                globalEntries[key] = entry
+        env.storeValues(globalEntries)
+        for serviceName, entries in localEntries.items():
+            envman(serviceName).storeValues(entries)
+        # Services waiting for these variables continue now
+        for service in services.list():
+            if len(globalEntries) > 0 or service.getName() in localEntries:
+                service.advance()
         return json.dumps({"result":"SUCCESS"})
     else:
         return json.dumps({"error":"ERR_AUTH"})
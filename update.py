@@ -6,22 +6,15 @@
 # Include dependencies
 import os
 from subprocess import Popen
-from pathlib import Path
 from time import sleep
 
-# Helper function to empty and delete a folder
-def emptyFolder(path, delete):
-    for sub in path.iterdir():
-        if sub.is_dir():
-            emptyFolder(sub, True)
-        else:
-            sub.unlink()
-    if delete:
-        path.rmdir()
+# Include modules
+import modules.filesystem as fs
 
-# Delete old files
+# Delete old files, this script exits right afterwards, so nothing is left to a background reaper
 sleep(5)
-emptyFolder(Path("/usr/local/bin/servermanager/"), False)
+for filename in os.listdir("/usr/local/bin/servermanager/"):
+    fs.filesystem.deleteTree("/usr/local/bin/servermanager/" + filename)
 
 # Move new files in place
 copy = Popen(["cp", "-R", "/var/lib/servermanager/update/.", "/usr/local/bin/servermanager"])
@@ -3,28 +3,60 @@
 # SchoolConnect Server-Manager - container volume data copy script
 # © 2019 - 2020 Johannes Kreutz.
 
+# Runs a single backup job, the backup helper daemon runs the same jobs without starting a process for each.
+# Usage:
+# volumebackup.py <destination> <volume> [--rate=<bytes/s>] [--iops=<ops/s>] [--workers=<n>]: backup
+# volumebackup.py <source> <volume> restore [options]: restore
+# volumebackup.py <path> delete: delete a backup
+# volumebackup.py <source> <volume> archive <version> --repository=<path> [--keep=<n>]: store a version in the deduplicating repository
+# volumebackup.py <version> <volume> restorearchive --repository=<path>: restore a version from the deduplicating repository
+# volumebackup.py <volume> versions --repository=<path>: list the versions of a volume stored in the deduplicating repository
+# volumebackup.py <volume> <target> clone [options]: copy a volume into another volume
+# Backup, restore, clone and archive operations print their statistics as a json object on the last line, versions
+# prints the list of versions the same way.
+
 # Include dependencies
-import shutil
-import os
-from pathlib import Path
+import json
 import sys
 
 # Include modules
+import modules.backupjob as backupjob
 import modules.filesystem as fs
 
-# Main logic
-if len(sys.argv) == 3:
-    if sys.argv[2] == "delete":
-        if not "/var/lib/docker/volumes/" in sys.argv[1]:
-            fs.filesystem.removeElement(sys.argv[1])
-    else:
-        if not os.path.exists(sys.argv[1]) and not os.path.isdir(sys.argv[1]):
-            sys.exit()
-        fs.filesystem.emptyFolder(sys.argv[1])
-        shutil.copytree("/var/lib/docker/volumes/" + sys.argv[2], sys.argv[1] + "/", symlinks=True, ignore=None)
-elif len(sys.argv) == 4:
-    if sys.argv[3] == "restore":
-        fs.filesystem.emptyFolder("/var/lib/docker/volumes/" + sys.argv[2])
-        shutil.copytree(sys.argv[1], "/var/lib/docker/volumes/" + sys.argv[2] + "/", symlinks=True, ignore=None)
+# Split positional arguments and options, numeric options are passed as numbers
+args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+job = {}
+for arg in sys.argv[1:]:
+    if arg.startswith("--") and "=" in arg:
+        key, value = arg[2:].split("=", 1)
+        job[key] = int(value) if value.isdigit() else value
+
+# Build the job from the positional arguments
+if len(args) == 2 and args[1] == "delete":
+    job.update({"action":"delete","path":args[0]})
+elif len(args) == 2 and args[1] == "versions":
+    job.update({"action":"versions","volume":args[0]})
+elif len(args) == 2:
+    job.update({"action":"backup","path":args[0],"volume":args[1]})
+elif len(args) == 3 and args[2] == "restore":
+    job.update({"action":"restore","path":args[0],"volume":args[1]})
+elif len(args) == 3 and args[2] == "clone":
+    job.update({"action":"clone","volume":args[0],"target":args[1]})
+elif len(args) == 3 and args[2] == "restorearchive":
+    job.update({"action":"restorearchive","version":args[0],"volume":args[1]})
+elif len(args) == 4 and args[2] == "archive":
+    job.update({"action":"archive","path":args[0],"volume":args[1],"version":args[3]})
 else:
     print("ERROR: Wrong number of parameters.")
+    sys.exit(1)
+
+# Main logic
+try:
+    stats = backupjob.runJob(job)
+except ValueError as e:
+    print("ERROR: " + str(e))
+    sys.exit(1)
+# Removed folders have to be gone before this process exits
+fs.waitForTrash()
+if job["action"] != "delete":
+    print(json.dumps(stats))